@@ -1,11 +1,16 @@
 # app.py
 # النسخة الجديدة التي تدعم المعالجة غير المتزامنة
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from celery.result import AsyncResult
-from tasks import generate_report_task, celery_app # استيراد المهمة وتطبيق Celery
+# نستورد توقيع المهمة فقط (وحدة خفيفة) لا tasks.py، حتى لا يحمّل خادم الويب مكتبات التعلم الآلي
+from task_signatures import celery_app
+from report_registry import start_or_join_report
+from progress import stream_events
+from stage_store import load_report_articles
 
 app = Flask(__name__)
+MAX_ARTICLES_PAGE = 100
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -22,14 +27,19 @@ def start_task():
     user_query = (data.get('query') or '').strip()
     if not user_query:
         return jsonify({"success": False, "message": "Query parameter is required"}), 400
+    try:
+        period_days = int(data.get('period_days', 14))
+    except (TypeError, ValueError):
+        period_days = 0
+    if not 1 <= period_days <= 365:
+        return jsonify({"success": False, "message": "period_days must be an integer between 1 and 365"}), 400
 
-    # --- بدء المهمة في الخلفية ---
-    # .delay() هي الطريقة التي نضيف بها المهمة إلى الطابور
-    task = generate_report_task.delay(user_query)
+    # --- بدء المهمة في الخلفية، أو الانضمام لتقرير مطابق جارٍ، أو تقديم تقرير مكتمل حديث ---
+    task_id, status = start_or_join_report(user_query, period_days)
 
     # --- الاستجابة الفورية ---
     # نرجع معرّف المهمة إلى التطبيق
-    return jsonify({"success": True, "task_id": task.id}), 202
+    return jsonify({"success": True, "task_id": task_id, "status": status}), 200 if status == 'cached' else 202
 
 
 @app.route('/report_status/<task_id>', methods=['GET'])
@@ -54,10 +64,49 @@ def get_status(task_id):
                 "status": "FAILURE",
                 "error": str(task_result.info) # .info يحتوي على تفاصيل الخطأ
             })
+    elif task_result.state == 'PROGRESS':
+        # المهمة تعمل وقد نشرت تقدمها: المرحلة الحالية والمحاور المكتملة حتى الآن
+        return jsonify({"status": "PROGRESS", "progress": task_result.info})
     else:
-        # إذا كانت المهمة لا تزال قيد التشغيل
+        # إذا كانت المهمة لا تزال في الطابور
         return jsonify({"status": "PENDING"})
 
+@app.route('/report_stream/<task_id>', methods=['GET'])
+def stream_status(task_id):
+    """
+    بث أحداث التقدم (Server-Sent Events): المراحل، كل محور فور اكتماله، وأجزاء نصه أثناء الكتابة.
+    يدعم الاستئناف بعد انقطاع الاتصال عبر ترويسة Last-Event-ID.
+    """
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    start = int(last_id) + 1 if last_id and last_id.isdigit() else 0
+    is_finished = lambda: AsyncResult(task_id, app=celery_app).ready()
+    return Response(
+        stream_events(task_id, start, is_finished),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/report_articles/<task_id>', methods=['GET'])
+def get_articles(task_id):
+    """
+    مقالات التقرير كاملة (مع نصوصها المستخرجة) على صفحات: ?offset=0&limit=20
+    نتيجة /report_status تحمل البيانات الوصفية فقط حتى يبقى كل استعلام حالة صغيرًا.
+    """
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(MAX_ARTICLES_PAGE, max(1, int(request.args.get('limit', 20))))
+    except ValueError:
+        return jsonify({"success": False, "message": "offset and limit must be integers"}), 400
+
+    total, articles = load_report_articles(task_id, offset, limit)
+    return jsonify({
+        "success": True,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "articles": articles
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
 
@@ -0,0 +1,116 @@
+# benchmarks/bench_clustering.py
+# زمن وذاكرة وجودة محرك العنقدة (clusterer.cluster_labels) مقارنة بالتنفيذ القديم
+# (HDBSCAN على متجهات 384 بعدًا خامًا، gen_min_span_tree=True، خيط واحد).
+# الجودة: ARI وNMI مقابل الوسوم الحقيقية، ونسبة ما وُسم ضوضاء.
+# التشغيل من جذر المشروع: python -m benchmarks.bench_clustering [--sizes 500,2000,5000,20000] [--output clustering.json]
+# مجموعة الحقائق المسجلة (fixtures/clustering_facts.json) تُرمّز بالنموذج الحقيقي إن كان متاحًا، وإلا تُتخطى.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from clusterer import cluster_labels, _min_cluster_size
+
+DIM = 384
+REFERENCE_MAX_N = 5000  # التنفيذ القديم يصبح بطيئًا جدًا فوق هذا الحجم
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'clustering_facts.json')
+
+def synthetic_facts(n: int, points_per_topic: int = 60, max_topics: int = 40, noise_ratio: float = 0.1,
+                    seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    محاور حول مراكز عشوائية على الكرة (تشابه داخل المحور ~0.5-0.7 كحقائق حقيقية)،
+    ونسبة noise_ratio متجهات عشوائية لا تنتمي لأي محور (وسمها -1).
+    عدد المحاور يتوقف عند max_topics: المقالات الأكثر تعني حقائق أكثر لكل محور لا محاور بلا حد.
+    """
+    rng = np.random.default_rng(seed)
+    n_noise = int(n * noise_ratio)
+    n_topics = min(max_topics, max(2, (n - n_noise) // points_per_topic))
+    centers = rng.standard_normal((n_topics, DIM))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = rng.integers(0, n_topics, size=n - n_noise)
+    X = centers[labels] + rng.standard_normal((n - n_noise, DIM)) * 0.045
+    X = np.vstack([X, rng.standard_normal((n_noise, DIM))]).astype('float32')
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X, np.concatenate([labels, np.full(n_noise, -1)])
+
+def reference_labels(embeddings: np.ndarray) -> np.ndarray:
+    """نسخة حرفية من الإعداد السابق في cluster_chunks."""
+    import hdbscan
+    clusterer = hdbscan.HDBSCAN(min_cluster_size=_min_cluster_size(), metric='euclidean', gen_min_span_tree=True)
+    clusterer.fit(embeddings)
+    return clusterer.labels_
+
+def quality(true_labels: np.ndarray, predicted: np.ndarray) -> dict:
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+    # الضوضاء الحقيقية خارج المقياس: أي وسم لها مقبول
+    mask = true_labels >= 0
+    return {
+        "ari": round(float(adjusted_rand_score(true_labels[mask], predicted[mask])), 3),
+        "nmi": round(float(normalized_mutual_info_score(true_labels[mask], predicted[mask])), 3),
+        "clusters": int(len(set(predicted.tolist()) - {-1})),
+        "noise_ratio": round(float((predicted == -1).mean()), 3),
+    }
+
+def _timed(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+def _compare(name: str, X: np.ndarray, truth: np.ndarray, with_reference: bool) -> dict:
+    labels, t_new, mem_new = _timed(cluster_labels, X)
+    row = {"set": name, "n": len(X), "engine_seconds": round(t_new, 3), "engine_peak_mb": round(mem_new, 1),
+           "engine": quality(truth, labels)}
+    if with_reference:
+        ref, t_ref, mem_ref = _timed(reference_labels, X)
+        row.update({"reference_seconds": round(t_ref, 3), "reference_peak_mb": round(mem_ref, 1),
+                    "reference": quality(truth, ref), "speedup": round(t_ref / t_new, 1) if t_new else None})
+    print(json.dumps(row, ensure_ascii=False))
+    return row
+
+def run_recorded() -> dict | None:
+    import semantic_searcher
+    from semantic_searcher import embeddings_available, encode_texts
+    semantic_searcher.SERVER_WAIT_SECONDS = 0  # قياس منفرد: لا ننتظر خادمًا لم يُطلق معه
+    if not embeddings_available():
+        print("النموذج غير متاح: تخطي مجموعة الحقائق المسجلة.")
+        return None
+    with open(FIXTURE, encoding='utf-8') as f:
+        facts = json.load(f)['facts']
+    topics = sorted({fact['topic'] for fact in facts})
+    truth = np.array([topics.index(fact['topic']) for fact in facts])
+    X = encode_texts([fact['text'] for fact in facts], normalize=True)
+    return _compare('recorded', X, truth, with_reference=True)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="قياس أداء وجودة محرك العنقدة")
+    parser.add_argument('--sizes', default='500,2000,5000,20000')
+    parser.add_argument('--skip-recorded', action='store_true', help="عدم ترميز مجموعة الحقائق المسجلة")
+    parser.add_argument('--output', help="ملف JSON لحفظ النتائج")
+    args = parser.parse_args()
+
+    # تسخين: استيراد sklearn/hdbscan لا يدخل في زمن أول حجم
+    cluster_labels(synthetic_facts(200)[0])
+    reference_labels(synthetic_facts(200)[0])
+
+    rows = []
+    for n in [int(s) for s in args.sizes.split(',')]:
+        X, truth = synthetic_facts(n)
+        rows.append(_compare('synthetic', X, truth, with_reference=n <= REFERENCE_MAX_N))
+    if not args.skip_recorded:
+        recorded = run_recorded()
+        if recorded:
+            rows.append(recorded)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"benchmark": "clustering", "dim": DIM, "results": rows}, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
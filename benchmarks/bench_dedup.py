@@ -0,0 +1,83 @@
+# benchmarks/bench_dedup.py
+# مقارنة محرك إزالة التكرار بالكتل (greedy_dedup_indices) بالتنفيذ القديم (مصفوفة N×N + حلقة مزدوجة).
+# التشغيل من جذر المشروع: python -m benchmarks.bench_dedup [--sizes 1000,3000,10000,50000] [--output dedup.json]
+
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from deduplicator import greedy_dedup_indices
+
+DIM = 384
+THRESHOLD = 0.9
+REFERENCE_MAX_N = 3000  # التنفيذ القديم تربيعي في الذاكرة وفي حلقة بايثون؛ لا نشغّله فوق هذا الحجم
+
+def synthetic_embeddings(n: int, duplicate_ratio: float = 0.3, seed: int = 0) -> np.ndarray:
+    """متجهات عشوائية مطبّعة، نسبة منها نسخ قريبة (ضوضاء صغيرة) من متجهات سابقة."""
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((n, DIM)).astype('float32')
+    n_dup = int(n * duplicate_ratio)
+    targets = rng.choice(np.arange(1, n), size=n_dup, replace=False)
+    for t in targets:
+        src = rng.integers(0, t)
+        X[t] = X[src] + rng.standard_normal(DIM).astype('float32') * rng.choice([0.05, 0.2, 0.5])
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X
+
+def reference_dedup(embeddings: np.ndarray, threshold: float) -> list[int]:
+    """نسخة حرفية من التنفيذ السابق لـ get_unique_chunk_indices."""
+    from sklearn.metrics.pairwise import cosine_similarity
+    similarity_matrix = cosine_similarity(embeddings)
+    to_keep_indices = []
+    discarded_indices = set()
+    for i in range(len(embeddings)):
+        if i in discarded_indices:
+            continue
+        to_keep_indices.append(i)
+        for j in range(i + 1, len(embeddings)):
+            if similarity_matrix[i, j] > threshold:
+                discarded_indices.add(j)
+    return to_keep_indices
+
+def _timed(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+def run(sizes: list[int]) -> list[dict]:
+    rows = []
+    for n in sizes:
+        X = synthetic_embeddings(n)
+        kept, t_new, mem_new = _timed(greedy_dedup_indices, X, THRESHOLD)
+        row = {"n": n, "kept": len(kept), "blocked_seconds": round(t_new, 4), "blocked_peak_mb": round(mem_new, 1)}
+        if n <= REFERENCE_MAX_N:
+            ref, t_ref, mem_ref = _timed(reference_dedup, X, THRESHOLD)
+            row.update({
+                "reference_seconds": round(t_ref, 4),
+                "reference_peak_mb": round(mem_ref, 1),
+                "identical": ref == kept,
+                "speedup": round(t_ref / t_new, 1) if t_new else None,
+            })
+        rows.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="قياس أداء إزالة التكرار الدلالي")
+    parser.add_argument('--sizes', default='1000,3000,10000,50000')
+    parser.add_argument('--output', help="ملف JSON لحفظ النتائج")
+    args = parser.parse_args()
+    rows = run([int(s) for s in args.sizes.split(',')])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"benchmark": "dedup", "threshold": THRESHOLD, "dim": DIM, "results": rows}, f, indent=2)
+    return 0 if all(r.get('identical', True) for r in rows) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# benchmarks/bench_lexical_dedup.py
+# دقة واستدعاء (precision/recall) مرحلة إزالة التكرار المعجمي على مجموعة مقالات موسومة.
+# التشغيل من جذر المشروع: python -m benchmarks.bench_lexical_dedup [--output lexical.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import combinations
+from deduplicator import find_lexical_duplicate_groups, LEXICAL_THRESHOLD
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'lexical_dedup.json')
+
+def pairwise_scores(true_groups: list[str], predicted: list[int]) -> dict:
+    """مقاييس على مستوى الأزواج: كل زوج في نفس المجموعة الحقيقية هو "تكرار" يجب اكتشافه."""
+    tp = fp = fn = 0
+    for i, j in combinations(range(len(true_groups)), 2):
+        same_true = true_groups[i] == true_groups[j]
+        same_pred = predicted[i] == predicted[j]
+        tp += same_true and same_pred
+        fp += same_pred and not same_true
+        fn += same_true and not same_pred
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    return {"true_positive_pairs": tp, "false_positive_pairs": fp, "false_negative_pairs": fn,
+            "precision": round(precision, 3), "recall": round(recall, 3)}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="دقة واستدعاء إزالة التكرار المعجمي")
+    parser.add_argument('--output', help="ملف JSON لحفظ النتائج")
+    args = parser.parse_args()
+
+    with open(FIXTURE, encoding='utf-8') as f:
+        articles = json.load(f)['articles']
+    start = time.perf_counter()
+    predicted = find_lexical_duplicate_groups(articles)
+    elapsed = time.perf_counter() - start
+
+    result = pairwise_scores([a['group'] for a in articles], predicted)
+    result.update({
+        "benchmark": "lexical_dedup",
+        "articles": len(articles),
+        "true_unique": len({a['group'] for a in articles}),
+        "predicted_unique": len(set(predicted)),
+        "jaccard_threshold": LEXICAL_THRESHOLD,
+        "seconds": round(elapsed, 4),
+    })
+    for i, a in enumerate(articles):
+        if predicted[i] != i:
+            same = "" if articles[predicted[i]]['group'] == a['group'] else "  <-- خطأ"
+            print(f"[{i}] -> [{predicted[i]}] {a['title'][:70]}{same}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
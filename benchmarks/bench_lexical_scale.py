@@ -0,0 +1,115 @@
+# benchmarks/bench_lexical_scale.py
+# زمن وذاكرة find_lexical_duplicate_groups (MinHash LSH في NumPy) على أحجام كبيرة، مقارنةً بالتنفيذ القديم
+# (توقيع MinHash في حلقة بايثون لكل مقطع ولكل تبديل). المقالات من نفس الملف المسجل لـ bench_pipeline.
+# التشغيل من جذر المشروع: python -m benchmarks.bench_lexical_scale [--sizes 1000,5000] [--output lexical_scale.json]
+
+import sys
+import json
+import zlib
+import random
+import argparse
+from itertools import combinations
+from url_utils import canonicalize_url
+from deduplicator import (find_lexical_duplicate_groups, _normalize_for_shingles,
+                          SHINGLE_SIZE, LSH_BANDS, LSH_ROWS, LEXICAL_THRESHOLD)
+from benchmarks.bench_dedup import _timed
+from benchmarks.bench_pipeline import RecordedCorpus, FIXTURE
+
+REFERENCE_MAX_N = 1000  # التنفيذ القديم ~10 ثوانٍ لكل 1000 مقال (أضعافها تحت tracemalloc)؛ لا نشغّله فوق هذا الحجم
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(LSH_BANDS * LSH_ROWS)]
+
+def reference_lexical_groups(articles: list) -> list[int]:
+    """نسخة حرفية من التنفيذ السابق لـ find_lexical_duplicate_groups."""
+    parent = list(range(len(articles)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    by_url = {}
+    shingle_sets = []
+    buckets = {}
+    for i, article in enumerate(articles):
+        url = canonicalize_url(article.get('url') or '')
+        if url in by_url:
+            union(by_url[url], i)
+        elif url:
+            by_url[url] = i
+
+        text = _normalize_for_shingles(article.get('title'), article.get('description'))
+        if len(text) <= SHINGLE_SIZE:
+            shingles = {zlib.crc32(text.encode('utf-8'))} if text else set()
+        else:
+            shingles = {zlib.crc32(text[k:k + SHINGLE_SIZE].encode('utf-8')) for k in range(len(text) - SHINGLE_SIZE + 1)}
+        shingle_sets.append(shingles)
+        if not shingles:
+            continue
+        signature = [min((a * x + b) % _MERSENNE_PRIME for x in shingles) for a, b in _PERMUTATIONS]
+        for band in range(LSH_BANDS):
+            key = (band, tuple(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]))
+            buckets.setdefault(key, []).append(i)
+
+    checked = set()
+    for members in buckets.values():
+        for i, j in combinations(members, 2):
+            if (i, j) in checked:
+                continue
+            checked.add((i, j))
+            si, sj = shingle_sets[i], shingle_sets[j]
+            if len(si & sj) / len(si | sj) >= LEXICAL_THRESHOLD:
+                union(i, j)
+    return [find(i) for i in range(len(articles))]
+
+def _duplicate_pairs(groups: list[int]) -> set:
+    members = {}
+    for i, root in enumerate(groups):
+        members.setdefault(root, []).append(i)
+    return {pair for group in members.values() for pair in combinations(group, 2)}
+
+def run(sizes: list[int]) -> list[dict]:
+    with open(FIXTURE, encoding='utf-8') as f:
+        fixture = json.load(f)
+    rows = []
+    for n in sizes:
+        articles = RecordedCorpus(fixture, n).articles
+        groups, t_new, mem_new = _timed(find_lexical_duplicate_groups, articles)
+        row = {"n": n, "unique": len(set(groups)), "numpy_seconds": round(t_new, 4), "numpy_peak_mb": round(mem_new, 1)}
+        if n <= REFERENCE_MAX_N:
+            ref, t_ref, mem_ref = _timed(reference_lexical_groups, articles)
+            # LSH احتمالي وبذور التجزئة تغيرت: المقارنة على أزواج التكرار لا على تطابق حرفي
+            new_pairs, ref_pairs = _duplicate_pairs(groups), _duplicate_pairs(ref)
+            row.update({
+                "reference_seconds": round(t_ref, 4),
+                "reference_peak_mb": round(mem_ref, 1),
+                "reference_unique": len(set(ref)),
+                "pairs_agreement": round(len(new_pairs & ref_pairs) / max(len(new_pairs | ref_pairs), 1), 3),
+                "speedup": round(t_ref / t_new, 1) if t_new else None,
+            })
+        rows.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="قياس أداء إزالة التكرار المعجمي على أحجام كبيرة")
+    parser.add_argument('--sizes', default='1000,5000')
+    parser.add_argument('--output', help="ملف JSON لحفظ النتائج")
+    args = parser.parse_args()
+    rows = run([int(s) for s in args.sizes.split(',')])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"benchmark": "lexical_scale", "jaccard_threshold": LEXICAL_THRESHOLD, "results": rows}, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+# benchmarks/bench_pipeline.py
+# زمن وذاكرة كل مرحلة من generate_report_task دون شبكة ولا مفاتيح API:
+# ردود NewsAPI وGNews وصفحات HTML تُعاد من fixtures/pipeline_corpus.json، وGemini بديل حتمي
+# (الصياغات ثابتة، الحقائق جمل من نص الأمر نفسه، والكتابة والتجميع بدوال mock_* في llm_summarizer).
+# كل حجم يعمل في عملية مستقلة بمخازن مؤقتة فارغة (تشغيل بارد)، والمراحل تستدعي نفس دوال tasks.py بالترتيب.
+# كلفة البدء (المكتبات الكسولة ومجمّع عمليات الاستخراج) تُقاس منفصلة في startup_seconds لا في أول مرحلة تحتاجها.
+# التشغيل من جذر المشروع:
+#   python -m benchmarks.bench_pipeline [--sizes 60,600,6000] [--encoder auto|model|hashing] [--output pipeline.json]
+#   python -m benchmarks.bench_pipeline --output new.json --baseline pipeline.json [--tolerance 0.25]  (رمز الخروج 1 عند التراجع)
+# المرمّز: النموذج الحقيقي إن كان متاحًا، وإلا ترميز تجزئة حتمي بنفس الأبعاد (الزمن حينها لا يشمل النموذج).
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import threading
+import contextlib
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'pipeline_corpus.json')
+RESULT_MARKER = 'BENCH_PIPELINE_RESULT '
+DIM = 384                    # أبعاد المرمّز البديل = أبعاد النموذج
+DUPLICATE_RATIO = 0.1        # نسبة المقالات المنسوخة حرفيًا من مقال سابق (نشر مشترك بين المواقع)
+TANGENT_PROBABILITY = 0.5    # احتمال أن يحوي المقال فقرات خارج الموضوع (تختبر اختيار المقاطع)
+FACTS_PER_ARTICLE = 3        # حقائق الرد البديل لكل مقال
+NEWSAPI_URL = 'https://newsapi.org/v2/everything'
+GNEWS_URL = 'https://gnews.io/api/v4/search'
+
+# --- المقالات وصفحاتها: تُبنى حتميًا من لبنات الملف المسجل ---
+
+class RecordedCorpus:
+    """
+    n مقال مبني من قوالب الملف المسجل (البذرة = رقم المقال، فنفس الحجم يعطي نفس المقالات دائمًا).
+    respond() يعيد رد المزود أو الصفحة لأي طلب GET كما يعيده الموقع الحقيقي.
+    ردود المزودين غير مقسمة إلى صفحات من 100: المقصود أن يصل n مقال فعلًا إلى المراحل اللاحقة.
+    """
+
+    def __init__(self, fixture: dict, n: int):
+        self.fixture = fixture
+        self.now = datetime.now(timezone.utc)
+        self.articles = [self._article(i) for i in range(n)]
+        self.by_url = {a['url']: i for i, a in enumerate(self.articles)}
+
+    def _fill(self, template: str, rng: random.Random) -> str:
+        fills = self.fixture['fills']
+        number = lambda low, high: f"{rng.uniform(low, high):.2f}".replace('.', '٫')  # فاصلة عشرية عربية
+        return template.format(
+            city=rng.choice(fills['city']), name=rng.choice(fills['name']), month=rng.choice(fills['month']),
+            pct=number(0.2, 9.5), n=rng.randint(2, 90), price=number(60, 95), price2=number(60, 95), price3=number(1, 4),
+        )
+
+    def _lead(self, topic: dict, rng: random.Random) -> str:
+        """جملة افتتاحية من قواعد القالب (موضوع × حركة × سبب × أماكن وأسماء): تميّز كل قصة عن غيرها."""
+        leads = self.fixture['leads']
+        return self._fill(rng.choice(leads['templates']).format(
+            subject=rng.choice(topic['subjects']), move=rng.choice(leads['moves']), reason=rng.choice(leads['reasons']),
+            city='{city}', name='{name}', month='{month}'), rng)
+
+    def _story(self, i: int) -> dict:
+        """العنوان والفقرات (بلا موقع): النسخ المشتركة تعيد قصة مقال سابق كما هي."""
+        rng = random.Random(i)
+        topics = self.fixture['topics']
+        topic = rng.choices(topics, weights=[t['weight'] for t in topics])[0]
+        paragraphs = [
+            '. '.join(self._fill(s, rng) for s in rng.sample(topic['sentences'], 2)) + '.'
+            for _ in range(rng.randint(5, 12))
+        ]
+        # الفقرة الأولى (وهي الوصف) تبدأ بجملة افتتاحية خاصة بالقصة، كما العنوان
+        paragraphs[0] = f"{self._lead(topic, rng)}. {paragraphs[0]}"
+        if rng.random() < TANGENT_PROBABILITY:
+            for tangent in rng.sample(self.fixture['tangents'], rng.randint(1, 2)):
+                paragraphs.insert(rng.randint(1, len(paragraphs)), self._fill(tangent, rng) + '.')
+        return {'topic': topic['name'], 'headline': f"{rng.choice(topic['title'])}: {self._lead(topic, rng)}",
+                'paragraphs': paragraphs}
+
+    def _article(self, i: int) -> dict:
+        rng = random.Random(-1 - i)
+        story = self._story(rng.randrange(i) if i and rng.random() < DUPLICATE_RATIO else i)
+        site = rng.choice(self.fixture['sites'])
+        published = self.now - timedelta(hours=rng.uniform(1, self.fixture['period_days'] * 24 - 1))
+        return {
+            'source': {'id': None, 'name': site['name']},
+            'title': f"{story['headline']} - {site['name']}",
+            'description': story['paragraphs'][0],
+            'url': f"https://www.{site['host']}/{story['topic']}/{published:%Y/%m/%d}/{i}",
+            'urlToImage': None,
+            'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            '_site': site,
+            '_paragraphs': story['paragraphs'],
+        }
+
+    def page_html(self, article: dict) -> str:
+        """صفحة كاملة: تنقل وتذييل الموقع، وأسطر الموقع المتكررة و"اقرأ أيضًا" داخل نص المقال نفسه."""
+        site, paragraphs = article['_site'], list(article['_paragraphs'])
+        paragraphs.insert(len(paragraphs) // 2, site['inline'][0])
+        paragraphs.insert(1, f"اقرأ أيضا: {self.articles[(self.by_url[article['url']] + 1) % len(self.articles)]['title']}")
+        paragraphs.append(site['inline'][1])
+        nav = ''.join(f'<li><a href="/{k}">{item}</a></li>' for k, item in enumerate(site['nav']))
+        body = ''.join(f'<p>{p}</p>' for p in paragraphs)
+        footer = ''.join(f'<p>{line}</p>' for line in site['footer'])
+        return (f'<!DOCTYPE html><html lang="ar" dir="rtl"><head><meta charset="utf-8"><title>{article["title"]} - {site["name"]}</title></head>'
+                f'<body><header><nav><ul>{nav}</ul></nav></header><main><article><h1>{article["title"]}</h1>'
+                f'<time datetime="{article["publishedAt"]}">{article["publishedAt"]}</time>{body}</article></main>'
+                f'<footer>{footer}</footer></body></html>')
+
+    def _public(self, article: dict) -> dict:
+        return {k: v for k, v in article.items() if not k.startswith('_')}
+
+    def respond(self, url: str, params: dict) -> 'ReplayResponse':
+        arabic = [(i, a) for i, a in enumerate(self.articles)] if params.get('language', params.get('lang')) == 'ar' else []
+        if url == NEWSAPI_URL:
+            # q وqInTitle يتداخلان في ثلث المقالات، كما يتداخل البحث العام مع البحث في العنوان
+            keep = (lambda i: i % 3 != 2) if 'q' in params else (lambda i: i % 3 != 0)
+            found = [dict(self._public(a), content=a['description'][:200]) for i, a in arabic if keep(i)]
+            return ReplayResponse.json_body({'status': 'ok', 'totalResults': len(found), 'articles': found})
+        if url == GNEWS_URL:
+            found = [{'title': a['title'], 'description': a['description'], 'content': a['description'][:200],
+                      'url': a['url'], 'image': None, 'publishedAt': a['publishedAt'],
+                      'source': {'name': a['source']['name'], 'url': f"https://www.{a['_site']['host']}"}}
+                     for i, a in arabic if i % 4 == 0]
+            return ReplayResponse.json_body({'totalArticles': len(found), 'articles': found})
+        if url in self.by_url:
+            return ReplayResponse(200, self.page_html(self.articles[self.by_url[url]]).encode('utf-8'),
+                                  {'Content-Type': 'text/html; charset=utf-8'})
+        return ReplayResponse(404, b'not found', {'Content-Type': 'text/plain'})
+
+class ReplayResponse:
+    """الحد الأدنى من requests.Response الذي يستخدمه search_service وcontent_extractor."""
+
+    def __init__(self, status_code: int, content: bytes, headers: dict):
+        self.status_code, self.content, self.headers = status_code, content, headers
+
+    @classmethod
+    def json_body(cls, body: dict) -> 'ReplayResponse':
+        return cls(200, json.dumps(body, ensure_ascii=False).encode('utf-8'), {'Content-Type': 'application/json'})
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 65536):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class ReplaySession:
+    def __init__(self, corpus: RecordedCorpus):
+        self.corpus = corpus
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False):
+        return self.corpus.respond(url, params or {})
+
+# --- Gemini بديل حتمي ---
+
+class StandInModel:
+    """
+    يرد على الأوامر التي يرسلها المشروع فعلًا: الترجمة والتوسع والتبسيط بصياغات ثابتة،
+    واستخلاص الحقائق (المفرد والدفعات) بأول جمل كل مقال في الأمر نفسه بالصيغة التي يحللها llm_summarizer.
+    """
+
+    def __init__(self, fixture: dict, prompts: dict):
+        self.fixture = fixture
+        self.single = prompts.get('fact_extraction_prompt', '').split('{context}')
+        self.batch = prompts.get('batch_fact_extraction_prompt', '').split('{context}')
+
+    @staticmethod
+    def _context(prompt: str, template: list[str]) -> str | None:
+        if len(template) != 2 or not prompt.startswith(template[0]):
+            return None
+        return prompt[len(template[0]):len(prompt) - len(template[1])]
+
+    @staticmethod
+    def _facts(text: str) -> list[str]:
+        sentences = [s.strip() for s in re.split(r'\.\s+|\n', text) if len(s.split()) >= 8]
+        return [s.rstrip('.') + '.' for s in sentences[:FACTS_PER_ARTICLE]]
+
+    def generate_content(self, prompt: str, **kwargs):
+        batch = self._context(prompt, self.batch)
+        if batch is not None:
+            blocks = re.split(r'(?m)^\[(\d+)\] ', batch)
+            lines = [f"[{article_id}] {fact}" for article_id, block in zip(blocks[1::2], blocks[2::2])
+                     for fact in self._facts(block.split('\n', 1)[-1])]
+            return StandInResponse('\n'.join(lines))
+        single = self._context(prompt, self.single)
+        if single is not None:
+            return StandInResponse('\n'.join(self._facts(single)))
+        if prompt.startswith('Translate'):
+            return StandInResponse(self.fixture['english_query'])
+        return StandInResponse(f'"{self.fixture["query"]}" OR "{self.fixture["english_query"]}"')
+
+class StandInResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class StandInGenAI:
+    def __init__(self, model: StandInModel):
+        self.model = model
+
+    def configure(self, api_key=None):
+        return None
+
+    def GenerativeModel(self, name):
+        return self.model
+
+def hashing_encode(texts: list[str], normalize: bool) -> 'np.ndarray':
+    """ترميز تجزئة حتمي (كلمة -> بعد وإشارة): يحفظ تشابه النصوص المشتركة في كلماتها دون أي نموذج."""
+    import numpy as np
+    out = np.zeros((len(texts), DIM), dtype='float32')
+    for row, text in enumerate(texts):
+        for token in text.split():
+            h = zlib.crc32(token.encode('utf-8'))
+            out[row, h % DIM] += 1.0 if (h >> 16) & 1 else -1.0
+    if normalize:
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+    return out
+
+# --- تشغيل حجم واحد (داخل عملية مستقلة) ---
+
+def _rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+
+class RssSampler(threading.Thread):
+    """
+    ذروة الذاكرة المقيمة (RSS) للعملية أثناء مرحلة، بعينة كل interval ثانية.
+    بديل tracemalloc هنا لأنه يبطئ الحلقات البايثونية أضعافًا فيفسد قياس الزمن نفسه.
+    ذاكرة عمليات الاستخراج الأبناء خارج القياس.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_mb = self.peak_mb = _rss_mb()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _rss_mb())
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.peak_mb = max(self.peak_mb, _rss_mb())
+
+def _measure(name: str, fn, rows: list) -> object:
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    rows.append({"stage": name, "seconds": round(elapsed, 3), "rss_peak_mb": round(sampler.peak_mb, 1),
+                 "rss_growth_mb": round(sampler.peak_mb - sampler.start_mb, 1)})
+    return result
+
+def run_size(n: int, encoder: str, verbose: bool = False) -> dict:
+    """المراحل بترتيب generate_report_task، بنفس الدوال التي تستدعيها مراحل tasks.py."""
+    from settings import SETTINGS
+    with open(FIXTURE, encoding='utf-8') as f:
+        fixture = json.load(f)
+    # مخازن باردة لهذه العملية فقط، ومفاتيح وهمية حتى لا تتخطى الوحدات استدعاءات المزودين
+    cache_dir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    SETTINGS.setdefault('cache', {})['directory'] = cache_dir
+    providers = SETTINGS.setdefault('search_providers', {})
+    for name, base_url in (('newsapi', NEWSAPI_URL), ('gnews', GNEWS_URL), ('google_gemini', None)):
+        providers.setdefault(name, {})['api_key'] = 'bench'
+        if base_url:
+            providers[name]['base_url'] = base_url
+
+    import numpy as np
+    import search_service
+    import content_extractor
+    import query_builder
+    import llm_summarizer
+    import semantic_searcher
+    import deduplicator
+    import corpus_index
+    from text_processor import clean_articles
+    from clusterer import cluster_topics
+
+    corpus = RecordedCorpus(fixture, n)
+    session = ReplaySession(corpus)
+    search_service._get_session = lambda: session
+    content_extractor._get_session = lambda: session
+    # بحث بلا حدود التنويع والقص: الحجم المطلوب كله يصل إلى المراحل التالية
+    search_service.MIN_RESULTS = search_service.MAX_RESULTS = search_service.PER_DOMAIN_CAP = n
+
+    genai = StandInGenAI(StandInModel(fixture, SETTINGS.get('llm_prompts', {})))
+    direct = lambda model, prompt, **kwargs: model.generate_content(prompt, **kwargs)
+    for module in (llm_summarizer, query_builder):
+        module.load_genai = lambda: genai
+        module.rate_limited_generate = direct
+
+    if encoder == 'auto':
+        semantic_searcher.SERVER_WAIT_SECONDS = 0  # قياس منفرد: لا ننتظر خادمًا لم يُطلق معه
+        encoder = 'model' if semantic_searcher.embeddings_available() else 'hashing'
+    if encoder == 'hashing':
+        semantic_searcher._encode_uncached = hashing_encode
+        semantic_searcher.embeddings_available = deduplicator.embeddings_available = lambda: True
+
+    query, period_days = fixture['query'], fixture['period_days']
+    rows, counts = [], {}
+    output = sys.stdout if verbose else open(os.devnull, 'w')
+    with contextlib.redirect_stdout(output):
+        def startup():
+            # كلفة تُدفع مرة لكل عامل لا لكل تقرير: المكتبات الكسولة ومجمّع عمليات الاستخراج
+            import faiss, hdbscan, sklearn.decomposition, sklearn.cluster  # noqa: F401
+            pool = content_extractor._get_process_pool()
+            pool.submit(content_extractor.extract_text, '<html><body><p>warm up</p></body></html>').result()
+        _measure('startup', startup, rows)
+
+        def search():
+            found = search_service.fetch_articles_from_all_providers(query, period_days)['articles']
+            counts['search'] = len(found)
+            return deduplicator.deduplicate_articles_lexical(deduplicator.deduplicate_articles_simple(found))
+        articles = _measure('search', search, rows)
+
+        def extract():
+            return list(clean_articles(content_extractor.process_articles_in_parallel(articles)))
+        articles = _measure('extraction', extract, rows)
+
+        def dedup():
+            unique = deduplicator.deduplicate_articles_semantic(articles)
+            corpus_index.index_articles(unique)
+            return unique
+        unique_articles = _measure('dedup', dedup, rows)
+
+        def facts():
+            found = llm_summarizer.extract_key_facts_with_sources(unique_articles, query)
+            known, known_articles = corpus_index.known_facts(query, period_days, [a.get('url') for a in unique_articles])
+            return found + known, known_articles
+        all_facts, known_articles = _measure('facts', facts, rows)
+
+        embeddings = _measure('embedding', lambda: corpus_index.fact_embeddings(all_facts, unique_articles), rows)
+
+        def clustering():
+            selected, selected_embeddings = semantic_searcher.find_relevant_chunks(query, all_facts, embeddings)
+            keep = deduplicator.get_unique_chunk_indices(selected, selected_embeddings)
+            topics = cluster_topics([selected[i] for i in keep], np.array([selected_embeddings[i] for i in keep]))
+            used_urls = sorted({fact['source_url'] for topic in topics for fact in topic['facts'] if fact.get('source_url')})
+            return topics, {url: i + 1 for i, url in enumerate(used_urls)}
+        topics, reference_map = _measure('clustering', clustering, rows)
+
+        def writing():
+            written = {topic['title']: llm_summarizer.mock_write_topic_content(
+                           topic['title'], llm_summarizer.budget_topic_facts(topic['facts'], reference_map), reference_map)
+                       for topic in topics}
+            body = llm_summarizer.mock_assemble_final_report(query, written)
+            cited = [a for a in unique_articles + known_articles if a.get('url') in reference_map]
+            return body + llm_summarizer.format_references(cited, reference_map)
+        report = _measure('writing', writing, rows)
+
+    items = {'startup': 0, 'search': counts['search'], 'extraction': sum(1 for a in articles if a.get('content')),
+             'dedup': len(unique_articles), 'facts': len(all_facts), 'embedding': len(embeddings),
+             'clustering': len(topics), 'writing': len(topics)}
+    for row in rows:
+        row['items'] = items[row['stage']]
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    stages = [r for r in rows if r['stage'] != 'startup']
+    return {"n": n, "encoder": encoder, "startup_seconds": rows[0]['seconds'],
+            "total_seconds": round(sum(r['seconds'] for r in stages), 3), "stages": stages}
+
+# --- المنسّق: عملية لكل حجم، ثم المقارنة بخط الأساس ---
+
+def _run_child(n: int, encoder: str) -> dict:
+    proc = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', '--child', str(n), '--encoder', encoder],
+                          cwd=ROOT, capture_output=True, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return {"n": n, "error": (proc.stderr or proc.stdout).strip().splitlines()[-20:]}
+
+def find_regressions(results: list[dict], baseline: dict, tolerance: float, min_seconds: float = 0.25) -> list[dict]:
+    """مرحلة أبطأ من خط الأساس بأكثر من tolerance (ومن min_seconds مطلقًا، فتذبذب المراحل السريعة لا يُحسب)."""
+    base = {(r['n'], s['stage']): s['seconds'] for r in baseline.get('results', []) for s in r.get('stages', [])}
+    regressions = []
+    for result in results:
+        for stage in result.get('stages', []):
+            old = base.get((result['n'], stage['stage']))
+            if old is not None and stage['seconds'] > old * (1 + tolerance) and stage['seconds'] - old > min_seconds:
+                regressions.append({"n": result['n'], "stage": stage['stage'], "baseline_seconds": old,
+                                    "seconds": stage['seconds'], "ratio": round(stage['seconds'] / old, 2) if old else None})
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="قياس زمن وذاكرة مراحل توليد التقرير دون شبكة")
+    parser.add_argument('--sizes', default='60,600,6000')
+    parser.add_argument('--encoder', choices=['auto', 'model', 'hashing'], default='auto')
+    parser.add_argument('--output', help="ملف JSON لحفظ النتائج")
+    parser.add_argument('--baseline', help="نتائج سابقة (JSON) للمقارنة؛ رمز الخروج 1 عند أي تراجع")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="نسبة التباطؤ المسموحة لكل مرحلة")
+    parser.add_argument('--min-seconds', type=float, default=0.25, help="فرق زمني مطلق لا يُعد دونه تراجعًا (تذبذب القياس)")
+    parser.add_argument('--verbose', action='store_true', help="إظهار مخرجات الوحدات أثناء التشغيل")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_size(args.child, args.encoder, args.verbose)
+        print(RESULT_MARKER + json.dumps(result, ensure_ascii=False), flush=True)
+        return 0
+
+    results = []
+    for n in [int(s) for s in args.sizes.split(',')]:
+        result = _run_child(n, args.encoder)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance, args.min_seconds)
+        for r in regressions:
+            print(f"تراجع: {r['stage']} عند {r['n']} مقال: {r['baseline_seconds']}s ← {r['seconds']}s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"benchmark": "pipeline", "fixture": os.path.basename(FIXTURE), "results": results,
+                       "regressions": regressions}, f, indent=2, ensure_ascii=False)
+    failed = any('error' in r for r in results)
+    return 1 if failed or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# cache_store.py
+# مخزن مؤقت دائم على القرص المحلي (SQLite) مع مدة صلاحية (TTL) وإخلاء حسب الحجم (LRU).
+# الملف مشترك بين كل عمليات العمال على نفس الجهاز، ويبقى بعد إعادة تشغيلها.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from settings import SETTINGS
+
+def cache_directory() -> str:
+    """يعيد مجلد التخزين المؤقت من config.yaml وينشئه عند الحاجة."""
+    path = SETTINGS.get('cache', {}).get('directory', '.cache')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class PersistentCache:
+    """
+    مخزن مفتاح/قيمة (قيم JSON) في ملف SQLite.
+    - كل مدخل له تاريخ انتهاء، والمدخلات المنتهية لا تُعاد.
+    - عند تجاوز الحجم الكلي لـ max_bytes تُحذف الأقدم استخدامًا أولًا (LRU).
+    - أي خطأ في المخزن يُعامل كـ miss ولا يوقف العمل الأساسي.
+    """
+
+    EVICT_EVERY_WRITES = 50  # فحص الحجم مرة كل عدد من عمليات الكتابة
+
+    def __init__(self, name: str, ttl_seconds: int, max_bytes: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.path = os.path.join(cache_directory(), f"{name}.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes_since_evict = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """يبني مفتاحًا ثابتًا من أي مجموعة قيم قابلة للتحويل إلى JSON."""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # اتصال جديد بعد fork (عمال Celery) لأن اتصالات SQLite لا تُورّث بأمان
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                'expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)')
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str, default=None):
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+                if row is None or row[1] < now:
+                    self.misses += 1
+                    return default
+                conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+                self.hits += 1
+            return json.loads(row[0])
+        except Exception as e:
+            print(f"تحذير: تعذرت القراءة من المخزن المؤقت '{self.name}': {e}")
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value, ttl_seconds: int | None = None) -> None:
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        try:
+            blob = json.dumps(value, ensure_ascii=False).encode('utf-8')
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, len(blob), now + ttl, now)
+                )
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= self.EVICT_EVERY_WRITES:
+                    self._writes_since_evict = 0
+                    self._evict(conn, now)
+        except Exception as e:
+            print(f"تحذير: تعذرت الكتابة في المخزن المؤقت '{self.name}': {e}")
+
+    def update(self, key: str, fn, default=None):
+        """
+        قراءة-تعديل-كتابة ذرّية بين العمليات: BEGIN IMMEDIATE يحجز قفل الكتابة في SQLite قبل القراءة،
+        فلا تكتب عمليتان فوق تحديث بعضهما لنفس المفتاح. fn تستقبل القيمة الحالية (أو default)
+        وتعيد القيمة الجديدة، أو None لترك المدخل كما هو. تعيد القيمة بعد التحديث.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    row = conn.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+                    current = json.loads(row[0]) if row is not None and row[1] >= now else default
+                    value = fn(current)
+                    if value is not None:
+                        blob = json.dumps(value, ensure_ascii=False).encode('utf-8')
+                        conn.execute(
+                            'INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)',
+                            (key, blob, len(blob), now + self.ttl_seconds, now)
+                        )
+                        self._writes_since_evict += 1
+                        if self._writes_since_evict >= self.EVICT_EVERY_WRITES:
+                            self._writes_since_evict = 0
+                            self._evict(conn, now)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            return current if value is None else value
+        except Exception as e:
+            print(f"تحذير: تعذر تحديث المخزن المؤقت '{self.name}': {e}")
+            return default
+
+    def delete(self, key: str) -> None:
+        try:
+            with self._lock:
+                self._connection().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except Exception as e:
+            print(f"تحذير: تعذر الحذف من المخزن المؤقت '{self.name}': {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute('DELETE FROM entries WHERE expires_at < ?', (now,))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # نحذف الأقدم استخدامًا حتى نعود إلى 90% من الحد لتجنب الإخلاء مع كل كتابة
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY last_access ASC'):
+            if total - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+        print(f"المخزن المؤقت '{self.name}': تم إخلاء {len(victims)} مدخل ({freed} بايت).")
+
+    def stats(self) -> dict:
+        entries, size = 0, 0
+        try:
+            with self._lock:
+                entries, size = self._connection().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+                ).fetchone()
+        except Exception:
+            pass
+        return {"name": self.name, "hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
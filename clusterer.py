@@ -1,72 +1,137 @@
 # clusterer.py
-# هذا الملف مسؤول عن تجميع المقاطع النصية في محاور موضوعية باستخدام HDBSCAN.
+# هذا الملف مسؤول عن تجميع المقاطع النصية في محاور موضوعية.
+# المحرك: خفض الأبعاد أولًا (PCA، أو UMAP اختياريًا)، ثم HDBSCAN في الفضاء المخفَّض مع حساب
+# مسافات النواة على كل الأنوية؛ وفوق حد الحجم يتحول تلقائيًا إلى MiniBatchKMeans (خطي في العدد).
 
-import hdbscan
+import time
 import numpy as np
 from settings import SETTINGS # استيراد الإعدادات
 
-def cluster_chunks(chunks: list[dict], embeddings: np.ndarray) -> dict:
+_clustering_cfg = SETTINGS.get('processing', {}).get('clustering', {})
+REDUCER = _clustering_cfg.get('reducer', 'pca')             # pca | umap | none
+REDUCED_DIM = _clustering_cfg.get('reduced_dim', 32)
+LARGE_THRESHOLD = _clustering_cfg.get('large_threshold', 5000)  # فوقه: MiniBatchKMeans بدل HDBSCAN
+N_JOBS = _clustering_cfg.get('n_jobs', -1)                  # -1 = كل الأنوية لحساب مسافات النواة
+KMEANS_POINTS_PER_TOPIC = _clustering_cfg.get('kmeans_points_per_topic', 100)
+MAX_TOPICS = _clustering_cfg.get('max_topics', 50)
+
+def _min_cluster_size() -> int:
+    # لا يمكن أن يكون حجم العنقود أصغر من 2
+    return max(2, _clustering_cfg.get('min_cluster_size', 2))
+
+def reduce_dimensions(embeddings: np.ndarray, n_components: int = REDUCED_DIM, reducer: str = REDUCER) -> np.ndarray:
     """
-    تستقبل قائمة من المقاطع ومتجهاتها، وتقوم بعنقَدتها إلى محاور.
-    --- محدث: يتعامل الآن مع حالة عدم العثور على أي عنقود ---
+    المتجهات تُطبّع (فالمسافة الإقليدية تتبع جيب التمام) ثم تُخفَّض إلى n_components.
+    HDBSCAN وk-means أسرع بكثير وأقل ذاكرة في 32 بعدًا منها في 384، ومسافات الأبعاد العالية أقل تمييزًا أصلًا.
     """
-    # اقرأ الحد الأدنى لحجم العنقود من ملف الإعدادات
-    min_cluster_size_from_config = SETTINGS.get('processing', {}).get('clustering', {}).get('min_cluster_size', 2)
+    X = np.asarray(embeddings, dtype='float32')
+    X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    n_components = min(n_components, X.shape[1], len(X) - 1)
+    if reducer == 'none' or n_components < 2 or n_components >= X.shape[1]:
+        return X
+    if reducer == 'umap':
+        try:
+            import umap
+            return umap.UMAP(n_components=n_components, metric='cosine', n_neighbors=min(15, len(X) - 1),
+                             random_state=0).fit_transform(X).astype('float32')
+        except ImportError:
+            print("تحذير: مكتبة umap-learn غير مثبتة؛ سيُستخدم PCA.")
+    from sklearn.decomposition import PCA
+    return PCA(n_components=n_components, svd_solver='randomized', random_state=0).fit_transform(X).astype('float32')
 
-    # لا يمكن أن يكون حجم العنقود أصغر من 2
-    min_cluster_size = max(2, min_cluster_size_from_config)
+def cluster_labels(embeddings: np.ndarray, min_cluster_size: int | None = None) -> np.ndarray:
+    """وسم عنقود لكل متجه (-1 = ضوضاء)، باختيار الخوارزمية حسب الحجم."""
+    min_cluster_size = min_cluster_size or _min_cluster_size()
+    n = len(embeddings)
+    started = time.perf_counter()
+    reduced = reduce_dimensions(embeddings)
+
+    if n <= LARGE_THRESHOLD:
+        # إعداد خوارزمية HDBSCAN (استيراد كسول: المكتبة ثقيلة ولا يحتاجها إلا العامل)
+        import hdbscan
+        labels = hdbscan.HDBSCAN(
+            min_cluster_size=min_cluster_size,
+            metric='euclidean',
+            core_dist_n_jobs=N_JOBS,
+        ).fit_predict(reduced)
+        method = 'hdbscan'
+    else:
+        from sklearn.cluster import MiniBatchKMeans
+        k = int(min(MAX_TOPICS, max(2, n // KMEANS_POINTS_PER_TOPIC)))
+        labels = MiniBatchKMeans(n_clusters=k, batch_size=2048, n_init=3, random_state=0).fit_predict(reduced)
+        # عناقيد k-means الأصغر من الحد الأدنى تُعامل كضوضاء مثل HDBSCAN
+        sizes = np.bincount(labels, minlength=k)
+        labels = np.where(sizes[labels] >= min_cluster_size, labels, -1)
+        method = f'minibatch-kmeans(k={k})'
+
+    print(f"العنقدة: {method} على {n} متجه في {reduced.shape[1]} بعدًا ({time.perf_counter() - started:.2f}s).")
+    return labels
+
+def centroid_order(embeddings: np.ndarray, members: list[int]) -> tuple[np.ndarray, list[int], list[float]]:
+    """مركز العنقود (متوسط المتجهات المطبّعة) وأعضاؤه مرتبين بالأقرب إليه (تشابه جيب التمام)."""
+    X = np.asarray(embeddings, dtype='float32')[members]
+    X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    centroid = X.mean(axis=0)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+    similarities = X @ centroid
+    order = np.argsort(-similarities, kind='stable')
+    return centroid, [members[j] for j in order], [float(similarities[j]) for j in order]
+
+def exemplar_title(text: str, used_titles: set) -> str:
+    """عنوان وصفي من نص الحقيقة الممثلة (حتى أول فاصلة أو نقطة)، بلاحقة رقمية إن سبق استخدامه."""
+    title = text.split('،')[0].split('.')[0].strip()
+    candidate, count = title, 2
+    while candidate in used_titles:
+        candidate = f"{title} ({count})"
+        count += 1
+    used_titles.add(candidate)
+    return candidate
+
+def cluster_topics(chunks: list[dict], embeddings: np.ndarray) -> list[dict]:
+    """
+    تستقبل قائمة من المقاطع ومتجهاتها، وتقوم بعنقَدتها إلى محاور.
+    كل محور: {title, facts, centroid, similarities} — الحقائق مرتبة بالأقرب إلى مركز العنقود أولًا،
+    والعنوان مأخوذ من الحقيقة الممثلة (الأقرب إلى المركز) لا من أول حقيقة صادفها العنقود.
+    """
+    min_cluster_size = _min_cluster_size()
     
     # إذا كان عدد المقاطع أقل من الحد الأدنى المطلوب، فضعها كلها في محور واحد
     if len(chunks) < min_cluster_size:
         print(f"عدد المقاطع ({len(chunks)}) أقل من الحد الأدنى للعنقدة ({min_cluster_size}). سيتم دمجها في محور واحد.")
-        return {"المحور الرئيسي": chunks}
+        centroid, order, similarities = centroid_order(embeddings, list(range(len(chunks))))
+        return [{"title": "المحور الرئيسي", "facts": [chunks[i] for i in order],
+                 "centroid": centroid, "similarities": similarities}]
 
-    # إعداد خوارزمية HDBSCAN
-    clusterer = hdbscan.HDBSCAN(
-        min_cluster_size=min_cluster_size, 
-        metric='euclidean', 
-        gen_min_span_tree=True
-    )
-    
-    clusterer.fit(embeddings)
+    labels = cluster_labels(embeddings, min_cluster_size)
     
-    num_clusters = len(set(clusterer.labels_)) - (1 if -1 in clusterer.labels_ else 0)
+    num_clusters = len(set(labels)) - (1 if -1 in labels else 0)
     print(f"تم اكتشاف {num_clusters} محور/عنقود.")
 
     clustered_data = {}
-    noise_chunks = [] # قائمة لتخزين المقاطع التي لم تنتمِ لأي عنقود
-    for i, label in enumerate(clusterer.labels_):
+    noise_indices = [] # فهارس المقاطع التي لم تنتمِ لأي عنقود
+    for i, label in enumerate(labels):
         if label == -1:
-            noise_chunks.append(chunks[i])
+            noise_indices.append(i)
             continue
-            
-        cluster_name = f"المحور {label + 1}"
-        if cluster_name not in clustered_data:
-            clustered_data[cluster_name] = []
-        
-        clustered_data[cluster_name].append(chunks[i])
+        clustered_data.setdefault(int(label), []).append(i)
     
-    # --- *** التحسين الرئيسي هنا *** ---
     # إذا لم يتم العثور على أي عناقيد على الإطلاق وكانت كل المقاطع "ضوضاء"،
     # فقم بإنشاء محور واحد يضمها جميعًا لضمان وجود مخرجات.
-    if not clustered_data and noise_chunks:
+    if not clustered_data and noise_indices:
         print("لم يتم تشكيل أي عناقيد محددة. سيتم تجميع كل المقاطع في 'المحور العام'.")
-        clustered_data["المحور العام"] = noise_chunks
-    # --- نهاية التحسين ---
+        clustered_data[-1] = noise_indices
         
-    final_clusters = {}
-    for cluster_id, cluster_chunks_list in clustered_data.items():
-        if cluster_chunks_list:
-            # استخلاص عنوان وصفي من المقطع الأول
-            topic_name = cluster_chunks_list[0]['text'].split('،')[0].split('.')[0].strip()
-            
-            # ضمان عدم تكرار أسماء المحاور
-            original_topic_name = topic_name
-            count = 2
-            while topic_name in final_clusters:
-                topic_name = f"{original_topic_name} ({count})"
-                count += 1
+    topics = []
+    used_titles = set()
+    for members in clustered_data.values():
+        centroid, order, similarities = centroid_order(embeddings, members)
+        # استخلاص عنوان وصفي من الحقيقة الممثلة (مع ضمان عدم تكرار أسماء المحاور)
+        topic_name = exemplar_title(chunks[order[0]]['text'], used_titles)
+        topics.append({"title": topic_name, "facts": [chunks[i] for i in order],
+                       "centroid": centroid, "similarities": similarities})
 
-            final_clusters[topic_name] = cluster_chunks_list
+    return topics
 
-    return final_clusters
\ No newline at end of file
+def cluster_chunks(chunks: list[dict], embeddings: np.ndarray) -> dict:
+    """{العنوان: الحقائق مرتبة بالأقرب إلى مركز العنقود} (انظر cluster_topics)."""
+    return {topic['title']: topic['facts'] for topic in cluster_topics(chunks, embeddings)}
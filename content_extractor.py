@@ -1,43 +1,261 @@
 # content_extractor.py
 # استخراج محتوى المقالات
 
-import trafilatura
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import time
+import threading
+import multiprocessing
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from settings import SETTINGS
+from cache_store import PersistentCache
+from url_utils import canonicalize_url, host_of
 
-def fetch_and_extract_content(article: dict) -> dict:
-    url = article.get('url')  # مهم: كان 'link'
-    if not url:
-        return article
+# --- إعدادات خط الاستخراج (تنزيل متزامن بكثافة + استخراج على مجمّع عمليات) ---
+_extraction_cfg = SETTINGS.get('processing', {}).get('extraction', {})
+DOWNLOAD_WORKERS = _extraction_cfg.get('download_workers', 32)
+PER_HOST_LIMIT = _extraction_cfg.get('per_host_limit', 2)
+MAX_PAGE_BYTES = _extraction_cfg.get('max_page_kb', 2048) * 1024
+URL_DEADLINE_SECONDS = _extraction_cfg.get('url_deadline_seconds', 20)
+EXTRACT_PROCESSES = _extraction_cfg.get('extract_processes') or os.cpu_count() or 2
 
-    print(f"جاري جلب المحتوى من: {url}")
+# --- مخزن دائم للمحتوى: رابط موحّد -> المحتوى المستخرج + ETag/Last-Modified ---
+_store_cfg = SETTINGS.get('cache', {}).get('article_content', {})
+FRESH_SECONDS = _store_cfg.get('fresh_hours', 6) * 3600
+CONTENT_FORMAT = 'text'  # يدخل في المفتاح حتى لا تُقرأ مدخلات صيغة قديمة بعد تغيير طريقة الاستخراج
+
+_content_store = PersistentCache(
+    'article_content',
+    ttl_seconds=_store_cfg.get('retention_days', 7) * 24 * 3600,
+    max_bytes=_store_cfg.get('max_mb', 500) * 1024 * 1024
+)
+# تخزين سلبي: المضيفات التي فشلت أو انتهت مهلتها لا نعيد طلبها قبل انتهاء فترة التهدئة
+_failed_hosts = PersistentCache(
+    'failed_hosts',
+    ttl_seconds=_store_cfg.get('failed_host_cooldown_minutes', 15) * 60,
+    max_bytes=5 * 1024 * 1024
+)
+
+REQUEST_TIMEOUT = (5, 15)  # (اتصال، قراءة)
+USER_AGENT = 'Mozilla/5.0 (compatible; NewsReportBot/1.0)'
+_NOT_LOOKED_UP = object()
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=PER_HOST_LIMIT * 2)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = USER_AGENT
+                _session = session
+    return _session
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    """حد أقصى للطلبات المتزامنة لكل مضيف، حتى لا يُغرق التنزيل موقعًا واحدًا."""
+    host = host_of(url)
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_slots[host]
+
+def _get_process_pool():
+    """
+    مجمّع عمليات لاستخراج النص (عمل CPU لا يتحرر فيه الـ GIL).
+    عمال Celery من نوع prefork عمليات daemon لا يُسمح لها بإنشاء عمليات أبناء،
+    فنرجع حينها إلى مجمّع خيوط بنفس الواجهة.
+    """
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                if multiprocessing.current_process().daemon:
+                    print("تحذير: العملية الحالية daemon؛ سيتم الاستخراج على خيوط بدل عمليات.")
+                    _process_pool = ThreadPoolExecutor(max_workers=EXTRACT_PROCESSES)
+                else:
+                    _process_pool = ProcessPoolExecutor(
+                        max_workers=EXTRACT_PROCESSES,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+    return _process_pool
+
+def _store_key(url: str) -> str:
+    return PersistentCache.make_key(canonicalize_url(url), CONTENT_FORMAT)
+
+def _lookup(url: str) -> tuple[dict | None, bool]:
+    """تعيد (المدخل المخزّن، هل هو طازج بما يكفي لتقديمه دون شبكة)."""
+    entry = _content_store.get(_store_key(url))
+    if not entry:
+        return None, False
+    return entry, (time.time() - entry.get('fetched_at', 0)) < FRESH_SECONDS
+
+def _mark_host_failed(url: str, reason: str) -> None:
+    _failed_hosts.set(PersistentCache.make_key(host_of(url)), {'reason': reason, 'at': time.time()})
+
+def _host_in_cooldown(url: str) -> bool:
+    return _failed_hosts.get(PersistentCache.make_key(host_of(url))) is not None
+
+def _download(url: str, cached: dict | None) -> tuple[str | None, bytes | str | None, dict | None]:
+    """
+    المرحلة الأولى (I/O): تنزيل مشروط بحد لكل مضيف، وسقف للحجم، ومهلة كلية لكل رابط.
+    تعيد (النوع، الحمولة، بيانات التخزين):
+    - ('html', bytes, meta): صفحة جديدة تحتاج استخراجًا.
+    - ('cached', text, entry): 304، المحتوى المخزّن ما زال صالحًا.
+    - (None, None, None): فشل.
+    """
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
 
-    # بعض إصدارات trafilatura لا تدعم no_fallback؛ نستخدم الاستدعاء البسيط المتوافق
+    with _host_slot(url):
+        deadline = time.monotonic() + URL_DEADLINE_SECONDS
+        try:
+            with _get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as r:
+                if r.status_code == 304 and cached:
+                    print(f"المحتوى لم يتغير (304): {url}")
+                    return 'cached', cached['content'], dict(cached, fetched_at=time.time())
+                if r.status_code == 429 or r.status_code >= 500:
+                    _mark_host_failed(url, f"HTTP {r.status_code}")
+                if r.status_code != 200:
+                    print(f"فشل جلب {url}: HTTP {r.status_code}")
+                    return None, None, None
+                content_type = r.headers.get('Content-Type', '').lower()
+                if content_type and 'html' not in content_type and 'xml' not in content_type:
+                    print(f"تخطي {url}: نوع محتوى غير مدعوم ({content_type}).")
+                    return None, None, None
+
+                chunks, size = [], 0
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= MAX_PAGE_BYTES:
+                        print(f"تم قص {url} عند {MAX_PAGE_BYTES // 1024} KB.")
+                        break
+                    if time.monotonic() > deadline:
+                        raise requests.Timeout(f"تجاوز المهلة الكلية ({URL_DEADLINE_SECONDS} ثانية)")
+                meta = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                }
+        except (requests.Timeout, requests.ConnectionError) as e:
+            _mark_host_failed(url, type(e).__name__)
+            print(f"فشل الاتصال بـ {url}: {e}")
+            return None, None, None
+
+    html = b''.join(chunks)
+    if not html:
+        return None, None, None
+    return 'html', html, meta
+
+def extract_text(html: bytes | str, url: str | None = None) -> str | None:
+    """المرحلة الثانية (CPU): استخراج النص النظيف من HTML. تعمل داخل مجمّع العمليات."""
     try:
-        downloaded_text = trafilatura.fetch_url(
-            url,
-            include_comments=False,   # مدعوم عادةً
-            target_language='ar'      # تحسين للاحتواء العربي؛ لا يضر بالإنجليزي
-        )
-    except TypeError:
-        # توافق للخلف إذا لم يدعم include_comments/target_language
-        downloaded_text = trafilatura.fetch_url(url)
-
-    if downloaded_text:
-        article['content'] = downloaded_text
+        import trafilatura  # استيراد كسول: يُحمّل داخل عمليات الاستخراج فقط
+        return trafilatura.extract(html, url=url, include_comments=False, include_tables=False)
+    except Exception as e:
+        print(f"خطأ أثناء استخراج النص من {url}: {e}")
+        return None
+
+def _apply(article: dict, text: str | None, entry: dict | None, cached: dict | None) -> dict:
+    url = article.get('url')
+    if text:
+        article['content'] = text
+        _content_store.set(_store_key(url), dict(entry, content=text, fetched_at=time.time()))
         print(f"تم استخراج المحتوى بنجاح من: {url}")
+    elif cached:
+        article['content'] = cached['content']
+        print(f"فشل التحديث؛ استخدام النسخة المخزنة لـ: {url}")
     else:
         print(f"فشل استخراج المحتوى من: {url}.")
     return article
 
+def _fetch_stage(article: dict, cached: dict | None):
+    url = article['url']
+    if _host_in_cooldown(url):
+        print(f"تخطي {url}: المضيف في فترة تهدئة بعد فشل سابق.")
+        return None, None, None
+    print(f"جاري جلب المحتوى من: {url}")
+    return _download(url, cached)
+
+def fetch_and_extract_content(article: dict, cached=_NOT_LOOKED_UP) -> dict:
+    """نسخة متزامنة لمقال واحد (تنزيل ثم استخراج في نفس الخيط)."""
+    url = article.get('url')  # مهم: كان 'link'
+    if not url:
+        return article
+
+    if cached is _NOT_LOOKED_UP:
+        cached, fresh = _lookup(url)
+        if fresh:
+            article['content'] = cached['content']
+            return article
+
+    kind, payload, entry = _fetch_stage(article, cached)
+    if kind == 'cached':
+        return _apply(article, payload, entry, cached)
+    text = extract_text(payload, url) if kind == 'html' else None
+    return _apply(article, text, entry, cached)
+
 def process_articles_in_parallel(articles: list) -> list:
+    """
+    خط استخراج من مرحلتين متداخلتين:
+    1) مجمّع خيوط كبير للتنزيل (حد لكل مضيف، سقف حجم، مهلة لكل رابط).
+    2) مجمّع عمليات يشغّل trafilatura.extract على كل صفحة فور وصولها،
+       فيتداخل استخراج الصفحات الأولى مع تنزيل الصفحات اللاحقة.
+    الناتج في article['content'] نص نظيف لا HTML خام.
+    """
     updated = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(fetch_and_extract_content, a): a for a in articles}
-        for fut in as_completed(futures):
+    to_fetch = []
+    # المقالات المخزنة حديثًا لا تمر على الشبكة إطلاقًا؛ القديمة تُعاد مصادقتها شرطيًا
+    for a in articles:
+        cached, fresh = _lookup(a['url']) if a.get('url') else (None, False)
+        if fresh:
+            a['content'] = cached['content']
+            updated.append(a)
+        elif a.get('url'):
+            to_fetch.append((a, cached))
+        else:
+            updated.append(a)
+    print(f"المحتوى المخزن: {len(updated)} مقال؛ يحتاج جلبًا أو تحققًا: {len(to_fetch)}.")
+    if not to_fetch:
+        return updated
+
+    extract_pool = _get_process_pool()
+    extract_futures = {}
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(to_fetch))) as io_pool:
+        download_futures = {io_pool.submit(_fetch_stage, a, cached): (a, cached) for a, cached in to_fetch}
+        for fut in as_completed(download_futures):
+            a, cached = download_futures[fut]
             try:
-                updated.append(fut.result())
+                kind, payload, entry = fut.result()
             except Exception as e:
-                print(f"خطأ أثناء معالجة {futures[fut].get('url')}: {e}")
-                updated.append(futures[fut])
+                print(f"خطأ أثناء تنزيل {a.get('url')}: {e}")
+                kind, payload, entry = None, None, None
+            if kind == 'html':
+                extract_futures[extract_pool.submit(extract_text, payload, a['url'])] = (a, entry, cached)
+            else:
+                updated.append(_apply(a, payload, entry, cached))
+
+    for fut in as_completed(extract_futures):
+        a, entry, cached = extract_futures[fut]
+        try:
+            text = fut.result()
+        except Exception as e:
+            print(f"خطأ أثناء استخراج {a.get('url')}: {e}")
+            text = None
+        updated.append(_apply(a, text, entry, cached))
+
     print(f"اكتملت معالجة {len(updated)} مقال.")
     return updated
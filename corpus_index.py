@@ -0,0 +1,486 @@
+# corpus_index.py
+# فهرس دائم على القرص لمتجهات الحقائق والمقالات، مشترك بين كل التقارير على نفس الجهاز.
+# - ملف متجهات خام float16 يُلحق به فقط (رقم الصف = معرّف المتجه) + ملف بيانات وصفية (SQLite)
+#   يربط كل متجه بنصه ورابط مصدره وتاريخ نشره.
+# - فهرس FAISS أساسي (IVF أو HNSW، مع ضغط int8/PQ اختياري) يُقرأ من القرص بـ mmap،
+#   والإضافات الأحدث منه (الدلتا) يُبحث فيها بحثًا مباشرًا حتى يعاد بناء الأساس دوريًا (compact).
+# فالتقارير اللاحقة تسترجع الحقائق المعروفة ذات الصلة ومتجهاتها دون إعادة ترميز أو استخلاص.
+
+import os
+import re
+import json
+import time
+import fcntl
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from settings import SETTINGS
+from cache_store import cache_directory
+from url_utils import canonicalize_url
+
+_corpus_cfg = SETTINGS.get('corpus_index', {}) or {}
+CORPUS_ENABLED = _corpus_cfg.get('enabled', True)
+INDEX_TYPE = _corpus_cfg.get('index_type', 'ivf')          # ivf | hnsw | flat
+COMPRESSION = _corpus_cfg.get('compression', 'sq8')        # none | sq8 | pq
+FLAT_BELOW = _corpus_cfg.get('flat_below', 20000)          # فهرس مسطح حتى هذا العدد (لا تدريب يستحق)
+NPROBE = _corpus_cfg.get('nprobe', 16)
+HNSW_EF_SEARCH = _corpus_cfg.get('hnsw_ef_search', 64)
+HNSW_M = 32
+PQ_M = 48                                                  # عدد المقاطع الفرعية لضغط PQ (يجب أن يقسم البعد)
+TRAIN_SAMPLE = 100000                                      # حد عينة التدريب لـ IVF/PQ
+COMPACT_MIN_DELTA = _corpus_cfg.get('compact_min_delta', 5000)
+RETENTION_DAYS = _corpus_cfg.get('retention_days', 30)
+KNOWN_FACTS_TOP_K = _corpus_cfg.get('known_facts_top_k', 50)
+KNOWN_FACTS_MIN_SCORE = _corpus_cfg.get('known_facts_min_score', 0.5)
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def fact_key(text: str, source_url: str | None) -> str:
+    raw = f"{canonicalize_url(source_url or '')}\n{text}"
+    return 'fact|' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def article_key(url: str) -> str:
+    return 'article|' + canonicalize_url(url)
+
+def _normalized(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype='float32')
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+class CorpusIndex:
+    """
+    المتجهات تُخزن مطبّعة، فالضرب الداخلي = تشابه جيب التمام.
+    الكتابة محمية بقفل ملف (flock) لأن الملفات مشتركة بين عمليات العمال؛ إعادة البناء تبني
+    الفهرس الجديد خارج القفل الحصري ثم تستبدل الملف ذريًا (os.replace) وترفع رقم الجيل،
+    فتعيد كل عملية تحميله عند أول بحث بعده.
+    """
+
+    def __init__(self, model_name: str):
+        slug = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        self.base_dir = os.path.join(cache_directory(), 'corpus', slug)
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.base_dir, 'vectors.f16')
+        self.meta_path = os.path.join(self.base_dir, 'corpus.sqlite3')
+        self.index_path = os.path.join(self.base_dir, 'base.faiss')
+        self.lock_path = os.path.join(self.base_dir, 'corpus.lock')
+        self.compact_lock_path = os.path.join(self.base_dir, 'compact.lock')
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._index = None
+        self._index_generation = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.meta_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS vectors (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, '
+                         'kind TEXT NOT NULL, text TEXT, source_url TEXT, published_at TEXT, meta TEXT, added_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_source_url ON vectors(source_url)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._conn = conn
+            self._pid = os.getpid()
+            self._index = None
+        return self._conn
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool, path: str | None = None):
+        with open(path or self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        """BEGIN/COMMIT، وROLLBACK عند أي خطأ حتى لا يبقى الاتصال المشترك داخل معاملة مفتوحة."""
+        conn.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _meta(self, conn, name: str, default=None):
+        row = conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, **values) -> None:
+        conn.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', list(values.items()))
+
+    def _raw(self, rows: int, dim: int) -> np.memmap | None:
+        if not rows:
+            return None
+        return np.memmap(self.vectors_path, dtype='float16', mode='r', shape=(rows, dim))
+
+    # --- الإضافة (إلحاق فقط) ---
+
+    def add(self, items: list[dict], vectors: np.ndarray) -> int:
+        """
+        items: [{key, kind, text, source_url, published_at, meta}] بنفس ترتيب vectors.
+        المفاتيح الموجودة مسبقًا تُتجاهل. يعيد عدد المتجهات المضافة.
+        """
+        if not items:
+            return 0
+        vectors = _normalized(vectors).astype('float16')
+        with self._lock, self._file_lock(exclusive=True):
+            conn = self._connection()
+            dim = self._meta(conn, 'dim')
+            if dim is None:
+                dim = int(vectors.shape[1])
+                self._set_meta(conn, dim=dim, rows=0, base_max_id=-1, generation=0)
+            if dim != vectors.shape[1]:
+                print(f"تحذير: بُعد المتجهات ({vectors.shape[1]}) لا يطابق فهرس المدوّنة ({dim}).")
+                return 0
+
+            keys = list(dict.fromkeys(item['key'] for item in items))
+            existing = set()
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                existing.update(k for (k,) in conn.execute(
+                    f"SELECT key FROM vectors WHERE key IN ({','.join('?' * len(part))})", part))
+            new_positions, seen = [], set(existing)
+            for i, item in enumerate(items):
+                if item['key'] not in seen:
+                    seen.add(item['key'])
+                    new_positions.append(i)
+            if not new_positions:
+                return 0
+
+            rows = self._meta(conn, 'rows', 0)
+            # الاقتطاع عند عدد الصفوف المسجل يحذف أي صفوف يتيمة من كتابة سابقة انقطعت قبل التسجيل
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(rows * dim * 2)
+                f.write(np.ascontiguousarray(vectors[new_positions]).tobytes())
+            now = time.time()
+            with self._transaction(conn):
+                conn.executemany(
+                    'INSERT INTO vectors (id, key, kind, text, source_url, published_at, meta, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(rows + n, items[i]['key'], items[i]['kind'], items[i].get('text'), items[i].get('source_url'),
+                      items[i].get('published_at'), json.dumps(items[i]['meta'], ensure_ascii=False) if items[i].get('meta') else None, now)
+                     for n, i in enumerate(new_positions)])
+                self._set_meta(conn, rows=rows + len(new_positions))
+        return len(new_positions)
+
+    # --- القراءة ---
+
+    def get_vectors(self, keys: list[str]) -> dict:
+        """{المفتاح: المتجه float32} للمفاتيح الموجودة فقط."""
+        found = {}
+        if not keys:
+            return found
+        with self._lock, self._file_lock(exclusive=False):
+            conn = self._connection()
+            dim, rows = self._meta(conn, 'dim'), self._meta(conn, 'rows', 0)
+            raw = self._raw(rows, dim) if dim else None
+            if raw is None:
+                return found
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                for key, row in conn.execute(f"SELECT key, id FROM vectors WHERE key IN ({','.join('?' * len(part))})", part):
+                    found[key] = np.asarray(raw[row], dtype='float32')
+        return found
+
+    def get_metadata(self, keys: list[str]) -> dict:
+        """{المفتاح: البيانات الوصفية المخزنة (meta)}."""
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                for key, meta in conn.execute(f"SELECT key, meta FROM vectors WHERE key IN ({','.join('?' * len(part))})", part):
+                    found[key] = json.loads(meta) if meta else {}
+        return found
+
+    def _load_index(self, conn):
+        """الفهرس الأساسي للجيل الحالي (mmap عند الإمكان)، أو None إن لم يُبنَ بعد."""
+        generation = self._meta(conn, 'generation', 0)
+        if self._index_generation != generation or (self._index is None and os.path.exists(self.index_path)):
+            self._index = None
+            if os.path.exists(self.index_path):
+                import faiss  # استيراد كسول: لا يُحمّل إلا في العامل عند أول بحث
+                try:
+                    index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+                except Exception:
+                    index = faiss.read_index(self.index_path)
+                params = faiss.ParameterSpace()
+                for name, value in (('nprobe', NPROBE), ('efSearch', HNSW_EF_SEARCH)):
+                    try:
+                        params.set_index_parameter(index, name, value)
+                    except Exception:
+                        pass  # المعامل لا يخص نوع هذا الفهرس
+                self._index = index
+            self._index_generation = generation
+        return self._index
+
+    def search(self, queries: np.ndarray, top_k: int, kind: str | None = None, since: str | None = None,
+               exclude_urls=(), min_score: float = 0.0) -> list[list[dict]]:
+        """
+        لكل استعلام: أقرب top_k متجهًا (بالترتيب) مع نصه ورابطه وتشابهه ومتجهه.
+        المرشحون من الفهرس الأساسي + بحث مباشر في الدلتا، ثم التصفية بالنوع وتاريخ النشر والروابط المستبعدة.
+        """
+        queries = _normalized(np.atleast_2d(queries))
+        exclude = {canonicalize_url(u) for u in exclude_urls if u}
+        with self._lock, self._file_lock(exclusive=False):
+            conn = self._connection()
+            dim, rows = self._meta(conn, 'dim'), self._meta(conn, 'rows', 0)
+            if not dim or not rows:
+                return [[] for _ in queries]
+            base_max_id = self._meta(conn, 'base_max_id', -1)
+            raw = self._raw(rows, dim)
+            index = self._load_index(conn)
+            # مرشحون إضافيون لتعويض ما تحذفه التصفية
+            candidates_k = top_k * 4 + len(exclude)
+
+            candidate_ids = [[] for _ in queries]
+            if index is not None and index.ntotal:
+                scores, ids = index.search(queries, min(candidates_k, index.ntotal))
+                for q in range(len(queries)):
+                    candidate_ids[q].extend((float(s), int(i)) for s, i in zip(scores[q], ids[q]) if i >= 0)
+            delta_start = base_max_id + 1
+            if delta_start < rows:
+                delta = np.asarray(raw[delta_start:rows], dtype='float32')
+                sims = queries @ delta.T
+                k = min(candidates_k, sims.shape[1])
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                for q in range(len(queries)):
+                    candidate_ids[q].extend((float(sims[q, j]), delta_start + int(j)) for j in top[q])
+
+            wanted = sorted({i for cands in candidate_ids for s, i in cands if s >= min_score})
+            meta_rows = {}
+            for start in range(0, len(wanted), 500):
+                part = wanted[start:start + 500]
+                sql = f"SELECT id, key, kind, text, source_url, published_at FROM vectors WHERE id IN ({','.join('?' * len(part))})"
+                for row in conn.execute(sql, part):
+                    meta_rows[row[0]] = row
+
+            results = []
+            for cands in candidate_ids:
+                hits = []
+                for score, vid in sorted(cands, reverse=True):
+                    row = meta_rows.get(vid)
+                    if score < min_score or row is None:  # None: حُذف بانتهاء الاحتفاظ ولم يُعد البناء بعد
+                        continue
+                    _, key, row_kind, text, source_url, published_at = row
+                    if kind and row_kind != kind:
+                        continue
+                    if since and (not published_at or published_at < since):
+                        continue
+                    if source_url and canonicalize_url(source_url) in exclude:
+                        continue
+                    hits.append({"key": key, "kind": row_kind, "text": text, "source_url": source_url,
+                                 "published_at": published_at, "score": score,
+                                 "vector": np.asarray(raw[vid], dtype='float32')})
+                    if len(hits) >= top_k:
+                        break
+                results.append(hits)
+        return results
+
+    # --- إعادة البناء الدورية ---
+
+    def _build_index(self, vectors: np.ndarray, ids: np.ndarray):
+        import faiss
+        n, dim = vectors.shape
+        code = {'sq8': 'SQ8', 'pq': f"PQ{PQ_M}" if dim % PQ_M == 0 else 'SQ8'}.get(COMPRESSION, 'Flat')
+        if INDEX_TYPE == 'flat' or n < FLAT_BELOW:
+            # PQ يحتاج آلاف نقاط التدريب لكل مقطع؛ دونها نكتفي بـ int8
+            spec = f"IDMap,{'SQ8' if code.startswith('PQ') else code}"
+        elif INDEX_TYPE == 'hnsw':
+            spec = f"IDMap,HNSW{HNSW_M}" + ('' if code == 'Flat' else f",{code}")
+        else:
+            nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+            spec = f"IVF{nlist},{code}"
+        index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            sample = vectors if n <= TRAIN_SAMPLE else vectors[np.random.default_rng(0).choice(n, TRAIN_SAMPLE, replace=False)]
+            index.train(sample)
+        index.add_with_ids(vectors, ids.astype('int64'))
+        return index, spec
+
+    def compact(self, retention_days: int = RETENTION_DAYS, min_delta: int = COMPACT_MIN_DELTA, force: bool = False) -> dict:
+        """
+        1) حذف ما خرج من نافذة الاحتفاظ (بتاريخ النشر، أو تاريخ الإضافة عند غيابه).
+        2) إن تجاوزت المحذوفات نصف الملف يعاد كتابة ملف المتجهات وترقيم المعرّفات.
+        3) إعادة بناء الفهرس الأساسي إن بلغت الدلتا min_delta أو حُذف شيء.
+        عملية إعادة بناء واحدة في الوقت نفسه (قفل منفصل)؛ الإضافات والبحث لا تنتظرها إلا لحظة الاستبدال.
+        """
+        with open(self.compact_lock_path, 'a') as compact_lock:
+            try:
+                fcntl.flock(compact_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"skipped": "compaction already running"}
+            try:
+                return self._compact(retention_days, min_delta, force)
+            finally:
+                fcntl.flock(compact_lock, fcntl.LOCK_UN)
+
+    def _compact(self, retention_days: int, min_delta: int, force: bool) -> dict:
+        started = time.time()
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        with self._lock, self._file_lock(exclusive=True):
+            conn = self._connection()
+            dim, rows = self._meta(conn, 'dim'), self._meta(conn, 'rows', 0)
+            if not dim:
+                return {"rows": 0}
+            expired = conn.execute(
+                'DELETE FROM vectors WHERE (published_at IS NOT NULL AND published_at < ?) OR (published_at IS NULL AND added_at < ?)',
+                (cutoff.strftime(ISO_FORMAT), cutoff.timestamp())).rowcount
+            live = conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+            delta = rows - 1 - self._meta(conn, 'base_max_id', -1)
+            if not force and not expired and delta < min_delta:
+                return {"rows": rows, "live": live, "delta": delta, "rebuilt": False}
+
+            renumbered = rows - live > live
+            if renumbered:
+                # ملف المتجهات يُعاد كتابته للأحياء فقط؛ يجري تحت القفل الحصري لأن المعرّفات تتغير
+                raw = self._raw(rows, dim)
+                old_ids = [i for (i,) in conn.execute('SELECT id FROM vectors ORDER BY id')]
+                tmp_path = self.vectors_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    for start in range(0, len(old_ids), 10000):
+                        f.write(np.ascontiguousarray(raw[old_ids[start:start + 10000]]).tobytes())
+                with self._transaction(conn):
+                    # ترقيم عبر معرّفات سالبة مؤقتة لتجنب تصادم المفتاح الأساسي
+                    conn.executemany('UPDATE vectors SET id = ? WHERE id = ?', [(-1 - new, old) for new, old in enumerate(old_ids)])
+                    conn.execute('UPDATE vectors SET id = -1 - id')
+                    # الفهرس القديم يحمل المعرّفات القديمة: يُسقط، والبحث مباشر على الكل حتى يكتمل البناء
+                    self._set_meta(conn, rows=live, base_max_id=-1, generation=self._meta(conn, 'generation', 0) + 1)
+                os.replace(tmp_path, self.vectors_path)
+                if os.path.exists(self.index_path):
+                    os.remove(self.index_path)
+                rows = live
+        # بناء الفهرس من لقطة الصفوف الحالية؛ ما يُلحق أثناء البناء يبقى في الدلتا
+        with self._lock, self._file_lock(exclusive=False):
+            conn = self._connection()
+            ids = np.array([i for (i,) in conn.execute('SELECT id FROM vectors WHERE id < ? ORDER BY id', (rows,))], dtype='int64')
+            vectors = np.asarray(self._raw(rows, dim)[ids], dtype='float32') if len(ids) else None
+        spec = None
+        tmp_index = self.index_path + '.tmp'
+        if vectors is not None:
+            index, spec = self._build_index(vectors, ids)
+            import faiss
+            faiss.write_index(index, tmp_index)
+        with self._lock, self._file_lock(exclusive=True):
+            conn = self._connection()
+            if vectors is not None:
+                os.replace(tmp_index, self.index_path)
+            elif os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            with self._transaction(conn):
+                self._set_meta(conn, base_max_id=rows - 1, generation=self._meta(conn, 'generation', 0) + 1)
+        stats = {"rows": rows, "live": int(len(ids)), "expired": expired, "renumbered": renumbered,
+                 "index": spec, "rebuilt": True, "seconds": round(time.time() - started, 2)}
+        print(f"فهرس المدوّنة: أعيد البناء {stats}")
+        return stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            return {name: value for name, value in conn.execute('SELECT name, value FROM meta')}
+
+# --- الاستخدام من مراحل التقرير: أي فشل هنا يُطبع ويُتجاهل ولا يُفشل التقرير ---
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+def get_corpus() -> CorpusIndex | None:
+    global _corpus
+    if not CORPUS_ENABLED:
+        return None
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                from semantic_searcher import MODEL_NAME
+                _corpus = CorpusIndex(MODEL_NAME)
+    return _corpus
+
+def _article_text(article: dict) -> str | None:
+    """نفس النص الذي ترمّزه الفلترة الدلالية، فيأتي متجهه من مخزن المتجهات."""
+    content = article.get('content') or article.get('description') or ''
+    return content if len(content.split()) > 25 else None
+
+def index_articles(articles: list) -> None:
+    """يضيف متجهات محتوى المقالات مع بياناتها الوصفية (للاستشهاد بها من تقارير لاحقة)."""
+    corpus = get_corpus()
+    if not corpus:
+        return
+    from semantic_searcher import encode_texts
+    from stage_store import ARTICLE_META_FIELDS
+    try:
+        articles = [a for a in articles if a.get('url') and _article_text(a)]
+        if not articles:
+            return
+        vectors = encode_texts([_article_text(a) for a in articles], normalize=True)
+        added = corpus.add([{
+            "key": article_key(a['url']), "kind": 'article', "source_url": a['url'], "published_at": a.get('publishedAt'),
+            "meta": {k: a[k] for k in ARTICLE_META_FIELDS if a.get(k) is not None}
+        } for a in articles], vectors)
+        print(f"فهرس المدوّنة: أضيف {added} مقال جديد.")
+    except Exception as e:
+        print(f"تحذير: تعذرت إضافة المقالات إلى فهرس المدوّنة: {e}")
+
+def known_facts(query: str, period_days: int, exclude_urls: list) -> tuple[list[dict], list[dict]]:
+    """
+    حقائق معروفة من تقارير سابقة ذات صلة بالاستعلام، منشورة ضمن الفترة، من غير مقالات التقرير الحالي.
+    يعيد (الحقائق موسومة بـ corpus_key، البيانات الوصفية لمقالاتها للاستشهاد).
+    """
+    corpus = get_corpus()
+    if not corpus or not query:
+        return [], []
+    from semantic_searcher import encode_texts
+    try:
+        since = (datetime.now(timezone.utc) - timedelta(days=period_days)).strftime(ISO_FORMAT)
+        hits = corpus.search(encode_texts([query], normalize=True), KNOWN_FACTS_TOP_K, kind='fact', since=since,
+                             exclude_urls=exclude_urls, min_score=KNOWN_FACTS_MIN_SCORE)[0]
+        urls = list(dict.fromkeys(h['source_url'] for h in hits if h['source_url']))
+        articles = corpus.get_metadata([article_key(u) for u in urls])
+        facts = [{'text': h['text'], 'source_url': h['source_url'], 'corpus_key': h['key']}
+                 for h in hits if article_key(h['source_url'] or '') in articles]
+        print(f"فهرس المدوّنة: {len(facts)} حقيقة معروفة ذات صلة من تقارير سابقة.")
+        return facts, [a for a in articles.values() if a.get('url')]
+    except Exception as e:
+        print(f"تحذير: تعذر البحث في فهرس المدوّنة: {e}")
+        return [], []
+
+def fact_embeddings(facts: list[dict], articles: list) -> np.ndarray:
+    """
+    متجهات الحقائق (مطبّعة): ما سبقت فهرسته يُقرأ من الفهرس مباشرة، والجديد يُرمّز ثم يُضاف إليه
+    مع تاريخ نشر مقاله.
+    """
+    from semantic_searcher import encode_texts
+    corpus = get_corpus()
+    # الحقائق المعادة من مخزن الحقائق (llm_summarizer) لها المفتاح نفسه، فمتجهاتها موجودة هنا أيضًا
+    keys = [f.get('corpus_key') or fact_key(f['text'], f.get('source_url')) for f in facts]
+    stored = {}
+    if corpus:
+        try:
+            stored = corpus.get_vectors(keys)
+        except Exception as e:
+            print(f"تحذير: تعذرت القراءة من فهرس المدوّنة: {e}")
+    missing = [i for i, key in enumerate(keys) if key not in stored]
+    vectors = np.zeros((len(facts), 0), dtype='float32')
+    if missing:
+        encoded = encode_texts([facts[i]['text'] for i in missing], normalize=True)
+        vectors = np.zeros((len(facts), encoded.shape[1]), dtype='float32')
+        vectors[missing] = encoded
+    elif facts:
+        vectors = np.zeros((len(facts), len(next(iter(stored.values())))), dtype='float32')
+    for i, key in enumerate(keys):
+        if key in stored:
+            vectors[i] = stored[key]
+
+    if corpus and missing:
+        published = {a['url']: a.get('publishedAt') for a in articles if a.get('url')}
+        try:
+            added = corpus.add([{
+                "key": keys[i], "kind": 'fact', "text": facts[i]['text'],
+                "source_url": facts[i].get('source_url'), "published_at": published.get(facts[i].get('source_url'))
+            } for i in missing], vectors[missing])
+            print(f"فهرس المدوّنة: أضيفت {added} حقيقة جديدة.")
+        except Exception as e:
+            print(f"تحذير: تعذرت إضافة الحقائق إلى فهرس المدوّنة: {e}")
+    return vectors
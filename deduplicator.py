@@ -1,17 +1,70 @@
 # deduplicator.py
 # هذا الملف مسؤول عن إزالة المقالات والمقاطع النصية المكررة.
 
+import re
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from settings import SETTINGS
+from url_utils import canonicalize_url
 
 # --- استيراد النموذج اللغوي متعدد اللغات من semantic_searcher ---
 # هذا النموذج ضروري لفهم معنى النصوص بلغات مختلفة
 try:
-    from semantic_searcher import model
+    from semantic_searcher import encode_texts, embeddings_available
 except ImportError:
     print("تحذير: لم يتم العثور على النموذج اللغوي. الفلترة الدلالية للمقالات لن تعمل.")
-    model = None
+    encode_texts = None
+    embeddings_available = lambda: False
+
+DEDUP_BLOCK_SIZE = 2048  # حجم الكتلة في محرك الإزالة: الذاكرة المؤقتة O(كتلة²) بدل O(N²)
+
+def greedy_dedup_indices(embeddings: np.ndarray, threshold: float, block_size: int = DEDUP_BLOCK_SIZE) -> list[int]:
+    """
+    إزالة تكرار جشعة "الأول يبقى" بنفس دلالة الحلقة المزدوجة القديمة:
+    العنصر j يُحذف إذا وُجد عنصر محتفَظ به i < j بتشابه جيب تمام > threshold.
+
+    بدل مصفوفة N×N تُعالج العناصر على كتل بالترتيب:
+    1) كل كتلة تُقارن دفعة واحدة (ضرب مصفوفات) مع كل ما احتُفظ به قبلها، على شرائح بحجم الكتلة.
+    2) الناجون منها يُقارنون ببعضهم داخل مصفوفة كتلة×كتلة، مع حلقة على الصفوف فقط (متجهة).
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    X = np.asarray(embeddings, dtype='float32')
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    X = X / np.maximum(norms, 1e-12)
+
+    kept_indices = []
+    kept_vectors = np.empty_like(X)
+    kept_count = 0
+
+    for start in range(0, n, block_size):
+        block = X[start:start + block_size]
+        alive = np.ones(len(block), dtype=bool)
+
+        # (1) المقارنة مع العناصر المحتفظ بها من الكتل السابقة
+        for k_start in range(0, kept_count, block_size):
+            rows = np.flatnonzero(alive)
+            if rows.size == 0:
+                break
+            sims = block[rows] @ kept_vectors[k_start:min(k_start + block_size, kept_count)].T
+            alive[rows[(sims > threshold).any(axis=1)]] = False
+
+        # (2) الإزالة الجشعة داخل الكتلة نفسها
+        rows = np.flatnonzero(alive)
+        if rows.size == 0:
+            continue
+        local = block[rows]
+        duplicate_of_kept = (local @ local.T) > threshold
+        discarded = np.zeros(rows.size, dtype=bool)
+        for a in range(rows.size):
+            if discarded[a]:
+                continue
+            discarded[a + 1:] |= duplicate_of_kept[a, a + 1:]
+            kept_vectors[kept_count] = local[a]
+            kept_count += 1
+            kept_indices.append(start + int(rows[a]))
+
+    return kept_indices
 
 def deduplicate_articles_simple(articles: list) -> list:
     """
@@ -23,8 +76,8 @@ def deduplicate_articles_simple(articles: list) -> list:
     unique_articles = []
     
     for article in articles:
-        url = article.get('url')
-        title = article.get('title', '').strip().lower()
+        url = canonicalize_url(article.get('url'))
+        title = (article.get('title') or '').strip().lower()
         
         # نعتبر المقال فريدًا فقط إذا لم نرَ رابطه أو عنوانه من قبل
         if url and url not in seen_urls and title and title not in seen_titles:
@@ -35,12 +88,156 @@ def deduplicate_articles_simple(articles: list) -> list:
     print(f"إزالة التكرار البسيط: تم تقليص عدد المقالات من {len(articles)} إلى {len(unique_articles)}.")
     return unique_articles
 
+# --- إزالة التكرار المعجمي (MinHash LSH على العنوان والوصف) ---
+_lexical_cfg = SETTINGS.get('processing', {}).get('lexical_dedup', {})
+SHINGLE_SIZE = _lexical_cfg.get('shingle_size', 4)
+LSH_BANDS = _lexical_cfg.get('bands', 16)
+LSH_ROWS = _lexical_cfg.get('rows_per_band', 4)
+LEXICAL_THRESHOLD = _lexical_cfg.get('jaccard_threshold', 0.6)
+
+# كل الحساب في NumPy: بصمات المقاطع ومعاملات التباديل أقل من الأولي (< 2^32)،
+# فـ a*x + b أقل من 2^64 ولا يفيض uint64 (باقي قسمة واحد لكل تبديل).
+_HASH_PRIME = np.uint64(4294967291)  # أكبر عدد أولي أقل من 2^32
+_SHINGLE_BASE = np.uint64(1000003)   # أساس بصمة المقطع (متعددة حدود على نقاط الترميز)
+_rng = np.random.default_rng(1)      # بذرة ثابتة: نفس التواقيع في كل العمليات
+_PERM_A = _rng.integers(1, int(_HASH_PRIME), size=LSH_BANDS * LSH_ROWS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, int(_HASH_PRIME), size=LSH_BANDS * LSH_ROWS, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 1 << 62, size=LSH_ROWS, dtype=np.uint64)  # يطوي صفوف النطاق في مفتاح واحد
+MINHASH_CHUNK_SHINGLES = 65536       # مقاطع كل دفعة: ذاكرة الدفعة = هذا × عدد التباديل × 8 بايت
+# المرشح لا يُحسب جاكاردها الدقيق إن قل تقديرها من التواقيع عن العتبة بأكثر من هذا الهامش
+# (الانحراف المعياري للتقدير بـ 64 تبديلًا ≈ 0.06، فالهامش أكثر من 3 انحرافات)
+ESTIMATE_MARGIN = 0.2
+
+_ARABIC_DIACRITICS_RE = re.compile(r'[\u064B-\u065F\u0670\u0640]')
+_NON_WORD_RE = re.compile(r'[^\w\s]+')
+_SOURCE_SUFFIX_RE = re.compile(r'\s+[-|–—]\s+[^-|–—]{1,40}$')  # " - Reuters" في نهاية العنوان
+_LETTER_VARIANTS = str.maketrans('أإآىة', 'ااايه')
+
+def _normalize_for_shingles(title: str, description: str) -> str:
+    text = f"{_SOURCE_SUFFIX_RE.sub('', title or '')} {description or ''}"
+    text = _ARABIC_DIACRITICS_RE.sub('', text.lower())
+    text = text.translate(_LETTER_VARIANTS)
+    return ' '.join(_NON_WORD_RE.sub(' ', text).split())
+
+def _shingles(text: str) -> np.ndarray:
+    """
+    بصمات المقاطع الحرفية بطول SHINGLE_SIZE (تتحمل تغييرات الصياغة الطفيفة في العناوين)، فريدة ومرتبة.
+    تُحسب لكل مقاطع النص معًا من مصفوفة نقاط الترميز، بدل crc32 لكل مقطع في حلقة بايثون.
+    """
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if not len(codes):
+        return codes
+    size = min(SHINGLE_SIZE, len(codes))
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        hashes = (hashes * _SHINGLE_BASE + codes[offset:offset + count]) % _HASH_PRIME
+    return np.unique(hashes)
+
+def _minhash_signatures(shingle_sets: list[np.ndarray]) -> np.ndarray:
+    """
+    تواقيع MinHash لكل المجموعات (غير الفارغة) معًا: مصفوفة (مجموعات × تباديل).
+    مقاطع دفعة من المجموعات في مصفوفة واحدة، تُطبّق عليها كل التباديل ثم تؤخذ أصغر قيمة لكل مجموعة
+    (np.minimum.reduceat)، بدل حلقة بايثون على كل مقطع وكل تبديل.
+    """
+    signatures = np.empty((len(shingle_sets), len(_PERM_A)), dtype=np.uint64)
+    start = 0
+    while start < len(shingle_sets):
+        # دفعة لا تتجاوز مقاطعها MINHASH_CHUNK_SHINGLES (مجموعة واحدة على الأقل)
+        end, total = start, 0
+        while end < len(shingle_sets) and (end == start or total + len(shingle_sets[end]) <= MINHASH_CHUNK_SHINGLES):
+            total += len(shingle_sets[end])
+            end += 1
+        chunk = shingle_sets[start:end]
+        offsets = np.cumsum([0] + [len(shingles) for shingles in chunk[:-1]])
+        hashed = (_PERM_A[:, None] * np.concatenate(chunk) + _PERM_B[:, None]) % _HASH_PRIME  # (تباديل × مقاطع)
+        signatures[start:end] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        start = end
+    return signatures
+
+def _candidate_pairs(signatures: np.ndarray) -> np.ndarray:
+    """
+    أزواج (i, j) بـ i < j تتطابق في نطاق واحد على الأقل من التوقيع (LSH)، بلا تكرار.
+    كل نطاق يُطوى في مفتاح واحد ويُجمَّع بالفرز بدل قاموس بايثون لكل نطاق ومقال.
+    """
+    pairs = []
+    for band in range(LSH_BANDS):
+        keys = signatures[:, band * LSH_ROWS:(band + 1) * LSH_ROWS] @ _BAND_MIX  # طي بفيض مقصود (mod 2^64)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        twos = starts[sizes == 2]  # أغلب الدلاء المشتركة زوج واحد: تُجمع دفعة واحدة
+        pairs.append(np.sort(np.stack([order[twos], order[twos + 1]], axis=1), axis=1))
+        for start, size in zip(starts[sizes > 2], sizes[sizes > 2]):
+            members = np.sort(order[start:start + size])
+            i, j = np.triu_indices(size, k=1)
+            pairs.append(np.stack([members[i], members[j]], axis=1))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def find_lexical_duplicate_groups(articles: list) -> list[int]:
+    """
+    تعيد لكل مقال فهرس "ممثل" مجموعته (أول مقال فيها).
+    - نفس الرابط الموحّد (utm، AMP، الجوال...) => نفس المجموعة.
+    - تشابه جاكارد للعنوان+الوصف >= LEXICAL_THRESHOLD => نفس المجموعة.
+      المرشحون يأتون من LSH (نطاقات من توقيع MinHash) بدل مقارنة كل الأزواج، ويُستبعد منهم ما يبعد
+      تقديره من التواقيع عن العتبة أكثر من ESTIMATE_MARGIN، ثم يُتحقق من الباقين بجاكارد الدقيق.
+    """
+    parent = list(range(len(articles)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)  # الأقدم في القائمة يبقى ممثلًا
+
+    by_url = {}
+    shingle_sets = []
+    for i, article in enumerate(articles):
+        url = canonicalize_url(article.get('url') or '')
+        if url in by_url:
+            union(by_url[url], i)
+        elif url:
+            by_url[url] = i
+        shingle_sets.append(_shingles(_normalize_for_shingles(article.get('title'), article.get('description'))))
+
+    hashed = [i for i, shingles in enumerate(shingle_sets) if len(shingles)]
+    if len(hashed) < 2:
+        return [find(i) for i in range(len(articles))]
+    signatures = _minhash_signatures([shingle_sets[i] for i in hashed])
+    pairs = _candidate_pairs(signatures)
+    estimates = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    for a, b in pairs[estimates >= LEXICAL_THRESHOLD - ESTIMATE_MARGIN].tolist():
+        si, sj = shingle_sets[hashed[a]], shingle_sets[hashed[b]]
+        common = len(np.intersect1d(si, sj, assume_unique=True))
+        if common / (len(si) + len(sj) - common) >= LEXICAL_THRESHOLD:
+            union(hashed[a], hashed[b])
+
+    return [find(i) for i in range(len(articles))]
+
+def deduplicate_articles_lexical(articles: list) -> list:
+    """
+    طبقة رخيصة قبل تنزيل المحتوى والفلترة الدلالية: تحذف النسخ المعاد نشرها من الوكالات،
+    ونسخ AMP/الجوال، والروابط الموسومة بمعاملات التتبع، والعناوين المعدّلة قليلًا.
+    """
+    if not _lexical_cfg.get('enabled', True) or len(articles) < 2:
+        return articles
+    groups = find_lexical_duplicate_groups(articles)
+    unique_articles = [a for i, a in enumerate(articles) if groups[i] == i]
+    print(f"إزالة التكرار المعجمي: تم تقليص عدد المقالات من {len(articles)} إلى {len(unique_articles)}.")
+    return unique_articles
+
 def deduplicate_articles_semantic(articles: list) -> list:
     """
     تزيل المقالات المكررة دلاليًا (مثل الترجمات) عبر مقارنة متجهات محتواها الكامل.
     هذه هي الطبقة الثانية من الفلترة العميقة.
     """
-    if not articles or not model or len(articles) < 2:
+    if not articles or len(articles) < 2 or not embeddings_available():
         return articles
 
     # استخلاص المحتوى، مع تفضيل المحتوى الكامل على الوصف القصير
@@ -57,30 +254,15 @@ def deduplicate_articles_semantic(articles: list) -> list:
     
     print(f"--- بدء الفلترة الدلالية لـ {len(valid_contents)} مقالًا ... ---")
     
-    embeddings = model.encode(valid_contents, show_progress_bar=False, normalize_embeddings=True)
-    embeddings = np.array(embeddings).astype('float32')
+    embeddings = encode_texts(valid_contents, normalize=True)
 
     # عتبة التشابه، يمكن تعديلها في config.yaml (أعلى تعني تطابقًا أقوى)
     threshold = SETTINGS.get('processing', {}).get('deduplication_threshold', 0.95)
     
-    similarity_matrix = cosine_similarity(embeddings)
-    
-    to_keep_indices = set()
-    discarded_indices = set()
-    
-    for i in range(len(original_valid_articles)):
-        if i in discarded_indices:
-            continue
-        
-        to_keep_indices.add(i)
-        
-        # ابحث عن المقالات المشابهة له وتجاهلها
-        for j in range(i + 1, len(original_valid_articles)):
-            if similarity_matrix[i, j] > threshold:
-                discarded_indices.add(j)
+    to_keep_indices = greedy_dedup_indices(embeddings, threshold)
 
     # بناء القائمة النهائية للمقالات الفريدة
-    final_unique_articles = [original_valid_articles[i] for i in sorted(list(to_keep_indices))]
+    final_unique_articles = [original_valid_articles[i] for i in to_keep_indices]
     
     # إضافة المقالات التي لم يتم فحصها (لأن محتواها كان قصيرًا جدًا)
     invalid_indices = set(range(len(articles))) - set(valid_indices)
@@ -100,20 +282,7 @@ def get_unique_chunk_indices(chunks: list[dict], embeddings: np.ndarray) -> list
 
     threshold = SETTINGS.get('processing', {}).get('deduplication_threshold', 0.9)
     
-    similarity_matrix = cosine_similarity(embeddings)
-    
-    to_keep_indices = []
-    discarded_indices = set()
-    
-    for i in range(len(chunks)):
-        if i in discarded_indices:
-            continue
-        
-        to_keep_indices.append(i)
-        
-        for j in range(i + 1, len(chunks)):
-            if similarity_matrix[i, j] > threshold:
-                discarded_indices.add(j)
-                
+    to_keep_indices = greedy_dedup_indices(embeddings, threshold)
+
     print(f"إزالة تكرار المقاطع: تم تحديد {len(to_keep_indices)} مقطع فريد من أصل {len(chunks)}.")
     return to_keep_indices
@@ -0,0 +1,194 @@
+# embedding_cache.py
+# مخزن دائم للمتجهات: مصفوفة float32 على القرص (memory-mapped) + ملف فهرس (SQLite).
+# المفتاح: (اسم النموذج، علم التطبيع، بصمة النص)، فلا يُعاد ترميز نفس النص مرتين.
+
+import os
+import re
+import time
+import fcntl
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from cache_store import cache_directory
+
+def embedding_key(model_name: str, normalize: bool, text: str) -> str:
+    digest = hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+    return f"{model_name}|{int(bool(normalize))}|{digest}"
+
+class EmbeddingCache:
+    """
+    كل متجه يشغل صفًا في ملف المصفوفة، والفهرس يربط المفتاح برقم الصف وآخر استخدام.
+    عند تجاوز max_bytes تُحرَّر صفوف الأقدم استخدامًا (LRU) ويعاد استخدامها لاحقًا.
+    الكتابة محمية بقفل ملف (flock) لأن الملفات مشتركة بين عمليات العمال.
+    """
+
+    GROW_ROWS = 4096  # عدد الصفوف المضافة للملف في كل توسيع
+
+    def __init__(self, model_name: str, max_bytes: int):
+        slug = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        base = os.path.join(cache_directory(), 'embeddings')
+        os.makedirs(base, exist_ok=True)
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.matrix_path = os.path.join(base, f"{slug}.f32")
+        self.index_path = os.path.join(base, f"{slug}.index.sqlite3")
+        self.lock_path = os.path.join(base, f"{slug}.lock")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._matrix = None
+        self._dim = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL, last_access REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_last_access ON vectors(last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._conn = conn
+            self._pid = os.getpid()
+            self._matrix = None
+        return self._conn
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        """BEGIN/COMMIT، وROLLBACK عند أي خطأ حتى لا يبقى الاتصال المشترك داخل معاملة مفتوحة."""
+        conn.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _meta(self, conn, name: str, default=None):
+        row = conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def _map(self, min_rows: int = 0) -> np.memmap | None:
+        """يعيد ربط الملف إذا كبر (قد تكون عملية أخرى وسّعته)."""
+        if not self._dim:
+            return None
+        if self._matrix is None or self._matrix.shape[0] < min_rows:
+            rows = os.path.getsize(self.matrix_path) // (self._dim * 4) if os.path.exists(self.matrix_path) else 0
+            if rows == 0:
+                return None
+            self._matrix = np.memmap(self.matrix_path, dtype='float32', mode='r+', shape=(rows, self._dim))
+        return self._matrix
+
+    def _grow(self, needed_rows: int) -> None:
+        current = os.path.getsize(self.matrix_path) // (self._dim * 4) if os.path.exists(self.matrix_path) else 0
+        if current >= needed_rows:
+            return
+        new_rows = max(needed_rows, current + self.GROW_ROWS)
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(new_rows * self._dim * 4)
+        self._matrix = None
+
+    def get_many(self, keys: list[str]) -> dict:
+        """تعيد {المفتاح: المتجه} للمفاتيح الموجودة فقط."""
+        found = {}
+        if not keys:
+            return found
+        try:
+            with self._lock, self._file_lock(exclusive=False):
+                conn = self._connection()
+                self._dim = self._dim or self._meta(conn, 'dim')
+                if not self._dim:
+                    self.misses += len(keys)
+                    return found
+                rows = []
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(part))
+                    rows.extend(conn.execute(f'SELECT key, row FROM vectors WHERE key IN ({placeholders})', part).fetchall())
+                if rows:
+                    matrix = self._map(max(r for _, r in rows) + 1)
+                    for key, row in rows:
+                        found[key] = np.array(matrix[row])
+                    now = time.time()
+                    conn.executemany('UPDATE vectors SET last_access = ? WHERE key = ?', [(now, k) for k, _ in rows])
+        except Exception as e:
+            print(f"تحذير: تعذرت القراءة من مخزن المتجهات: {e}")
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict) -> None:
+        if not items:
+            return
+        try:
+            with self._lock, self._file_lock(exclusive=True):
+                conn = self._connection()
+                dim = int(len(next(iter(items.values()))))
+                self._dim = self._dim or self._meta(conn, 'dim')
+                if not self._dim:
+                    conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', ('dim', dim))
+                    self._dim = dim
+                if self._dim != dim:
+                    print(f"تحذير: بُعد المتجهات ({dim}) لا يطابق المخزن ({self._dim}).")
+                    return
+
+                keys = list(items)
+                existing = set()
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(part))
+                    existing.update(k for (k,) in conn.execute(f'SELECT key FROM vectors WHERE key IN ({placeholders})', part))
+                new_items = [(k, v) for k, v in items.items() if k not in existing]
+                if not new_items:
+                    return
+
+                self._evict(conn, len(new_items))
+                free = [r for (r,) in conn.execute('SELECT row FROM free_rows ORDER BY row LIMIT ?', (len(new_items),))]
+                next_row = self._meta(conn, 'next_row', 0)
+                fresh = len(new_items) - len(free)
+                rows = free + list(range(next_row, next_row + fresh))
+                next_row += fresh
+
+                self._grow(next_row)
+                matrix = self._map(next_row)
+                for (key, vec), row in zip(new_items, rows):
+                    matrix[row] = np.asarray(vec, dtype='float32')
+                matrix.flush()
+
+                now = time.time()
+                with self._transaction(conn):
+                    conn.executemany('DELETE FROM free_rows WHERE row = ?', [(r,) for r in free])
+                    conn.executemany('INSERT OR REPLACE INTO vectors (key, row, last_access) VALUES (?, ?, ?)',
+                                     [(key, row, now) for (key, _), row in zip(new_items, rows)])
+                    conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', ('next_row', next_row))
+        except Exception as e:
+            print(f"تحذير: تعذرت الكتابة في مخزن المتجهات: {e}")
+
+    def _evict(self, conn, incoming: int) -> None:
+        max_rows = max(1, self.max_bytes // (self._dim * 4))
+        count = conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+        if count + incoming <= max_rows:
+            return
+        # نحرر 10% إضافية حتى لا يتكرر الإخلاء مع كل دفعة
+        to_free = min(count, count + incoming - max_rows + max_rows // 10)
+        victims = conn.execute('SELECT key, row FROM vectors ORDER BY last_access ASC LIMIT ?', (to_free,)).fetchall()
+        with self._transaction(conn):
+            conn.executemany('DELETE FROM vectors WHERE key = ?', [(k,) for k, _ in victims])
+            conn.executemany('INSERT OR IGNORE INTO free_rows (row) VALUES (?)', [(r,) for _, r in victims])
+        print(f"مخزن المتجهات: تم تحرير {len(victims)} صف.")
+
+    def stats(self) -> dict:
+        return {"name": self.model_name, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,148 @@
+# embedding_server.py
+# خادم ترميز محلي: نموذج واحد لكل جهاز بدل نسخة داخل كل عملية عامل.
+# يجمع الطلبات المتزامنة من كل العمال في دفعات ديناميكية (حجم أقصى + نافذة انتظار قصوى).
+# التشغيل: python embedding_server.py
+
+import json
+import time
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+from settings import SETTINGS
+
+_server_cfg = SETTINGS.get('embedding_server', {})
+MAX_BATCH = _server_cfg.get('max_batch', 64)
+MAX_LATENCY_MS = _server_cfg.get('max_latency_ms', 10)
+
+class _Request:
+    __slots__ = ('texts', 'normalize', 'event', 'result', 'error')
+
+    def __init__(self, texts: list[str], normalize: bool):
+        self.texts = texts
+        self.normalize = normalize
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class DynamicBatcher:
+    """
+    خيط واحد يستهلك طابور الطلبات: يأخذ أول طلب ثم ينتظر حتى max_latency_ms
+    لتجميع طلبات أخرى حتى max_batch نص، ثم يرمّزها في استدعاء واحد للنموذج.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = MAX_BATCH, max_latency_ms: int = MAX_LATENCY_MS):
+        self._encode = encode_fn
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        threading.Thread(target=self._loop, name='embedding-batcher', daemon=True).start()
+
+    def submit(self, texts: list[str], normalize: bool) -> np.ndarray:
+        req = _Request(texts, normalize)
+        self._queue.put(req)
+        req.event.wait()
+        if req.error:
+            raise req.error
+        return req.result
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            batch, count = [first], len(first.texts)
+            deadline = time.monotonic() + self.max_latency
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                count += len(req.texts)
+            self._run(batch)
+
+    def _run(self, batch: list[_Request]):
+        # الطلبات المطبّعة وغير المطبّعة تُرمَّز في مجموعتين منفصلتين
+        for normalize in (False, True):
+            group = [r for r in batch if r.normalize == normalize]
+            if not group:
+                continue
+            texts = [t for r in group for t in r.texts]
+            try:
+                vectors = np.asarray(self._encode(texts, normalize), dtype='float32')
+                offset = 0
+                for r in group:
+                    r.result = vectors[offset:offset + len(r.texts)]
+                    offset += len(r.texts)
+                self.batches += 1
+                self.texts += len(texts)
+            except Exception as e:
+                for r in group:
+                    r.error = e
+            for r in group:
+                r.event.set()
+
+def make_handler(batcher: DynamicBatcher):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urlparse(self.path).path != '/health':
+                self.send_error(404)
+                return
+            body = json.dumps({"status": "ok", "batches": batcher.batches, "texts": batcher.texts}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/encode':
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                texts = [str(t) for t in payload.get('texts', [])]
+                vectors = batcher.submit(texts, bool(payload.get('normalize', False))) if texts else np.zeros((0, 0), 'float32')
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            # المتجهات تعاد ثنائيًا (float32) مع البعد في ترويسة، أخف بكثير من JSON
+            body = np.ascontiguousarray(vectors, dtype='float32').tobytes()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('X-Embedding-Dim', str(vectors.shape[1] if vectors.ndim == 2 else 0))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # سجل كل طلب مزعج مع آلاف الطلبات الصغيرة
+
+    return EmbeddingHandler
+
+def serve():
+    from semantic_searcher import get_model
+
+    model = get_model()
+    if model is None:
+        raise SystemExit("تعذر تحميل النموذج؛ لن يبدأ خادم الترميز.")
+
+    def encode(texts, normalize):
+        return model.encode(texts, batch_size=MAX_BATCH, show_progress_bar=False, normalize_embeddings=normalize)
+
+    host = _server_cfg.get('host', '127.0.0.1')
+    port = _server_cfg.get('port', 8765)
+    ThreadingHTTPServer.request_queue_size = 128  # طلبات كثيرة متزامنة من كل العمال
+    server = ThreadingHTTPServer((host, port), make_handler(DynamicBatcher(encode)))
+    server.daemon_threads = True
+    print(f"خادم الترميز يعمل على http://{host}:{port} (دفعة {MAX_BATCH}، نافذة {MAX_LATENCY_MS}ms).")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,54 @@
+# import_budget.py
+# قياس زمن الاستيراد وذاكرة RSS لعمليتي الويب والعامل ومقارنتها بالميزانية في config.yaml.
+# التشغيل: python import_budget.py   (رمز الخروج 1 عند تجاوز أي ميزانية)
+
+import sys
+import json
+import subprocess
+from settings import SETTINGS
+
+# مكتبات لا يجوز أن تُحمّل عند مجرد الاستيراد (يجب أن تكون كسولة)
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'faiss', 'hdbscan', 'sklearn', 'google.generativeai', 'trafilatura']
+
+_PROBE = '''
+import sys, time, resource, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb,
+                   "heavy_loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def measure(module: str) -> dict:
+    """يستورد الوحدة في عملية مستقلة نظيفة ويعيد الزمن والذاكرة والمكتبات الثقيلة المحمّلة."""
+    out = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main() -> int:
+    budgets = SETTINGS.get('import_budget', {})
+    failed = False
+    report = {}
+    for process, budget in budgets.items():
+        result = measure(budget['module'])
+        problems = []
+        if result['seconds'] > budget['max_seconds']:
+            problems.append(f"زمن الاستيراد {result['seconds']:.2f}s > {budget['max_seconds']}s")
+        if result['rss_mb'] > budget['max_rss_mb']:
+            problems.append(f"الذاكرة {result['rss_mb']:.0f}MB > {budget['max_rss_mb']}MB")
+        if result['heavy_loaded']:
+            problems.append(f"مكتبات ثقيلة محمّلة عند الاستيراد: {', '.join(result['heavy_loaded'])}")
+        report[process] = dict(result, module=budget['module'], problems=problems)
+        status = "تجاوز" if problems else "ضمن الميزانية"
+        print(f"[{process}] import {budget['module']}: {result['seconds']:.2f}s، {result['rss_mb']:.0f}MB — {status}")
+        for p in problems:
+            print(f"    - {p}")
+        failed = failed or bool(problems)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
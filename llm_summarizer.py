@@ -1,8 +1,14 @@
 # llm_summarizer.py
 # تمت إضافة دوال محاكاة للاختبار دون استهلاك حصة API
 
-import google.generativeai as genai
+import re
+import time
+import hashlib
 from settings import SETTINGS
+from rate_limiter import rate_limited_generate, rate_limited_stream, load_genai
+from cache_store import PersistentCache
+from url_utils import canonicalize_url
+from semantic_searcher import encode_texts
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -24,9 +30,14 @@ def mock_generate_report_outline(query: str, facts: list[dict]) -> list[str]:
         "المحور الوهمي الثالث: الخاتمة"
     ]
 
-def mock_write_topic_content(topic_title: str, relevant_facts_with_sources: list[dict], reference_map: dict) -> str:
+def mock_write_topic_content(topic_title: str, relevant_facts_with_sources: list[dict], reference_map: dict,
+                             on_token=None, on_reset=None) -> str:
     print(f"--- [محاكاة] كتابة محتوى وهمي لمحور: '{topic_title}' ---")
-    return f"هذا نص وهمي تم إنشاؤه لمحور '{topic_title}'. النص يحتوي على تفاصيل ومعلومات وهمية [1] لغرض اختبار النظام وشكله النهائي [2]."
+    content = f"هذا نص وهمي تم إنشاؤه لمحور '{topic_title}'. النص يحتوي على تفاصيل ومعلومات وهمية [1] لغرض اختبار النظام وشكله النهائي [2]."
+    if on_token:
+        for word in content.split(' '):
+            on_token(word + ' ')
+    return content
 
 def mock_assemble_final_report(query: str, written_topics: dict) -> str:
     print("--- [محاكاة] تجميع تقرير وهمي نهائي ---")
@@ -42,32 +53,239 @@ def configure_gemini():
     google_api_key = SETTINGS.get('search_providers', {}).get('google_gemini', {}).get('api_key')
     if not google_api_key: return False
     try:
-        genai.configure(api_key=google_api_key)
+        load_genai().configure(api_key=google_api_key)
         return True
     except Exception: return False
 
-def _extract_facts_from_one_article(article: dict) -> list[dict]:
-    content, url = article.get('content'), article.get('url')
+def _extract_facts_from_one_article(article: dict) -> list[dict] | None:
+    """حقائق المقال ([] إن نجح الاستدعاء بلا حقائق)، أو None عند فشل الاستدعاء."""
+    content, url = _article_prompt_text(article), article.get('url')
     if not content or not url: return []
     prompt = SETTINGS.get('llm_prompts', {}).get('fact_extraction_prompt', '').format(context=content)
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
+        model = load_genai().GenerativeModel('gemini-1.5-flash')
+        response = rate_limited_generate(model, prompt)
         facts_text = [fact.strip() for fact in response.text.split('\n') if fact.strip()]
         return [{'text': fact, 'source_url': url} for fact in facts_text]
     except Exception as e:
         print(f"خطأ أثناء استخلاص الحقائق من {url}: {e}")
-        return []
+        return None
+
+# --- الاستخلاص على دفعات: عدة مقالات في أمر واحد ضمن ميزانية رموز ---
+_fact_cfg = SETTINGS.get('llm', {}).get('fact_extraction', {})
+CHARS_PER_TOKEN = 3  # تقدير محافظ (النص العربي أكثف رموزًا من الإنجليزي)
+_FACT_LINE_RE = re.compile(r'^\s*[\[(](\d+)[\])]\s*[-:.]?\s*(.+)$')
+
+def estimate_tokens(text: str) -> int:
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+def _article_prompt_text(article: dict) -> str:
+    """نص المقال كما يدخل الأمر (المقاطع المختارة إن وُجدت، انظر select_passages)، مقصوصًا عند max_article_tokens."""
+    max_chars = _fact_cfg.get('max_article_tokens', 3000) * CHARS_PER_TOKEN
+    return (article.get('passages') or article.get('content') or '')[:max_chars]
+
+# --- اختيار المقاطع قبل الاستخلاص: فقرات المقال الأوثق صلة بالاستعلام ضمن سقف رموز لكل مقال ---
+_passage_cfg = _fact_cfg.get('passage_selection', {})
+PASSAGE_SELECTION_ENABLED = _passage_cfg.get('enabled', True)
+PASSAGE_TOKENS = _passage_cfg.get('max_tokens_per_article', 800)
+PASSAGE_KEEP_LEAD = _passage_cfg.get('keep_lead', True)
+
+def select_passages(query: str, articles: list[dict], max_tokens: int = PASSAGE_TOKENS,
+                    keep_lead: bool = PASSAGE_KEEP_LEAD) -> list[dict]:
+    """
+    لكل مقال أطول من max_tokens: تُرمَّز فقراته (فقرة في كل سطر بعد text_processor.clean_articles)،
+    فقرات كل المقالات في استدعاء ترميز واحد، وتُقاس صلتها بالاستعلام دفعة واحدة (ضرب مصفوفة في متجه)،
+    ثم تُملأ الميزانية بالأعلى صلة وتُعاد بترتيبها الأصلي في article['passages'].
+    الفقرة الأولى (مقدمة الخبر: من، ماذا، متى) تبقى دائمًا إن كان keep_lead.
+    المقالات القصيرة تبقى كما هي؛ وعند تعذر الترميز يُستخدم النص المقصوص كالسابق.
+    """
+    if not query or not articles:
+        return articles
+    long_articles = [a for a in articles if estimate_tokens(a.get('content')) > max_tokens]
+    if not long_articles:
+        return articles
+    paragraphs = [[p for p in a['content'].split('\n') if p.strip()] for a in long_articles]
+    flat = [p for ps in paragraphs for p in ps]
+    try:
+        vectors = encode_texts([query] + flat, normalize=True)
+    except Exception as e:
+        print(f"تحذير: تعذر اختيار المقاطع ({e}); سيُستخدم نص المقال المقصوص.")
+        return articles
+    relevance = vectors[1:] @ vectors[0]
+
+    tokens_before = tokens_after = offset = 0
+    for article, ps in zip(long_articles, paragraphs):
+        scores = relevance[offset:offset + len(ps)]
+        offset += len(ps)
+        costs = [estimate_tokens(p) for p in ps]
+        chosen, used = set(), 0
+        order = ([0] if keep_lead else []) + sorted(range(len(ps)), key=lambda i: -scores[i])
+        for i in order:
+            if i not in chosen and used + costs[i] <= max_tokens:
+                chosen.add(i)
+                used += costs[i]
+        article['passages'] = '\n'.join(ps[i] for i in sorted(chosen))
+        tokens_before += estimate_tokens(article['content'])
+        tokens_after += estimate_tokens(article['passages'])
+    print(f"اختيار المقاطع: {len(long_articles)} مقال طويل، {tokens_before} ← {tokens_after} رمزًا تقديريًا.")
+    return articles
+
+def _pack_batches(articles: list) -> list[list[dict]]:
+    """تجميع المقالات بالترتيب في دفعات لا يتجاوز مجموع رموزها batch_token_budget."""
+    budget = _fact_cfg.get('batch_token_budget', 12000)
+    max_articles = _fact_cfg.get('max_articles_per_batch', 8)
+    batches, current, used = [], [], 0
+    for article in articles:
+        cost = estimate_tokens(_article_prompt_text(article))
+        if current and (used + cost > budget or len(current) >= max_articles):
+            batches.append(current)
+            current, used = [], 0
+        current.append(article)
+        used += cost
+    if current: batches.append(current)
+    return batches
+
+def _extract_facts_from_batch(batch: list[dict]) -> list[dict] | None:
+    """
+    استدعاء واحد لعدة مقالات. كل مقال يُوسم بمعرّف [n] ويُطلب أن تبدأ كل حقيقة بمعرّف مقالها،
+    فتبقى نسبة source_url صحيحة. يعيد None عند فشل الاستدعاء أو تعذر تحليل الرد
+    (ومنه قراءة response.text التي ترفع ValueError حين يُحجب الرد أو يعود فارغًا).
+    """
+    context = "\n\n".join(
+        f"[{i}] {article.get('title') or ''}\n{_article_prompt_text(article)}"
+        for i, article in enumerate(batch, start=1)
+    )
+    prompt = SETTINGS.get('llm_prompts', {}).get('batch_fact_extraction_prompt', '').format(context=context)
+    try:
+        model = load_genai().GenerativeModel('gemini-1.5-flash')
+        response = rate_limited_generate(model, prompt)
+        reply = response.text
+    except Exception as e:
+        print(f"خطأ أثناء استخلاص الحقائق لدفعة من {len(batch)} مقال: {e}")
+        return None
+    facts = []
+    for line in reply.split('\n'):
+        match = _FACT_LINE_RE.match(line)
+        if not match: continue
+        article_id = int(match.group(1))
+        if 1 <= article_id <= len(batch):
+            facts.append({'text': match.group(2).strip(), 'source_url': batch[article_id - 1]['url']})
+    if not facts:
+        print(f"تعذر تحليل رد الدفعة ({len(batch)} مقال): لا توجد أسطر موسومة بمعرّف مقال.")
+        return None
+    return facts
+
+def _extract_with_retry(batch: list[dict]) -> tuple[list[dict], set[str]]:
+    """
+    عند فشل دفعة تُقسم نصفين ويعاد فقط ما فشل؛ المقال المنفرد يرجع إلى الاستخلاص الفردي.
+    المقالات التي لم يُوسم لها أي سطر في رد ناجح تعاد وحدها أيضًا بدل أن تسقط بصمت.
+    يعيد الحقائق وروابط المقالات التي نجح استدعاؤها (ولو بلا حقائق)، فلا يُخزَّن إلا ما استُخلص فعلًا.
+    """
+    if len(batch) == 1:
+        facts = _extract_facts_from_one_article(batch[0])
+        return (facts, {batch[0]['url']}) if facts is not None else ([], set())
+    facts = _extract_facts_from_batch(batch)
+    if facts is None:
+        middle = len(batch) // 2
+        first_facts, first_done = _extract_with_retry(batch[:middle])
+        second_facts, second_done = _extract_with_retry(batch[middle:])
+        return first_facts + second_facts, first_done | second_done
+    tagged = {fact['source_url'] for fact in facts}
+    untagged = [article for article in batch if article['url'] not in tagged]
+    if untagged:
+        # الدفعة المعادة أصغر دائمًا من الأصلية (مقال موسوم واحد على الأقل)، فالتكرار ينتهي
+        print(f"دفعة من {len(batch)} مقال: {len(untagged)} بلا حقائق موسومة وسيعاد استخلاصها.")
+        retried_facts, retried_done = _extract_with_retry(untagged)
+        return facts + retried_facts, tagged | retried_done
+    return facts, tagged
+
+# --- مخزن دائم للحقائق لكل مقال: (رابط موحّد، بصمة المحتوى، [بصمة المقاطع]، نسخة أمر الاستخلاص) -> الحقائق ---
+# نفس المقال يظهر في تقارير كثيرة؛ لا يُرسل إلى Gemini مجددًا إلا إن تغير محتواه أو تغير الأمر.
+# حقائق المحتوى الكامل تصلح لأي استعلام، وحقائق المقاطع المختارة لا تُعاد إلا لنفس المقاطع.
+# متجهات هذه الحقائق محفوظة في فهرس المدوّنة (corpus_index.py) بمفتاح (الرابط، نص الحقيقة).
+_fact_store_cfg = SETTINGS.get('cache', {}).get('article_facts', {})
+_fact_store = PersistentCache(
+    'article_facts',
+    ttl_seconds=_fact_store_cfg.get('ttl_days', 30) * 24 * 3600,
+    max_bytes=_fact_store_cfg.get('max_mb', 200) * 1024 * 1024
+)
+FACT_MODEL_NAME = 'gemini-1.5-flash'  # يدخل في نسخة الأمر: تغيير النموذج يعيد الاستخلاص أيضًا
+
+def _fact_prompt_version() -> str:
+    """بصمة أمري الاستخلاص والنموذج: أي تعديل عليها في config.yaml يبطل الحقائق المخزنة تلقائيًا."""
+    prompts = SETTINGS.get('llm_prompts', {})
+    raw = '\n'.join([FACT_MODEL_NAME, prompts.get('fact_extraction_prompt', ''), prompts.get('batch_fact_extraction_prompt', '')])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+FACT_PROMPT_VERSION = _fact_prompt_version()
+
+def _fact_store_key(article: dict, passages: str | None = None) -> str:
+    """
+    مفتاح حقائق المقال. passages: المقاطع المختارة التي أُرسلت بدل المحتوى الكامل (انظر select_passages)؛
+    المقاطع تتبع الاستعلام، فحقائقها تحت مفتاح منفصل ولا تُعاد لاستعلام اختار مقاطع أخرى.
+    """
+    content_hash = hashlib.sha1((article.get('content') or '').encode('utf-8')).hexdigest()
+    parts = [canonicalize_url(article['url']), content_hash]
+    if passages:
+        parts.append(hashlib.sha1(passages.encode('utf-8')).hexdigest())
+    return PersistentCache.make_key(*parts, FACT_PROMPT_VERSION)
 
-def extract_key_facts_with_sources(articles: list) -> list[dict]:
+def _stored_facts(articles: list, passages: bool = False) -> tuple[list[dict], list]:
+    """حقائق المقالات الموجودة في المخزن (بمفتاح المقاطع المختارة إن كان passages)، والمقالات الباقية."""
+    facts, missing = [], []
+    for article in articles:
+        stored = _fact_store.get(_fact_store_key(article, article.get('passages') if passages else None))
+        if stored is None:
+            missing.append(article)
+        else:
+            facts.extend({'text': text, 'source_url': article['url']} for text in stored['facts'])
+    return facts, missing
+
+def _remember_facts(articles: list, facts: list[dict], extracted_urls: set[str]) -> None:
+    """
+    يخزن حقائق كل مقال نجح استدعاء استخلاصه، ولو بقائمة فارغة (مقال بلا حقائق لا يُرسل مجددًا كل تقرير).
+    المقالات التي فشل استدعاؤها لا تُخزن فتعاد في التقرير التالي.
+    """
+    by_url = {}
+    for fact in facts:
+        by_url.setdefault(fact['source_url'], []).append(fact['text'])
+    now = time.time()
+    for article in articles:
+        if article['url'] in extracted_urls:
+            _fact_store.set(_fact_store_key(article, article.get('passages')), {
+                "facts": by_url.get(article['url'], []), "prompt_version": FACT_PROMPT_VERSION, "extracted_at": now
+            })
+
+def extract_key_facts_with_sources(articles: list, query: str | None = None) -> list[dict]:
     print("--- بدء استخلاص الحقائق الأساسية مع مصادرها ---")
-    if not configure_gemini(): return []
-    all_facts = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futs = {executor.submit(_extract_facts_from_one_article, article) for article in articles}
+    articles = [a for a in articles if a.get('content') and a.get('url')]
+    for article in articles:
+        article.pop('passages', None)  # مقاطع استعلام سابق لا تحدد ما يُرسل الآن ولا مفتاح تخزينه
+    all_facts, pending = _stored_facts(articles)
+    # المقاطع تُختار لما ليس له حقائق من المحتوى الكامل فقط، وترتيب الحقائق حسب صلتها بالاستعلام
+    # يجري لاحقًا على الحقائق نفسها (find_relevant_chunks في مرحلة العنقدة) بلا استدعاء Gemini
+    if pending and query and PASSAGE_SELECTION_ENABLED:
+        pending = select_passages(query, pending)
+        passage_facts, pending = _stored_facts(pending, passages=True)
+        all_facts.extend(passage_facts)
+    print(f"مخزن الحقائق: {len(articles) - len(pending)} مقال من المخزن، {len(pending)} يحتاج استخلاصًا.")
+    if not pending or not configure_gemini(): return all_facts
+
+    if _fact_cfg.get('mode', 'batch') == 'batch':
+        batches, max_workers = _pack_batches(pending), _fact_cfg.get('max_parallel_batches', 4)
+        print(f"استخلاص على دفعات: {len(pending)} مقال في {len(batches)} استدعاء.")
+    else:
+        batches, max_workers = [[article] for article in pending], 10  # دفعة من مقال واحد = الاستخلاص الفردي
+    new_facts, extracted_urls = [], set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futs = {executor.submit(_extract_with_retry, batch) for batch in batches}
         for fut in as_completed(futs):
-            all_facts.extend(fut.result())
-    print(f"تم استخلاص {len(all_facts)} حقيقة من جميع المصادر.")
+            facts, done = fut.result()
+            new_facts.extend(facts)
+            extracted_urls |= done
+    _remember_facts(pending, new_facts, extracted_urls)
+    all_facts.extend(new_facts)
+    print(f"تم استخلاص {len(new_facts)} حقيقة جديدة ({len(all_facts)} مع المخزنة) من جميع المصادر.")
     return all_facts
 
 def generate_report_outline(query: str, facts: list[dict]) -> list[str]:
@@ -77,8 +295,8 @@ def generate_report_outline(query: str, facts: list[dict]) -> list[str]:
     prompt = SETTINGS.get('llm_prompts', {}).get('outline_generation_prompt', '').format(query=query, facts=facts_context)
     try:
         if not configure_gemini(): return []
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
+        model = load_genai().GenerativeModel('gemini-1.5-flash')
+        response = rate_limited_generate(model, prompt)
         outline = [title.strip() for title in response.text.split('\n') if title.strip()]
         print(f"تم إنشاء هيكل مكون من {len(outline)} محور.")
         return outline
@@ -86,7 +304,31 @@ def generate_report_outline(query: str, facts: list[dict]) -> list[str]:
         print(f"خطأ أثناء إنشاء الهيكل: {e}")
         return []
 
-def write_topic_content(topic_title: str, relevant_facts_with_sources: list[dict], reference_map: dict) -> str:
+_topic_cfg = SETTINGS.get('llm', {}).get('topic_writing', {})
+TOPIC_FACT_TOKENS = _topic_cfg.get('max_fact_tokens', 2000)
+
+def budget_topic_facts(facts: list[dict], reference_map: dict, max_tokens: int = TOPIC_FACT_TOKENS) -> list[dict]:
+    """
+    الحقائق مرتبة بالأقرب إلى مركز المحور؛ تُؤخذ من أولها حتى تمتلئ ميزانية الرموز
+    (حقيقة واحدة على الأقل)، فيبقى حجم أمر الكتابة وزمنها ثابتين مهما كبر العنقود.
+    """
+    selected, used = [], 0
+    for fact in facts:
+        cost = estimate_tokens(f"[{reference_map.get(fact['source_url'], 0)}] {fact['text']}\n")
+        if selected and used + cost > max_tokens:
+            break
+        selected.append(fact)
+        used += cost
+    if len(selected) < len(facts):
+        print(f"ميزانية المحور: {len(selected)} حقيقة من أصل {len(facts)} (~{used} رمز).")
+    return selected
+
+def write_topic_content(topic_title: str, relevant_facts_with_sources: list[dict], reference_map: dict,
+                        on_token=None, on_reset=None) -> str:
+    """
+    on_token: عند تمريرها يُطلب الرد بثًا (stream) وتُستدعى مع كل جزء نصي فور وصوله.
+    on_reset: تُستدعى إن انقطع البث بعد إرسال أجزاء، فيُمسح ما وصل قبل الإعادة أو نص الفشل.
+    """
     print(f"--- بدء كتابة محتوى محور: '{topic_title}' ---")
     if not relevant_facts_with_sources: return "لم يتم العثور على معلومات كافية."
     facts_context = ""
@@ -96,9 +338,14 @@ def write_topic_content(topic_title: str, relevant_facts_with_sources: list[dict
     prompt = SETTINGS.get('llm_prompts', {}).get('topic_writing_prompt', '').format(topic_title=topic_title, facts=facts_context)
     try:
         if not configure_gemini(): return "خدمة الذكاء الاصطناعي غير متاحة."
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
-        return response.text
+        model = load_genai().GenerativeModel('gemini-1.5-flash')
+        if on_token is None:
+            response = rate_limited_generate(model, prompt)
+            return response.text
+        content = rate_limited_stream(model, prompt, on_token, on_reset)
+        if not content:
+            raise ValueError("رد البث فارغ أو محجوب بالكامل")
+        return content
     except Exception as e:
         print(f"خطأ أثناء كتابة المحور '{topic_title}': {e}")
         return f"(فشلت كتابة هذا المحور)"
@@ -109,8 +356,8 @@ def assemble_final_report(query: str, written_topics: dict) -> str:
     prompt = SETTINGS.get('llm_prompts', {}).get('final_report_assembly_prompt', '').format(query=query, written_topics=topics_context)
     try:
         if not configure_gemini(): return "خدمة الذكاء الاصطناعي غير متاحة."
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
+        model = load_genai().GenerativeModel('gemini-1.5-flash')
+        response = rate_limited_generate(model, prompt)
         return response.text
     except Exception as e:
         print(f"خطأ أثناء تجميع التقرير النهائي: {e}")
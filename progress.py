@@ -0,0 +1,144 @@
+# progress.py
+# أحداث تقدّم التقرير: العامل ينشرها في Redis، وخادم الويب يبثها للعميل (SSE).
+# كل حدث يُضاف إلى قائمة خاصة بالمهمة (لإعادة التشغيل والاتصال من جديد عبر Last-Event-ID)
+# ويُنشر على قناة pub/sub لإيقاظ المستمعين فورًا. وحدة خفيفة يستوردها خادم الويب أيضًا.
+
+import json
+import time
+from settings import SETTINGS
+from redis_conn import get_redis
+
+_progress_cfg = SETTINGS.get('progress', {})
+EVENTS_TTL_SECONDS = _progress_cfg.get('events_ttl_hours', 24) * 3600
+KEEPALIVE_SECONDS = _progress_cfg.get('stream_keepalive_seconds', 15)
+# بث لمعرّف بلا أي حدث (مجهول أو انتهت صلاحية أحداثه) يُغلق بعد هذه المدة بدل أن يحجز خيطًا للأبد
+UNKNOWN_STREAM_SECONDS = _progress_cfg.get('unknown_stream_timeout_seconds', 300)
+
+# الأحداث التي تنهي البث
+TERMINAL_EVENTS = ('done', 'error')
+
+_warned = False
+
+def _events_key(task_id: str) -> str:
+    return f"report:{task_id}:events"
+
+def _channel(task_id: str) -> str:
+    return f"report:{task_id}:channel"
+
+def publish(task_id: str | None, event_type: str, **data) -> None:
+    """ينشر حدثًا؛ فشل Redis هنا لا يوقف توليد التقرير أبدًا."""
+    global _warned
+    if not task_id:
+        return
+    event = json.dumps({"type": event_type, "ts": round(time.time(), 3), "data": data}, ensure_ascii=False)
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        pipe.rpush(_events_key(task_id), event)
+        pipe.expire(_events_key(task_id), EVENTS_TTL_SECONDS)
+        pipe.publish(_channel(task_id), event_type)
+        pipe.execute()
+    except Exception as e:
+        if not _warned:
+            print(f"تحذير: تعذر نشر أحداث التقدم في Redis: {e}")
+            _warned = True
+
+def read_events(task_id: str, start: int = 0) -> list[dict]:
+    """الأحداث من الموضع start فصاعدًا؛ كل حدث يحمل رقمه (id) في القائمة."""
+    raw = get_redis().lrange(_events_key(task_id), start, -1)
+    events = []
+    for offset, item in enumerate(raw):
+        event = json.loads(item)
+        event['id'] = start + offset
+        events.append(event)
+    return events
+
+def _sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+def stream_events(task_id: str, start: int = 0, is_finished=None):
+    """
+    مولّد نص SSE: يرسل الأحداث المخزنة من start ثم ينتظر الجديد على قناة pub/sub.
+    is_finished: دالة اختيارية تُستدعى عند السكون لإنهاء البث إن انتهت المهمة دون حدث ختامي
+    (مثل عامل توقف فجأة). المعرّف الذي لا أحداث له بعد UNKNOWN_STREAM_SECONDS يُغلق بثه بحدث
+    stream_timeout (بلا id، فلا يتغير Last-Event-ID)؛ حالته تبقى متاحة عبر /report_status.
+    """
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_channel(task_id))
+    try:
+        cursor = start
+        opened = last_sent = time.monotonic()
+        while True:
+            events = read_events(task_id, cursor)
+            for event in events:
+                yield _sse(event)
+                cursor = event['id'] + 1
+                if event['type'] in TERMINAL_EVENTS:
+                    return
+            if events:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                if is_finished and is_finished():
+                    return
+                if time.monotonic() - opened >= UNKNOWN_STREAM_SECONDS and not get_redis().exists(_events_key(task_id)):
+                    yield f"event: stream_timeout\ndata: {json.dumps({'task_id': task_id})}\n\n"
+                    return
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            pubsub.get_message(timeout=1.0)
+    finally:
+        pubsub.close()
+
+class ReportProgress:
+    """
+    يربط مراحل التقرير (مهام Celery منفصلة) بأحداث التقدم. كل مرحلة تنشر حدثًا وتحدّث حالة
+    التقرير (report_id) إلى PROGRESS فيراها /report_status أيضًا، وكل محور يُنشر فور اكتمال كتابته.
+    الحالة المجمعة محفوظة في Redis لأن المراحل تعمل في عمليات وعمال مختلفين.
+    """
+
+    def __init__(self, task, report_id: str | None = None):
+        self.task = task
+        self.task_id = report_id or getattr(task.request, 'id', None)
+
+    def _update_state(self, stage_data: dict | None = None, section: tuple | None = None):
+        if not self.task_id:
+            return
+        meta_key, sections_key = f"report:{self.task_id}:meta", f"report:{self.task_id}:sections"
+        try:
+            pipe = get_redis().pipeline()
+            if stage_data:
+                pipe.hset(meta_key, mapping={k: json.dumps(v, ensure_ascii=False) for k, v in stage_data.items()})
+            if section:
+                pipe.hset(sections_key, section[0], section[1])
+            pipe.expire(meta_key, EVENTS_TTL_SECONDS)
+            pipe.expire(sections_key, EVENTS_TTL_SECONDS)
+            pipe.hgetall(meta_key)
+            pipe.hgetall(sections_key)
+            stored_meta, stored_sections = pipe.execute()[-2:]
+            meta = {k.decode(): json.loads(v) for k, v in stored_meta.items()}
+            meta['sections'] = {k.decode(): v.decode() for k, v in stored_sections.items()}
+            meta['sections_done'] = len(meta['sections'])
+            self.task.update_state(task_id=self.task_id, state='PROGRESS', meta=meta)
+        except Exception as e:
+            print(f"تحذير: تعذر تحديث حالة التقرير: {e}")
+
+    def stage(self, stage: str, **data) -> None:
+        publish(self.task_id, stage, **data)
+        self._update_state(stage_data=dict(data, stage=stage))
+
+    def token(self, topic_title: str, text: str) -> None:
+        publish(self.task_id, 'token', title=topic_title, text=text)
+
+    def reset_section(self, topic_title: str) -> None:
+        """انقطع بث المحور بعد إرسال أجزاء منه: يمسح العميل ما عرضه وينتظر إعادته أو حدث section."""
+        publish(self.task_id, 'section_reset', title=topic_title)
+
+    def section(self, topic_title: str, content: str) -> None:
+        publish(self.task_id, 'section', title=topic_title, content=content)
+        self._update_state(section=(topic_title, content))
+
+    def finish(self, **data) -> None:
+        publish(self.task_id, 'done', **data)
+
+    def fail(self, error: str) -> None:
+        publish(self.task_id, 'error', error=error)
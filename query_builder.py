@@ -1,8 +1,11 @@
 # query_builder.py
 
 import re
-import google.generativeai as genai
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from settings import SETTINGS
+from cache_store import PersistentCache
+from rate_limiter import rate_limited_generate, load_genai
 
 AR_LETTERS_RE = re.compile(r'[\u0600-\u06FF]')
 
@@ -24,17 +27,53 @@ NAIVE_EN_KEYWORDS = {
     'كوليرا': ['cholera'],
 }
 
+# --- مخزن دائم لإعادة صياغة الاستعلامات (مفتاحه: نوع الصياغة + نص الاستعلام الموحّد) ---
+_rewrite_cfg = SETTINGS.get('cache', {}).get('query_rewrites', {})
+_rewrite_cache = PersistentCache(
+    'query_rewrites',
+    ttl_seconds=_rewrite_cfg.get('ttl_days', 7) * 24 * 3600,
+    max_bytes=_rewrite_cfg.get('max_mb', 20) * 1024 * 1024
+)
+
+_gemini_lock = threading.Lock()
+_gemini_configured = False
+_gemini_model = None
+
 def _configure_gemini():
+    # الإعداد يتم مرة واحدة لكل عملية بدل تكراره مع كل استدعاء
+    global _gemini_configured
+    if _gemini_configured:
+        return True
     key = SETTINGS.get('search_providers', {}).get('google_gemini', {}).get('api_key')
     if not key:
         print("تحذير: لا يوجد مفتاح Gemini.")
         return False
-    try:
-        genai.configure(api_key=key)
-        return True
-    except Exception as e:
-        print(f"خطأ في إعداد Gemini: {e}")
-        return False
+    with _gemini_lock:
+        if _gemini_configured:
+            return True
+        try:
+            load_genai().configure(api_key=key)
+            _gemini_configured = True
+            return True
+        except Exception as e:
+            print(f"خطأ في إعداد Gemini: {e}")
+            return False
+
+def _get_model():
+    """نموذج Gemini مشترك يعاد استخدامه بدل بناء GenerativeModel جديد لكل طلب."""
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_lock:
+            if _gemini_model is None:
+                _gemini_model = load_genai().GenerativeModel('gemini-1.5-flash')
+    return _gemini_model
+
+def normalize_query_text(query: str) -> str:
+    """توحيد نص الاستعلام لاستخدامه كمفتاح تخزين (مسافات وحالة أحرف)."""
+    return " ".join((query or '').split()).casefold()
+
+def _rewrite_key(kind: str, query: str) -> str:
+    return PersistentCache.make_key(kind, normalize_query_text(query))
 
 def contains_arabic(txt: str) -> bool:
     return bool(AR_LETTERS_RE.search(txt or ''))
@@ -50,13 +89,19 @@ def generate_precise_query(user_query: str) -> str:
 
 def translate_query_for_search(query: str) -> str | None:
     print(f"--- محاولة ترجمة الاستعلام: '{query} ' ---")
+    cache_key = _rewrite_key('translate', query)
+    cached = _rewrite_cache.get(cache_key)
+    if cached:
+        return cached
     if not _configure_gemini():
         return None
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
         prompt = f"Translate this news search query to English, return only text:\n{query}"
-        resp = model.generate_content(prompt)
-        return resp.text.strip()
+        resp = rate_limited_generate(_get_model(), prompt)
+        translated = resp.text.strip()
+        if translated:
+            _rewrite_cache.set(cache_key, translated)
+        return translated
     except Exception as e:
         print(f"حدث خطأ أثناء الترجمة: {e}")
         return None
@@ -77,33 +122,45 @@ def naive_english_from_arabic(query: str) -> str | None:
 
 def expand_query_semantically(query: str) -> str:
     print(f"--- بدء التوسع الدلالي للاستعلام: '{query} ' ---")
+    cache_key = _rewrite_key('expand', query)
+    cached = _rewrite_cache.get(cache_key)
+    if cached:
+        return cached
     if not _configure_gemini():
         return generate_precise_query(query)
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
         prompt = (
             'أنت خبير تحسين استعلامات. ولّد 4 صيغ بديلة بالعربية والإنجليزية؛ '
             'ضع كل صيغة بين علامتي تنصيص وافصلها بـ OR. أعد السطر فقط.\n'
             f'الاستعلام: "{query}"'
         )
-        resp = model.generate_content(prompt)
-        return resp.text.strip().replace('\n', ' ')
+        resp = rate_limited_generate(_get_model(), prompt)
+        expanded = resp.text.strip().replace('\n', ' ')
+        if expanded:
+            _rewrite_cache.set(cache_key, expanded)
+        return expanded
     except Exception as e:
         print(f"حدث خطأ أثناء التوسع الدلالي: {e}")
         return generate_precise_query(query)
 
 def simplify_and_broaden_query(query: str) -> str:
     print(f"--- بدء التبسيط الذكي (المرحلة 3) للاستعلام: '{query}' ---")
+    cache_key = _rewrite_key('simplify', query)
+    cached = _rewrite_cache.get(cache_key)
+    if cached:
+        return cached
     try:
         if _configure_gemini():
-            model = genai.GenerativeModel('gemini-1.5-flash')
             prompt = (
                 'Simplify to core keywords in Arabic and English. '
                 'Separate with OR. No quotes or extra text.\n'
                 f'Original: "{query}"'
             )
-            resp = model.generate_content(prompt)
-            return resp.text.strip().replace('\n', ' ')
+            resp = rate_limited_generate(_get_model(), prompt)
+            broad = resp.text.strip().replace('\n', ' ')
+            if broad:
+                _rewrite_cache.set(cache_key, broad)
+                return broad
     except Exception as e:
         print(f"حدث خطأ أثناء تبسيط الاستعلام: {e}")
 
@@ -113,3 +170,21 @@ def simplify_and_broaden_query(query: str) -> str:
         return f"{query} OR {eng}"
     # وإلا نرجع الجملة كما هي
     return " ".join(query.split())
+
+def prepare_query_rewrites(query: str) -> dict:
+    """
+    تولّد الصياغات الثلاث (ترجمة، توسع دلالي، تبسيط) مرة واحدة وبالتوازي قبل البحث.
+    كل صياغة تُقرأ من المخزن الدائم أولًا، فالاستعلامات المتكررة لا تلمس Gemini إطلاقًا.
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        translated = executor.submit(translate_query_for_search, query)
+        expanded = executor.submit(expand_query_semantically, query)
+        broad = executor.submit(simplify_and_broaden_query, query)
+        rewrites = {
+            'translated': translated.result(),
+            'expanded': expanded.result(),
+            'broad': broad.result(),
+        }
+    stats = _rewrite_cache.stats()
+    print(f"مخزن صياغات الاستعلام: {stats['hits']} إصابة / {stats['misses']} إخفاق.")
+    return rewrites
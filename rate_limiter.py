@@ -0,0 +1,243 @@
+# rate_limiter.py
+# محدد معدل مشترك بين كل العمال لاستدعاءات Gemini (دلو رموز في Redis).
+# يتعلم من ردود 429 وRetry-After: يخفض المعدل إلى النصف ويوقف الجميع حتى انتهاء المهلة،
+# ثم يرفعه تدريجيًا مع كل نجاح (AIMD). عند تعذر Redis يعمل دلو محلي داخل العملية.
+
+import re
+import time
+import threading
+from settings import SETTINGS
+from redis_conn import REDIS_URL
+
+_limit_cfg = SETTINGS.get('llm', {}).get('rate_limit', {})
+
+def load_genai():
+    """استيراد google.generativeai عند أول استدعاء فعلي لـ Gemini فقط (مكتبة ثقيلة)؛ تستخدمه كل وحدات Gemini."""
+    import google.generativeai as genai
+    return genai
+
+# سكربت ذري: تعبئة الدلو حسب الزمن المنقضي ثم استهلاك رمز، أو إعادة زمن الانتظار المطلوب.
+# الزمن من خادم Redis نفسه حتى لا يؤثر اختلاف ساعات الأجهزة.
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cooldown_until = tonumber(redis.call('GET', KEYS[3]) or '0')
+if cooldown_until > now then
+  return tostring(cooldown_until - now)
+end
+local rpm = tonumber(redis.call('GET', KEYS[2]) or ARGV[1])
+local rate = rpm / 60
+local burst = tonumber(ARGV[2])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+class RateLimitExceeded(Exception):
+    """استنفاد محاولات الإعادة بعد ردود 429 متتالية."""
+
+class AdaptiveRateLimiter:
+    REDIS_RETRY_SECONDS = 30  # بعد فشل Redis نعمل محليًا هذه المدة قبل إعادة المحاولة
+
+    def __init__(self, name: str, requests_per_minute: float, min_requests_per_minute: float, burst: int):
+        self.name = name
+        self.max_rpm = requests_per_minute
+        self.min_rpm = min_requests_per_minute
+        self.burst = burst
+        self._keys = [f"ratelimit:{name}:bucket", f"ratelimit:{name}:rpm", f"ratelimit:{name}:cooldown"]
+        self._redis = None
+        self._script = None
+        self._redis_down_until = 0.0
+        # الحالة المحلية (بديل Redis)
+        self._lock = threading.Lock()
+        self._local_rpm = requests_per_minute
+        self._local_tokens = float(burst)
+        self._local_ts = time.monotonic()
+        self._local_cooldown_until = 0.0
+
+    def _client(self):
+        if time.time() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            try:
+                import redis
+                client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+                self._script = client.register_script(_ACQUIRE_LUA)
+                self._redis = client
+            except Exception as e:
+                self._redis_unavailable(e)
+                return None
+        return self._redis
+
+    def _redis_unavailable(self, error: Exception):
+        print(f"تحذير: Redis غير متاح لمحدد المعدل ({error}); سيتم التحديد محليًا.")
+        self._redis = None
+        self._redis_down_until = time.time() + self.REDIS_RETRY_SECONDS
+
+    def _try_acquire(self) -> float:
+        """تعيد 0 عند الحصول على رمز، وإلا عدد الثواني المطلوب انتظارها."""
+        client = self._client()
+        if client is not None:
+            try:
+                return float(self._script(keys=self._keys, args=[self.max_rpm, self.burst]))
+            except Exception as e:
+                self._redis_unavailable(e)
+        with self._lock:
+            now = time.monotonic()
+            if self._local_cooldown_until > now:
+                return self._local_cooldown_until - now
+            rate = self._local_rpm / 60
+            self._local_tokens = min(self.burst, self._local_tokens + (now - self._local_ts) * rate)
+            self._local_ts = now
+            if self._local_tokens >= 1:
+                self._local_tokens -= 1
+                return 0.0
+            return (1 - self._local_tokens) / rate
+
+    def acquire(self, timeout: float = 300) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"انتظار محدد المعدل '{self.name}' تجاوز {timeout} ثانية.")
+            time.sleep(min(wait, 5))
+
+    def _current_rpm(self, client) -> float:
+        value = client.get(self._keys[1])
+        return float(value) if value else self.max_rpm
+
+    def on_success(self) -> None:
+        """زيادة جمعية بطيئة للمعدل حتى السقف."""
+        step = max(1.0, self.max_rpm * 0.02)
+        client = self._client()
+        if client is not None:
+            try:
+                rpm = self._current_rpm(client)
+                if rpm < self.max_rpm:
+                    client.set(self._keys[1], min(self.max_rpm, rpm + step), ex=3600)
+                return
+            except Exception as e:
+                self._redis_unavailable(e)
+        with self._lock:
+            self._local_rpm = min(self.max_rpm, self._local_rpm + step)
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        """429: خفض المعدل إلى النصف وإيقاف كل العمال حتى انتهاء Retry-After."""
+        client = self._client()
+        if client is not None:
+            try:
+                new_rpm = max(self.min_rpm, self._current_rpm(client) / 2)
+                client.set(self._keys[1], new_rpm, ex=3600)
+                until = client.time()
+                until = until[0] + until[1] / 1_000_000 + retry_after
+                current = float(client.get(self._keys[2]) or 0)
+                if until > current:
+                    client.set(self._keys[2], until, ex=int(retry_after) + 1)
+                print(f"محدد المعدل '{self.name}': 429، المعدل الآن {new_rpm:.1f}/دقيقة، توقف {retry_after:.0f} ثانية.")
+                return
+            except Exception as e:
+                self._redis_unavailable(e)
+        with self._lock:
+            self._local_rpm = max(self.min_rpm, self._local_rpm / 2)
+            self._local_cooldown_until = max(self._local_cooldown_until, time.monotonic() + retry_after)
+
+_RETRY_PATTERNS = [
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'retry in\s*([\d.]+)\s*s', re.IGNORECASE),
+]
+
+def _rate_limit_delay(error: Exception) -> float | None:
+    """إن كان الخطأ 429 (ResourceExhausted) تعيد زمن الانتظار المقترح، وإلا None."""
+    code = getattr(error, 'code', None)
+    code = getattr(code, 'value', code)
+    message = str(error)
+    if code != 429 and type(error).__name__ != 'ResourceExhausted' and '429' not in message:
+        return None
+    response = getattr(error, 'response', None)
+    header = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return float(_limit_cfg.get('default_retry_after_seconds', 20))
+
+gemini_limiter = AdaptiveRateLimiter(
+    'gemini',
+    requests_per_minute=_limit_cfg.get('requests_per_minute', 60),
+    min_requests_per_minute=_limit_cfg.get('min_requests_per_minute', 5),
+    burst=_limit_cfg.get('burst', 10),
+)
+
+def rate_limited_generate(model, prompt, limiter: AdaptiveRateLimiter = gemini_limiter, **kwargs):
+    """
+    بديل model.generate_content لكل نقاط استدعاء Gemini: ينتظر رمزًا من الدلو المشترك،
+    ويعيد المحاولة بعد 429 حسب Retry-After حتى max_retries مرة.
+    """
+    max_retries = _limit_cfg.get('max_retries', 4)
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = model.generate_content(prompt, **kwargs)
+        except Exception as e:
+            delay = _rate_limit_delay(e)
+            if delay is None:
+                raise
+            limiter.on_rate_limited(delay)
+            if attempt == max_retries:
+                raise RateLimitExceeded(f"استُنفدت محاولات الإعادة بعد 429: {e}") from e
+            continue
+        limiter.on_success()
+        return response
+
+def _chunk_text(chunk) -> str:
+    """نص جزء من رد البث، أو '' للجزء الفارغ أو المحجوب (chunk.text يرفع ValueError فيه)."""
+    try:
+        return getattr(chunk, 'text', '') or ''
+    except ValueError:
+        return ''
+
+def rate_limited_stream(model, prompt, on_text, on_reset=None, limiter: AdaptiveRateLimiter = gemini_limiter, **kwargs) -> str:
+    """
+    مثل rate_limited_generate لكن بثًا: on_text تُستدعى مع كل جزء نصي فور وصوله، ويعاد النص كاملًا.
+    أخطاء البث تظهر أثناء قراءته لا عند فتحه، فـ 429 في أي جزء يُبلَّغ للمحدد ويعاد البث من البداية.
+    إن انقطع البث بعد وصول أجزاء تُستدعى on_reset أولًا ليمسح المستقبِل ما وصله (قبل الإعادة أو رفع الخطأ).
+    """
+    max_retries = _limit_cfg.get('max_retries', 4)
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        parts = []
+        try:
+            for chunk in model.generate_content(prompt, stream=True, **kwargs):
+                text = _chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    on_text(text)
+        except Exception as e:
+            if parts and on_reset is not None:
+                on_reset()
+            delay = _rate_limit_delay(e)
+            if delay is None:
+                raise
+            limiter.on_rate_limited(delay)
+            if attempt == max_retries:
+                raise RateLimitExceeded(f"استُنفدت محاولات الإعادة بعد 429: {e}") from e
+            continue
+        limiter.on_success()
+        return ''.join(parts)
@@ -0,0 +1,19 @@
+# redis_conn.py
+# اتصال Redis مشترك (كسول، واحد لكل عملية) لوحدات الحالة: أحداث التقدم ومخرجات المراحل.
+
+import threading
+from settings import SETTINGS
+
+REDIS_URL = SETTINGS.get('redis', {}).get('url', 'redis://localhost:6379/0')
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_redis():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(REDIS_URL, socket_timeout=5, socket_connect_timeout=2)
+    return _client
@@ -0,0 +1,99 @@
+# report_registry.py
+# تجميع الطلبات المتطابقة (single-flight): الاستعلامات المتطابقة بعد التوحيد تحصل على نفس
+# معرّف التقرير الجاري بدل إطلاق سلسلة جديدة، والتقارير المكتملة تُقدَّم من الذاكرة
+# ضمن نافذة صلاحية تختلف حسب period_days. وحدة خفيفة يستوردها خادم الويب والعامل.
+
+import re
+import uuid
+import hashlib
+from celery.result import AsyncResult
+from settings import SETTINGS
+from redis_conn import get_redis
+from task_signatures import celery_app, generate_report_signature
+
+_registry_cfg = SETTINGS.get('report_cache', {})
+INFLIGHT_TTL_SECONDS = _registry_cfg.get('inflight_timeout_minutes', 30) * 60
+# period_days -> دقائق الصلاحية؛ الفترات الطويلة تتغير أخبارها ببطء فتُقدَّم من الذاكرة مدة أطول
+FRESHNESS_MINUTES = {int(k): v for k, v in (_registry_cfg.get('freshness_minutes') or {1: 10, 7: 30, 14: 60, 30: 180}).items()}
+
+_ARABIC_DIACRITICS_RE = re.compile(r'[\u064B-\u065F\u0670\u0640]')
+_NON_WORD_RE = re.compile(r'[^\w\s]+')
+
+def normalize_report_query(query: str) -> str:
+    """توحيد يتجاهل الفروق التافهة: حالة الأحرف، المسافات، الترقيم، التشكيل، وصور الألف والياء والتاء."""
+    text = _ARABIC_DIACRITICS_RE.sub('', (query or '').casefold())
+    text = text.translate(str.maketrans('أإآىة', 'ااايه'))
+    return ' '.join(_NON_WORD_RE.sub(' ', text).split())
+
+def freshness_seconds(period_days: int) -> int:
+    """نافذة أصغر فترة مهيأة تغطي period_days، أو نافذة أكبر فترة إن تجاوزها."""
+    covering = [p for p in FRESHNESS_MINUTES if p >= period_days]
+    period = min(covering) if covering else max(FRESHNESS_MINUTES)
+    return int(FRESHNESS_MINUTES[period] * 60)
+
+def _registry_key(user_query: str, period_days: int) -> str:
+    digest = hashlib.sha1(f"{normalize_report_query(user_query)}|{period_days}".encode('utf-8')).hexdigest()
+    return f"report_registry:{digest}"
+
+def start_or_join_report(user_query: str, period_days: int) -> tuple[str, str]:
+    """
+    تعيد (معرّف التقرير، الحالة):
+    - 'cached': تقرير مكتمل وما زال ضمن نافذة الصلاحية.
+    - 'in_flight': تقرير مطابق قيد التوليد الآن؛ ينضم الطلب إليه.
+    - 'started': أُطلقت سلسلة جديدة.
+    """
+    key = _registry_key(user_query, period_days)
+    client = get_redis()
+
+    done_id = client.get(f"{key}:done")
+    if done_id and AsyncResult(done_id.decode(), app=celery_app).state == 'SUCCESS':
+        return done_id.decode(), 'cached'
+
+    for _ in range(3):
+        report_id = str(uuid.uuid4())
+        # SET NX: أول طلب فقط يطلق السلسلة، والبقية يقرؤون معرّفه
+        if client.set(f"{key}:inflight", report_id, nx=True, ex=INFLIGHT_TTL_SECONDS):
+            try:
+                client.set(f"report:{report_id}:registry_key", key, ex=INFLIGHT_TTL_SECONDS)
+                generate_report_signature(user_query, period_days, report_id=report_id).delay()
+            except Exception:
+                # السلسلة لم تُطلق (الوسيط متوقف مثلًا): لا يبقى حجز يشير إلى تقرير لن يعمل أبدًا
+                client.delete(f"{key}:inflight", f"report:{report_id}:registry_key")
+                raise
+            return report_id, 'started'
+        existing = client.get(f"{key}:inflight")
+        if existing is None:
+            continue  # انتهت صلاحيته بين الطلبين؛ نحاول الحجز من جديد
+        existing = existing.decode()
+        if AsyncResult(existing, app=celery_app).state == 'FAILURE':
+            # تقرير فاشل لم يُنظَّف (عامل توقف فجأة مثلًا): لا ننضم إليه
+            client.delete(f"{key}:inflight")
+            continue
+        return existing, 'in_flight'
+    raise RuntimeError("تعذر حجز تقرير جديد لهذا الاستعلام.")
+
+def publish_completed_report(user_query: str, period_days: int, report_id: str) -> None:
+    """تقرير جاهز من خارج مسار الطلبات (تحديث موضوع دائم) يُقدَّم لطلبات نفس الاستعلام."""
+    try:
+        get_redis().set(f"{_registry_key(user_query, period_days)}:done", report_id, ex=freshness_seconds(period_days))
+    except Exception as e:
+        print(f"تحذير: تعذر تحديث سجل التقارير: {e}")
+
+def complete_report(report_id: str, succeeded: bool, period_days: int | None = None) -> None:
+    """
+    يستدعيها العامل عند انتهاء التقرير: تحرير الحجز، وحفظه في الذاكرة إن نجح.
+    عند النجاح تُستدعى بعد تخزين النتيجة (on_success في tasks.ReportResultTask)، فمعرّف :done حالته SUCCESS دائمًا.
+    """
+    try:
+        client = get_redis()
+        key = client.get(f"report:{report_id}:registry_key")
+        if not key:
+            return
+        key = key.decode()
+        inflight = client.get(f"{key}:inflight")
+        if inflight and inflight.decode() == report_id:
+            client.delete(f"{key}:inflight")
+        if succeeded and period_days is not None:
+            client.set(f"{key}:done", report_id, ex=freshness_seconds(period_days))
+    except Exception as e:
+        print(f"تحذير: تعذر تحديث سجل التقارير: {e}")
@@ -1,19 +1,69 @@
 # search_service.py (إضافات مهمّة)
 
-import requests, re, urllib.parse
+import requests, re, urllib.parse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 from settings import SETTINGS
+from cache_store import PersistentCache
 from query_builder import (
     generate_precise_query,
-    translate_query_for_search,
-    expand_query_semantically,
-    simplify_and_broaden_query,
+    prepare_query_rewrites,
     contains_arabic, naive_english_from_arabic
 )
 
 MIN_RESULTS = 40
 MAX_RESULTS = 60
 PER_DOMAIN_CAP = 3  # حد أعلى لكل دومين لزيادة التنويع
+MAX_PARALLEL_REQUESTS = 16  # أقصى عدد طلبات متزامنة نحو مزودي البحث
+
+_session = None
+_session_lock = threading.Lock()
+
+# --- مخزن مؤقت لاستجابات المزودين (مفتاحه: مزود، subquery، لغة، نمط، نافذة زمنية مقرّبة) ---
+_cache_cfg = SETTINGS.get('cache', {}).get('search_responses', {})
+WINDOW_BUCKET_MINUTES = _cache_cfg.get('window_bucket_minutes', 60)
+_response_cache = PersistentCache(
+    'search_responses',
+    ttl_seconds=_cache_cfg.get('ttl_minutes', 30) * 60,
+    max_bytes=_cache_cfg.get('max_mb', 200) * 1024 * 1024
+)
+
+def get_search_cache_stats() -> dict:
+    """عدادات الإصابة/الإخفاق لمخزن استجابات البحث."""
+    return _response_cache.stats()
+
+def _bucketed_from_date(period_days: int) -> str:
+    """
+    تاريخ بداية النافذة مقرّبًا للأسفل إلى حدود WINDOW_BUCKET_MINUTES،
+    حتى تتطابق مفاتيح التخزين بين عمليات البحث المتقاربة زمنيًا (بدل الدقة بالثانية).
+    """
+    now = datetime.now()
+    bucket = max(1, WINDOW_BUCKET_MINUTES)
+    minutes = (now.hour * 60 + now.minute) // bucket * bucket
+    floored = now.replace(hour=minutes // 60 % 24, minute=minutes % 60, second=0, microsecond=0)
+    return (floored - timedelta(days=period_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _window_start(period_days: int, since: str | None) -> str:
+    """بداية النافذة: الأحدث بين (الآن - period_days) والعلامة المائية since (تحديث تزايدي)."""
+    start = _bucketed_from_date(period_days)
+    return max(start, since) if since else start
+
+def _get_session() -> requests.Session:
+    """
+    جلسة HTTP مشتركة بمجمّع اتصالات keep-alive، يعاد استخدامها في كل الطلبات المتوازية
+    بدل فتح اتصال TLS جديد مع كل requests.get.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_PARALLEL_REQUESTS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
 
 def _split_or_query(q: str) -> list[str]:
     parts = [p.strip().strip('"') for p in q.split('OR')]
@@ -54,6 +104,10 @@ def _enforce_diversity_and_limit(articles: list, max_count=MAX_RESULTS, per_doma
     return diversified
 
 def _try_newsapi_one_mode(q: str, from_date: str, lang: str, mode: str, api_key: str, base_url: str, timeout_sec=12) -> dict:
+    cache_key = PersistentCache.make_key('newsapi', q, lang, mode, from_date)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
     params = {
         'apiKey': api_key,
         'from': from_date,
@@ -63,83 +117,126 @@ def _try_newsapi_one_mode(q: str, from_date: str, lang: str, mode: str, api_key:
     }
     params[mode] = q
     try:
-        r = requests.get(base_url, params=params, timeout=timeout_sec)
+        r = _get_session().get(base_url, params=params, timeout=timeout_sec)
         if r.status_code != 200:
             print(f"NewsAPI {lang}/{mode} HTTP {r.status_code}: {r.text[:160]}")
             return {}
         data = r.json() or {}
         arts = data.get('articles', []) or []
-        return {a.get('url'): a for a in arts if a.get('url')}
+        found = {a.get('url'): a for a in arts if a.get('url')}
+        _response_cache.set(cache_key, found)
+        return found
     except Exception as e:
         print(f"NewsAPI error ({lang}/{mode}): {e}")
         return {}
 
-def _fetch_from_newsapi(query: str, period_days: int, timeout_sec=12) -> dict:
-    print(f"--- محاولة البحث في NewsAPI عن: '{query}' ---")
+def _try_gnews_one_lang(q: str, from_date: str, lang: str, api_key: str, base_url: str, timeout_sec=15) -> dict:
+    cache_key = PersistentCache.make_key('gnews', q, lang, from_date)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    params = {'q': q, 'apikey': api_key, 'from': from_date, 'max': 100, 'lang': lang}
+    try:
+        r = _get_session().get(base_url, params=params, timeout=timeout_sec)
+        if r.status_code != 200:
+            print(f"GNews {lang} HTTP {r.status_code}: {r.text[:160]}")
+            return {}
+        combined = {}
+        for a in (r.json() or {}).get('articles', []) or []:
+            url = a.get('url')
+            if not url: continue
+            combined[url] = {
+                'source': {'name': (a.get('source') or {}).get('name', 'غير معروف')},
+                'title': a.get('title'),
+                'url': url,
+                'description': a.get('description'),
+                'publishedAt': a.get('publishedAt'),
+                'urlToImage': a.get('image'),
+                'content': a.get('content')
+            }
+        _response_cache.set(cache_key, combined)
+        return combined
+    except Exception as e:
+        print(f"GNews error ({lang}): {e}")
+        return {}
+
+def _newsapi_calls(query: str, period_days: int, timeout_sec=12, since: str | None = None) -> list:
+    """تبني قائمة استدعاءات NewsAPI (subquery × لغة × نمط) دون تنفيذها."""
     cfg = SETTINGS.get('search_providers', {}).get('newsapi', {})
     api_key, base_url = cfg.get('api_key'), cfg.get('base_url')
     if not api_key or not base_url:
-        return {"success": False, "articles": []}
+        return []
 
-    from_date = (datetime.now() - timedelta(days=period_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    from_date = _window_start(period_days, since)
     subqueries = _split_or_query(query) or [query]
-
-    combined = {}
     languages = ['ar', 'en']      # نجرب الاثنين دائمًا
     modes = ['q', 'qInTitle']     # بحث عام + عنوان فقط
 
-    for sq in subqueries:
-        for lang in languages:
-            for mode in modes:
-                got = _try_newsapi_one_mode(sq, from_date, lang, mode, api_key, base_url, timeout_sec=timeout_sec)
-                combined.update(got)
-
-    if combined:
-        print(f"نجح البحث في NewsAPI: {len(combined)} مقال (مجمّع).")
-        return {"success": True, "articles": list(combined.values())}
-    print("فشل البحث في NewsAPI.")
-    return {"success": False, "articles": []}
+    return [
+        (lambda sq=sq, lang=lang, mode=mode:
+            _try_newsapi_one_mode(sq, from_date, lang, mode, api_key, base_url, timeout_sec=timeout_sec))
+        for sq in subqueries for lang in languages for mode in modes
+    ]
 
-def _fetch_from_gnews(query: str, period_days: int, timeout_sec=15) -> dict:
-    print(f"--- (احتياطي) محاولة البحث في GNews عن: '{query}' ---")
+def _gnews_calls(query: str, period_days: int, timeout_sec=15, since: str | None = None) -> list:
+    """تبني قائمة استدعاءات GNews (subquery × لغة) دون تنفيذها."""
     cfg = SETTINGS.get('search_providers', {}).get('gnews', {})
     api_key, base_url = cfg.get('api_key'), cfg.get('base_url')
     if not api_key or not base_url:
-        return {"success": False, "articles": []}
+        return []
 
-    from_date = (datetime.now() - timedelta(days=period_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    from_date = _window_start(period_days, since)
     subqueries = _split_or_query(query) or [query]
 
-    combined = {}
-    for sq in subqueries:
-        for lang in ['ar', 'en']:   # صريحتين بدل any
-            params = {'q': sq, 'apikey': api_key, 'from': from_date, 'max': 100, 'lang': lang}
+    return [
+        (lambda sq=sq, lang=lang:
+            _try_gnews_one_lang(sq, from_date, lang, api_key, base_url, timeout_sec=timeout_sec))
+        for sq in subqueries for lang in ['ar', 'en']   # صريحتين بدل any
+    ]
+
+def _fan_out(calls: list, all_found: dict, min_results: int | None = MIN_RESULTS) -> int:
+    """
+    تنفذ الاستدعاءات بالتوازي وتدمج نتائجها في all_found فور وصولها.
+    عند بلوغ min_results رابطًا فريدًا تُلغى الاستدعاءات التي لم تبدأ بعد،
+    ولا ننتظر الجارية منها (مهلتها تحدّها على أي حال).
+    تعيد عدد المقالات الجديدة المضافة.
+    """
+    if not calls or (min_results and len(all_found) >= min_results):
+        return 0
+
+    before = len(all_found)
+    executor = ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_REQUESTS, len(calls)))
+    try:
+        futures = [executor.submit(call) for call in calls]
+        for fut in as_completed(futures):
             try:
-                r = requests.get(base_url, params=params, timeout=timeout_sec)
-                if r.status_code != 200:
-                    print(f"GNews {lang} HTTP {r.status_code}: {r.text[:160]}")
-                    continue
-                for a in (r.json() or {}).get('articles', []) or []:
-                    url = a.get('url')
-                    if not url: continue
-                    combined[url] = {
-                        'source': {'name': (a.get('source') or {}).get('name', 'غير معروف')},
-                        'title': a.get('title'),
-                        'url': url,
-                        'description': a.get('description'),
-                        'publishedAt': a.get('publishedAt'),
-                        'urlToImage': a.get('image'),
-                        'content': a.get('content')
-                    }
+                got = fut.result()
             except Exception as e:
-                print(f"GNews error ({lang}): {e}")
+                print(f"خطأ في أحد طلبات البحث المتوازية: {e}")
                 continue
+            for url, a in got.items():
+                all_found[url] = a
+            if min_results and len(all_found) >= min_results:
+                print(f"تم بلوغ الحد الأدنى ({min_results}) مبكرًا؛ إلغاء الطلبات المتبقية.")
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return len(all_found) - before
 
-    if combined:
-        print(f"نجح البحث في GNews: {len(combined)} مقال (مجمّع).")
-        return {"success": True, "articles": list(combined.values())}
-    print("فشل البحث في GNews.")
-    return {"success": False, "articles": []}
+def _search_stage(query: str, period_days: int, all_found: dict, newsapi_timeout=12, gnews_timeout=15, since: str | None = None) -> None:
+    """
+    مرحلة بحث واحدة: استدعاءات NewsAPI كلها تنطلق معًا بدل التسلسل، فيصبح زمنها محدودًا بأبطأ
+    استدعاء مفيد لا بمجموعها. GNews يبقى احتياطيًا (حصته اليومية أصغر): استدعاءاته، المتوازية أيضًا،
+    لا تُطلق إلا إن لم تبلغ نتائج NewsAPI الحد الأدنى.
+    """
+    print(f"--- بحث متوازٍ في NewsAPI عن: '{query}' ---")
+    added = _fan_out(_newsapi_calls(query, period_days, timeout_sec=newsapi_timeout, since=since),
+                     all_found, min_results=MIN_RESULTS)
+    if len(all_found) < MIN_RESULTS:
+        print(f"--- (احتياطي) بحث متوازٍ في GNews عن: '{query}' ---")
+        added += _fan_out(_gnews_calls(query, period_days, timeout_sec=gnews_timeout, since=since),
+                          all_found, min_results=MIN_RESULTS)
+    print(f"أضافت المرحلة {added} مقال؛ المجموع الحالي {len(all_found)}.")
 
 def _broaden_strategies(user_query: str, stage: int, base_period: int) -> tuple[str, int]:
     """
@@ -156,14 +253,20 @@ def _broaden_strategies(user_query: str, stage: int, base_period: int) -> tuple[
         return q, min(base_period * 2, 60)  # لا نتجاوز 60 يومًا افتراضيًا
     return user_query, base_period
 
-def fetch_articles_from_all_providers(user_query: str, period_days: int) -> dict:
+def fetch_articles_from_all_providers(user_query: str, period_days: int, since: str | None = None) -> dict:
+    """
+    since: علامة مائية (ISO 8601 UTC)؛ عند تمريرها تُجلب المقالات المنشورة بعدها فقط (تحديث تزايدي
+    للمواضيع الدائمة)، ولا تُضاعف الفترة في مرحلة التوسيع الأخيرة.
+    """
     try:
         all_found = {}
 
         # STAGE 0: بحث دقيق + نسخة إنجليزية إن أمكن
         print("\n--- المرحلة 1: البحث الدقيق ---")
+        # كل صياغات Gemini تُحضّر مسبقًا دفعة واحدة (ومن المخزن إن توفرت)
+        rewrites = prepare_query_rewrites(user_query)
         precise = generate_precise_query(user_query)
-        translated = translate_query_for_search(user_query)
+        translated = rewrites['translated']
         if not translated and contains_arabic(user_query):
             naive_eng = naive_english_from_arabic(user_query)
             if naive_eng:
@@ -172,52 +275,30 @@ def fetch_articles_from_all_providers(user_query: str, period_days: int) -> dict
         if translated and translated.lower() != user_query.lower():
             precise_mix += f" OR {generate_precise_query(translated)}"
 
-        # جرّب NewsAPI
-        res = _fetch_from_newsapi(precise_mix, period_days, timeout_sec=12)
-        if res.get('success'):
-            for a in res['articles']: all_found[a['url']] = a
-
-        # لو أقل من الحد الأدنى، GNews
-        if len(all_found) < MIN_RESULTS:
-            res = _fetch_from_gnews(precise_mix, period_days, timeout_sec=15)
-            if res.get('success'):
-                for a in res['articles']: all_found[a['url']] = a
+        # NewsAPI ثم GNews احتياطيًا، مع قطع مبكر عند بلوغ الحد الأدنى
+        _search_stage(precise_mix, period_days, all_found, newsapi_timeout=12, gnews_timeout=15, since=since)
 
         # STAGE 1: توسع دلالي
         if len(all_found) < MIN_RESULTS:
             print("\n--- المرحلة 2: التوسع الدلالي ---")
-            expanded = expand_query_semantically(user_query)
-            res = _fetch_from_newsapi(expanded, period_days, timeout_sec=12)
-            if res.get('success'):
-                for a in res['articles']: all_found[a['url']] = a
-            if len(all_found) < MIN_RESULTS:
-                res = _fetch_from_gnews(expanded, period_days, timeout_sec=15)
-                if res.get('success'):
-                    for a in res['articles']: all_found[a['url']] = a
+            expanded = rewrites['expanded']
+            _search_stage(expanded, period_days, all_found, newsapi_timeout=12, gnews_timeout=15, since=since)
 
         # STAGE 2: تبسيط/توسيع
         if len(all_found) < MIN_RESULTS:
             print("\n--- المرحلة 3: التبسيط ---")
-            broad = simplify_and_broaden_query(user_query)
-            res = _fetch_from_newsapi(broad, period_days, timeout_sec=12)
-            if res.get('success'):
-                for a in res['articles']: all_found[a['url']] = a
-            if len(all_found) < MIN_RESULTS:
-                res = _fetch_from_gnews(broad, period_days, timeout_sec=15)
-                if res.get('success'):
-                    for a in res['articles']: all_found[a['url']] = a
+            broad = rewrites['broad']
+            _search_stage(broad, period_days, all_found, newsapi_timeout=12, gnews_timeout=15, since=since)
 
         # STAGE 3: توسيع إضافي قوي (إزالة اقتباسات + مضاعفة المدة)
-        if len(all_found) < MIN_RESULTS:
+        if len(all_found) < MIN_RESULTS and not since:
             print("\n--- المرحلة 4: توسيع إضافي ---")
             q4, pd4 = _broaden_strategies(user_query, stage=3, base_period=period_days)
-            res = _fetch_from_newsapi(q4, pd4, timeout_sec=15)
-            if res.get('success'):
-                for a in res['articles']: all_found[a['url']] = a
-            if len(all_found) < MIN_RESULTS:
-                res = _fetch_from_gnews(q4, pd4, timeout_sec=20)
-                if res.get('success'):
-                    for a in res['articles']: all_found[a['url']] = a
+            _search_stage(q4, pd4, all_found, newsapi_timeout=15, gnews_timeout=20)
+
+        if since:
+            # المزودون يعاملون from كحد شامل: نستبعد ما نُشر عند العلامة نفسها أو قبلها
+            all_found = {url: a for url, a in all_found.items() if (a.get('publishedAt') or '') > since}
 
         if not all_found:
             return {"success": False, "articles": []}
@@ -225,6 +306,8 @@ def fetch_articles_from_all_providers(user_query: str, period_days: int) -> dict
         # تنويع + قطع للحد الأعلى
         diversified = _enforce_diversity_and_limit(list(all_found.values()), max_count=MAX_RESULTS, per_domain_cap=PER_DOMAIN_CAP)
         print(f"\nاكتمل البحث: {len(diversified)} مقال (بعد التنويع والقصّ).")
+        stats = get_search_cache_stats()
+        print(f"مخزن استجابات البحث: {stats['hits']} إصابة / {stats['misses']} إخفاق.")
         return {"success": True, "articles": diversified}
     except Exception as e:
         print(f"[fetch_articles_from_all_providers] خطأ غير متوقع: {e}")
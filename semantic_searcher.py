@@ -1,56 +1,186 @@
 # semantic_searcher.py
 # هذا الملف مسؤول عن تحويل النصوص إلى متجهات وفهرستها للبحث الدلالي.
 
-import faiss
+import time
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import requests
+from settings import SETTINGS
+from embedding_cache import EmbeddingCache, embedding_key
 
-# --- تحميل النموذج ---
-# يتم تحميل النموذج مرة واحدة فقط عند بدء تشغيل الخادم لتوفير الوقت.
-try:
-    print("بدء تحميل نموذج تحويل الجمل (قد يستغرق بعض الوقت في المرة الأولى)...")
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    print("تم تحميل النموذج بنجاح.")
-except Exception as e:
-    print(f"خطأ فادح: فشل تحميل نموذج SentenceTransformer. تأكد من اتصالك بالإنترنت. الخطأ: {e}")
-    model = None
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
 
-def create_vector_index(chunks: list[dict]):
+# --- خادم الترميز المشترك (embedding_server.py) ---
+# إن كان يعمل على نفس الجهاز تُرسل إليه طلبات الترميز بدل تحميل نسخة من النموذج في كل عامل.
+_server_cfg = SETTINGS.get('embedding_server', {})
+EMBEDDING_SERVER_URL = (
+    f"http://{_server_cfg.get('host', '127.0.0.1')}:{_server_cfg.get('port', 8765)}"
+    if _server_cfg.get('enabled', True) else None
+)
+# الخادم يبدأ مع العمال (Procfile) ولا يستمع إلا بعد تحميل نموذجه: ننتظره هذه المدة قبل التحميل داخل العامل
+SERVER_WAIT_SECONDS = _server_cfg.get('startup_wait_seconds', 120)
+HEALTH_CACHE_SECONDS = 5   # نتيجة فحص /health تُستخدم هذه المدة دون طلب جديد
+
+_model = None
+_model_failed = False
+_model_lock = threading.Lock()
+_health = (0.0, False)     # (وقت آخر فحص، هل الخادم يستجيب)
+_server_waited = False     # انتظار بدء الخادم مرة واحدة في عمر العملية
+_http = requests.Session()
+
+def get_model():
+    """
+    تحميل النموذج داخل العملية عند أول حاجة فعلية فقط (عند غياب خادم الترميز).
+    يعيد None إن فشل التحميل.
     """
-    تستقبل قائمة من مقاطع النص، تنشئ متجهات لها، وتبني فهرس FAISS.
-    --- محدث: يعيد الآن مصفوفة المتجهات الكاملة ---
+    global _model, _model_failed
+    if _model is None and not _model_failed:
+        with _model_lock:
+            if _model is None and not _model_failed:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    print("بدء تحميل نموذج تحويل الجمل (قد يستغرق بعض الوقت في المرة الأولى)...")
+                    _model = SentenceTransformer(MODEL_NAME)
+                    print("تم تحميل النموذج بنجاح.")
+                except Exception as e:
+                    print(f"خطأ فادح: فشل تحميل نموذج SentenceTransformer. تأكد من اتصالك بالإنترنت. الخطأ: {e}")
+                    _model_failed = True
+    return _model
+
+def _server_ready() -> bool:
+    """
+    هل خادم الترميز يستجيب؟ فحص /health مخزن HEALTH_CACHE_SECONDS، فلا طلب شبكة مع كل استدعاء.
+    في أول استدعاء فقط ننتظر الخادم حتى SERVER_WAIT_SECONDS، بدل أن يحمّل كل عامل سبقه عند البدء
+    نسخته الخاصة من النموذج؛ لا انتظار بعدها، ولا إن كان النموذج قد حُمّل أو فشل تحميله.
     """
+    global _health, _server_waited
+    if not EMBEDDING_SERVER_URL:
+        return False
+    wait = not (_server_waited or _model is not None or _model_failed)
+    deadline = time.time() + (SERVER_WAIT_SECONDS if wait else 0)
+    interval = HEALTH_CACHE_SECONDS
+    while True:
+        checked_at, ok = _health
+        if time.time() - checked_at >= interval:
+            try:
+                ok = _http.get(f"{EMBEDDING_SERVER_URL}/health", timeout=0.5).ok
+            except Exception:
+                ok = False
+            _health = (time.time(), ok)
+        if ok or time.time() >= deadline:
+            _server_waited = _server_waited or wait  # بعد انتهاء الانتظار الأول (الطلبات المتزامنة معه تنتظر أيضًا)
+            return ok
+        if interval:
+            print(f"انتظار خادم الترميز (حتى {SERVER_WAIT_SECONDS} ثانية) قبل تحميل النموذج داخل العملية...")
+            interval = 0  # أثناء الانتظار: فحص كل ثانية
+        time.sleep(1)
+
+def _encode_remote(texts: list[str], normalize: bool) -> np.ndarray | None:
+    """ترميز عبر خادم الترميز المشترك؛ يعيد None إن لم يكن متاحًا."""
+    global _health
+    try:
+        r = _http.post(f"{EMBEDDING_SERVER_URL}/encode", json={'texts': texts, 'normalize': normalize}, timeout=(2, 300))
+        r.raise_for_status()
+        dim = int(r.headers['X-Embedding-Dim'])
+        return np.frombuffer(r.content, dtype='float32').reshape(len(texts), dim)
+    except Exception as e:
+        _health = (time.time(), False)
+        print(f"فشل الترميز عبر الخادم ({e}).")
+        return None
+
+def _encode_uncached(texts: list[str], normalize: bool) -> np.ndarray:
+    # محاولة ثانية بعد انتظار الخادم إن انقطع أثناء الطلب (إعادة تشغيل مثلًا)؛ بعدها فقط النموذج المحلي
+    for _ in range(2):
+        if not _server_ready():
+            break
+        vectors = _encode_remote(texts, normalize)
+        if vectors is not None:
+            return vectors
+    if EMBEDDING_SERVER_URL and _model is None:
+        print("خادم الترميز غير متاح؛ سيتم الترميز داخل العملية.")
+    model = get_model()
     if not model:
-        return None, None, None
-    if not chunks:
-        return None, None, None
-
-    texts = [chunk['text'] for chunk in chunks]
-    embeddings = model.encode(texts, show_progress_bar=False)
-    embeddings = np.array(embeddings).astype('float32')
-    
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
-    
-    print(f"تم بناء الفهرس بنجاح ويحتوي على {index.ntotal} متجه.")
-    return index, chunks, embeddings
-
-def find_relevant_chunks(query: str, index: faiss.Index, all_embeddings: np.ndarray, chunks_map: list[dict], top_k: int = 5) -> tuple:
-    """
-    تبحث في الفهرس عن أقرب المقاطع للاستعلام من حيث المعنى.
-    --- محدث: يعيد الآن المقاطع ومتجهاتها ---
-    """
-    if not model or not index:
-        return [], np.array([])
-
-    query_vector = model.encode([query])
-    query_vector = np.array(query_vector).astype('float32')
-    
-    distances, indices = index.search(query_vector, top_k)
-    
-    relevant_indices = [i for i in indices[0] if i < len(chunks_map)]
-    relevant_chunks = [chunks_map[i] for i in relevant_indices]
-    relevant_embeddings = np.array([all_embeddings[i] for i in relevant_indices])
-    
-    print(f"تم العثور على {len(relevant_chunks)} مقطع ذي صلة.")
-    return relevant_chunks, relevant_embeddings
\ No newline at end of file
+        raise RuntimeError("نموذج SentenceTransformer غير متاح.")
+    return np.asarray(model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False,
+                                   normalize_embeddings=normalize), dtype='float32')
+
+def embeddings_available() -> bool:
+    """هل يمكن الترميز (عبر الخادم أو بنموذج محلي)؟ النموذج المحلي لا يُحمَّل إلا إن لم يستجب الخادم."""
+    return _server_ready() or get_model() is not None
+
+# --- مخزن دائم للمتجهات حتى لا يُعاد ترميز نفس النص مع كل تقرير ---
+_embedding_cfg = SETTINGS.get('cache', {}).get('embeddings', {})
+EMBEDDING_BATCH_SIZE = _embedding_cfg.get('batch_size', 64)
+_embedding_cache = EmbeddingCache(MODEL_NAME, max_bytes=_embedding_cfg.get('max_mb', 300) * 1024 * 1024)
+
+def encode_texts(texts: list[str], normalize: bool = False) -> np.ndarray:
+    """
+    ترميز قائمة نصوص مع المرور على مخزن المتجهات أولًا.
+    النصوص غير المخزنة فقط (بدون تكرار) تُرسل إلى خادم الترميز، أو إلى النموذج المحلي عند غيابه.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+    keys = [embedding_key(MODEL_NAME, normalize, t) for t in texts]
+    found = _embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        vectors = _encode_uncached(list(missing.values()), normalize)
+        computed = {key: np.asarray(vec, dtype='float32') for key, vec in zip(missing, vectors)}
+        _embedding_cache.put_many(computed)
+        found.update(computed)
+
+    print(f"المتجهات: {len(missing)} ترميز جديد من أصل {len(texts)} نص (الباقي من المخزن أو مكرر).")
+    return np.vstack([found[key] for key in keys]).astype('float32')
+
+# --- اختيار الحقائق قبل العنقدة: صلة بالاستعلام + تنوع (MMR) ضمن ميزانية ---
+_selection_cfg = SETTINGS.get('processing', {}).get('fact_selection', {})
+FACT_BUDGET = _selection_cfg.get('max_facts', 150)
+MMR_LAMBDA = _selection_cfg.get('mmr_lambda', 0.7)
+MIN_RELEVANCE = _selection_cfg.get('min_relevance', 0.1)
+MMR_POOL_FACTOR = 10  # مرشحو MMR = أعلى (الميزانية × هذا العامل) صلةً
+
+def find_relevant_chunks(query: str, chunks: list[dict], embeddings: np.ndarray, top_k: int = FACT_BUDGET,
+                         mmr_lambda: float = MMR_LAMBDA, min_relevance: float = MIN_RELEVANCE) -> tuple:
+    """
+    تقيس صلة كل المقاطع بالاستعلام دفعة واحدة (ضرب مصفوفة في متجه)، ثم تختار حتى top_k مقطعًا
+    بالصلة الهامشية القصوى (MMR): في كل خطوة المقطع الأعلى في
+    mmr_lambda × الصلة − (1 − mmr_lambda) × أقصى تشابه مع ما اختير قبله،
+    فتُستبعد المقاطع البعيدة عن الاستعلام والمكررة لما اختير معًا.
+    المقاطع دون min_relevance لا تدخل الاختيار (إلا إن لم يتجاوزه أي مقطع).
+    تعيد (المقاطع المختارة بترتيب اختيارها، متجهاتها).
+    """
+    if not chunks or not query:
+        return chunks, embeddings
+
+    X = np.asarray(embeddings, dtype='float32')
+    X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    relevance = X @ encode_texts([query], normalize=True)[0]
+
+    candidates = np.flatnonzero(relevance >= min_relevance)
+    if candidates.size == 0:
+        candidates = np.arange(len(chunks))
+    if candidates.size > top_k * MMR_POOL_FACTOR:
+        # MMR على أعلى المرشحين صلةً فقط: كلفته O(top_k × المرشحين) لا O(top_k × كل المقاطع)
+        candidates = candidates[np.argpartition(-relevance[candidates], top_k * MMR_POOL_FACTOR)[:top_k * MMR_POOL_FACTOR]]
+    if candidates.size <= top_k:
+        selected = candidates[np.argsort(-relevance[candidates])]
+    else:
+        C, rel = X[candidates], relevance[candidates]
+        max_sim = np.full(candidates.size, -1.0, dtype='float32')  # أقصى تشابه مع المختار حتى الآن
+        available = np.ones(candidates.size, dtype=bool)
+        picked = []
+        for _ in range(top_k):
+            score = np.where(available, mmr_lambda * rel - (1 - mmr_lambda) * np.maximum(max_sim, 0), -np.inf)
+            best = int(np.argmax(score))
+            picked.append(best)
+            available[best] = False
+            np.maximum(max_sim, C @ C[best], out=max_sim)
+        selected = candidates[picked]
+
+    print(f"اختيار الحقائق: {len(selected)} من أصل {len(chunks)} "
+          f"(صلة ≥ {min_relevance}: {int((relevance >= min_relevance).sum())}).")
+    return [chunks[i] for i in selected], X[selected]
@@ -0,0 +1,65 @@
+# stage_store.py
+# مخرجات مراحل خط التقرير في Redis (JSON مضغوط)، مفتاحها (معرّف التقرير، اسم المرحلة).
+# كل مرحلة تقرأ مخرجات سابقتها من هنا لا من وسيط الرسائل، فإعادة مرحلة فاشلة
+# أو إعادة إرسال السلسلة كلها لا تعيد تنفيذ المراحل التي اكتملت.
+
+import json
+import zlib
+from settings import SETTINGS
+from redis_conn import get_redis
+
+STAGE_TTL_SECONDS = SETTINGS.get('pipeline', {}).get('stage_ttl_hours', 24) * 3600
+RESULT_TTL_SECONDS = SETTINGS.get('pipeline', {}).get('result_ttl_hours', 24) * 3600
+
+def _key(report_id: str, stage: str) -> str:
+    return f"report:{report_id}:stage:{stage}"
+
+def save_stage(report_id: str, stage: str, value) -> None:
+    payload = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'), 3)
+    get_redis().set(_key(report_id, stage), payload, ex=STAGE_TTL_SECONDS)
+
+def load_stage(report_id: str, stage: str, default=None):
+    payload = get_redis().get(_key(report_id, stage))
+    if payload is None:
+        return default
+    return json.loads(zlib.decompress(payload))
+
+def run_stage(report_id: str, stage: str, compute):
+    """تعيد المخرجات المحفوظة إن اكتملت المرحلة سابقًا، وإلا تحسبها وتحفظها."""
+    done = load_stage(report_id, stage)
+    if done is not None:
+        print(f"المرحلة '{stage}' للتقرير {report_id} مكتملة سابقًا؛ استخدام مخرجاتها المحفوظة.")
+        return done
+    value = compute()
+    save_stage(report_id, stage, value)
+    return value
+
+# --- مقالات التقرير النهائية: قائمة Redis منفصلة عن نتيجة المهمة، تُقرأ صفحةً صفحة ---
+# نتيجة المهمة (وكل استعلام /report_status) تحمل البيانات الوصفية فقط، لا نصوص الصفحات.
+ARTICLE_META_FIELDS = ('source', 'title', 'url', 'description', 'publishedAt', 'urlToImage')
+
+def article_metadata(article: dict) -> dict:
+    meta = {field: article.get(field) for field in ARTICLE_META_FIELDS}
+    meta['has_content'] = bool(article.get('content'))
+    return meta
+
+def _articles_key(report_id: str) -> str:
+    return f"report:{report_id}:articles"
+
+def save_report_articles(report_id: str, articles: list) -> None:
+    pipe = get_redis().pipeline()
+    pipe.delete(_articles_key(report_id))
+    if articles:
+        pipe.rpush(_articles_key(report_id), *[
+            zlib.compress(json.dumps(a, ensure_ascii=False).encode('utf-8'), 3) for a in articles
+        ])
+        pipe.expire(_articles_key(report_id), RESULT_TTL_SECONDS)
+    pipe.execute()
+
+def load_report_articles(report_id: str, offset: int, limit: int) -> tuple[int, list]:
+    """تعيد (العدد الكلي، مقالات الصفحة المطلوبة)."""
+    pipe = get_redis().pipeline()
+    pipe.llen(_articles_key(report_id))
+    pipe.lrange(_articles_key(report_id), offset, offset + limit - 1)
+    total, page = pipe.execute()
+    return total, [json.loads(zlib.decompress(item)) for item in page]
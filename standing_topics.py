@@ -0,0 +1,250 @@
+# standing_topics.py
+# المواضيع الدائمة: استعلامات ثابتة يحدّثها Celery beat دوريًا بشكل تزايدي.
+# كل تحديث يجلب المقالات الأحدث من العلامة المائية فقط، يستخلص حقائقها، ويضيفها إلى
+# مجموعة الحقائق ومتجهاتها المحفوظة. الحقائق الجديدة تُلحق بأقرب محور قائم، ولا يعاد
+# كتابة إلا المحاور التي تغيرت؛ فكلفة التحديث تتناسب مع الجديد لا مع النافذة كلها.
+
+import json
+import zlib
+import hashlib
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from settings import SETTINGS
+from redis_conn import get_redis
+from url_utils import canonicalize_url
+from stage_store import ARTICLE_META_FIELDS
+
+_standing_cfg = SETTINGS.get('standing_topics', {}) or {}
+ASSIGN_THRESHOLD = _standing_cfg.get('assign_threshold', 0.6)   # تشابه جيب التمام لإلحاق حقيقة بمحور قائم
+MIN_NEW_TOPIC_FACTS = _standing_cfg.get('min_new_topic_facts', 5)  # حقائق غير ملحقة تكفي لتكوين محاور جديدة
+REFRESH_LOCK_SECONDS = _standing_cfg.get('refresh_lock_minutes', 30) * 60
+# الحالة المعلّقة تنتظر كتابة المحاور في طابور llm؛ تُحذف صراحة عند النشر، والصلاحية للتحديث المتروك فقط
+PENDING_STATE_SECONDS = max(_standing_cfg.get('pending_state_hours', 6) * 3600, REFRESH_LOCK_SECONDS)
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def configured_topics() -> dict:
+    """{المعرّف: الإعدادات} لكل موضوع دائم في config.yaml."""
+    topics = {}
+    for topic in _standing_cfg.get('topics') or []:
+        slug = topic.get('id') or hashlib.sha1(topic['query'].encode('utf-8')).hexdigest()[:12]
+        topics[slug] = {
+            "query": topic['query'],
+            "period_days": topic.get('period_days', 7),
+            "refresh_minutes": topic.get('refresh_minutes', 30),
+        }
+    return topics
+
+# --- الحالة المحفوظة (Redis): JSON مضغوط + مصفوفة المتجهات float32 خامًا، صف لكل حقيقة ---
+
+def _state_keys(slug: str, pending: str | None = None) -> tuple[str, str]:
+    base = f"standing:{slug}" + (f":pending:{pending}" if pending else '')
+    return f"{base}:state", f"{base}:embeddings"
+
+def empty_state(slug: str) -> dict:
+    topic = configured_topics().get(slug, {})
+    return {
+        "query": topic.get('query'), "period_days": topic.get('period_days', 7),
+        "watermark": None, "seen_urls": {}, "articles": {}, "facts": [],
+        "topics": {}, "next_topic_id": 0, "reference_map": {}, "report": None, "dim": None,
+    }
+
+def is_empty_state(state: dict) -> bool:
+    return not state.get('watermark') and not state.get('facts') and not state.get('seen_urls')
+
+def load_state(slug: str, pending: str | None = None) -> tuple[dict | None, np.ndarray | None]:
+    """
+    الحالة المثبّتة (أو حالة فارغة لموضوع لم يُحدَّث بعد).
+    مع pending: النسخة المعلّقة لذلك التحديث، أو (None, None) إن لم تعد موجودة؛ لا تُستبدل بحالة فارغة أبدًا.
+    """
+    state_key, emb_key = _state_keys(slug, pending)
+    pipe = get_redis().pipeline()
+    pipe.get(state_key)
+    pipe.get(emb_key)
+    raw_state, raw_emb = pipe.execute()
+    if raw_state is None:
+        return (None, None) if pending else (empty_state(slug), None)
+    state = json.loads(zlib.decompress(raw_state))
+    embeddings = None
+    if raw_emb and state.get('dim'):
+        embeddings = np.frombuffer(raw_emb, dtype='float32').reshape(-1, state['dim']).copy()
+    return state, embeddings
+
+def save_state(slug: str, state: dict, embeddings: np.ndarray | None, pending: str | None = None) -> bool:
+    """يحفظ الحالة؛ حالة فارغة لا تُكتب أبدًا فوق حالة مثبّتة موجودة (يعيد False حينها)."""
+    state_key, emb_key = _state_keys(slug, pending)
+    ttl = PENDING_STATE_SECONDS if pending else None
+    client = get_redis()
+    if not pending and is_empty_state(state) and client.exists(state_key):
+        print(f"تحذير: رُفض حفظ حالة فارغة فوق الحالة المحفوظة للموضوع الدائم '{slug}'.")
+        return False
+    pipe = client.pipeline()
+    pipe.set(state_key, zlib.compress(json.dumps(state, ensure_ascii=False).encode('utf-8'), 3), ex=ttl)
+    if embeddings is not None and len(embeddings):
+        pipe.set(emb_key, np.ascontiguousarray(embeddings, dtype='float32').tobytes(), ex=ttl)
+    else:
+        pipe.delete(emb_key)
+    pipe.execute()
+    return True
+
+def discard_pending(slug: str, pending: str) -> None:
+    get_redis().delete(*_state_keys(slug, pending))
+
+def acquire_refresh_lock(slug: str, refresh_id: str) -> bool:
+    """تحديث واحد لكل موضوع في الوقت نفسه؛ التحديث الفاشل يحرر القفل بانتهاء صلاحيته."""
+    return bool(get_redis().set(f"standing:{slug}:lock", refresh_id, nx=True, ex=REFRESH_LOCK_SECONDS))
+
+def renew_refresh(slug: str, refresh_id: str) -> bool:
+    """
+    تُستدعى في بداية كل مرحلة من سلسلة التحديث: تمدد القفل (وتستعيده إن انتهى ولم يأخذه أحد)
+    وصلاحية الحالة المعلّقة. تعيد False إن كان تحديث آخر قد أخذ القفل، فلا يعمل تحديثان معًا.
+    """
+    client = get_redis()
+    lock_key = f"standing:{slug}:lock"
+    client.set(lock_key, refresh_id, nx=True, ex=REFRESH_LOCK_SECONDS)
+    current = client.get(lock_key)
+    if not current or current.decode() != refresh_id:
+        return False
+    pipe = client.pipeline()
+    pipe.expire(lock_key, REFRESH_LOCK_SECONDS)
+    for key in _state_keys(slug, refresh_id):
+        pipe.expire(key, PENDING_STATE_SECONDS)
+    pipe.execute()
+    return True
+
+def release_refresh_lock(slug: str, refresh_id: str) -> None:
+    client = get_redis()
+    current = client.get(f"standing:{slug}:lock")
+    if current and current.decode() == refresh_id:
+        client.delete(f"standing:{slug}:lock")
+
+# --- التحديث التزايدي ---
+
+def unseen_articles(state: dict, articles: list) -> list:
+    """يستبعد المقالات التي عولجت في تحديث سابق (برابطها الموحّد)."""
+    seen = state['seen_urls']
+    return [a for a in articles if a.get('url') and canonicalize_url(a['url']) not in seen]
+
+def _window_cutoff(period_days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=period_days)).strftime(ISO_FORMAT)
+
+def _normalized(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+def merge_new_facts(state: dict, embeddings: np.ndarray | None, articles: list,
+                    new_facts: list[dict], new_embeddings: np.ndarray | None) -> tuple[dict, np.ndarray | None, list[str]]:
+    """
+    يدمج حقائق التحديث في الحالة ويعيد (الحالة الجديدة، المتجهات، معرّفات المحاور التي تغيرت):
+    1) حذف الحقائق والروابط التي خرجت من النافذة الزمنية (محاورها تُعتبر متغيرة).
+    2) حذف الحقائق الجديدة المكررة دلاليًا لحقيقة محفوظة.
+    3) إلحاق كل حقيقة جديدة بأقرب مركز محور إن تجاوز التشابه ASSIGN_THRESHOLD.
+    4) الحقائق غير الملحقة تنتظر حتى تبلغ MIN_NEW_TOPIC_FACTS ثم تُعنقد وحدها إلى محاور جديدة.
+    """
+    from deduplicator import greedy_dedup_indices
+    from clusterer import cluster_chunks
+
+    state = dict(state)
+    dirty = set()
+    topics_before = set(state['topics'])
+    cutoff = _window_cutoff(state['period_days'])
+
+    # (1) النافذة الزمنية
+    facts = state['facts']
+    keep = [i for i, f in enumerate(facts) if not f.get('published_at') or f['published_at'] >= cutoff]
+    for i in set(range(len(facts))) - set(keep):
+        if facts[i]['topic'] >= 0:
+            dirty.add(str(facts[i]['topic']))
+    facts = [facts[i] for i in keep]
+    embeddings = embeddings[keep] if embeddings is not None and keep else None
+    state['seen_urls'] = {u: ts for u, ts in state['seen_urls'].items() if not ts or ts >= cutoff}
+    state['articles'] = {u: a for u, a in state['articles'].items() if u in state['seen_urls']}
+
+    # المقالات الجديدة: تُسجَّل كمعالجة، وتتقدم العلامة المائية إلى أحدث تاريخ نشر بينها
+    for a in articles:
+        url = canonicalize_url(a['url'])
+        state['seen_urls'][url] = a.get('publishedAt')
+        state['articles'][url] = {k: a[k] for k in ARTICLE_META_FIELDS if a.get(k) is not None}
+    published = [a['publishedAt'] for a in articles if a.get('publishedAt')]
+    if published:
+        state['watermark'] = max([state['watermark'] or ''] + published)
+
+    # (2) تكرار دلالي مع المحفوظ: المحفوظ أولًا فيبقى، والجديد يُحذف إن شابهه
+    if new_facts:
+        n_old = 0 if embeddings is None else len(embeddings)
+        combined = new_embeddings if embeddings is None else np.vstack([embeddings, new_embeddings])
+        threshold = SETTINGS.get('processing', {}).get('deduplication_threshold', 0.9)
+        survivors = [i - n_old for i in greedy_dedup_indices(combined, threshold) if i >= n_old]
+        print(f"موضوع دائم: {len(survivors)} حقيقة جديدة فريدة من أصل {len(new_facts)}.")
+        new_facts = [dict(new_facts[i], topic=-1) for i in survivors]
+        new_embeddings = new_embeddings[survivors]
+
+        # (3) الإلحاق بأقرب محور قائم
+        topic_ids = sorted({f['topic'] for f in facts if f['topic'] >= 0})
+        if topic_ids and len(new_facts):
+            centroids = np.vstack([
+                _normalized(embeddings[[i for i, f in enumerate(facts) if f['topic'] == t]]).mean(axis=0)
+                for t in topic_ids
+            ])
+            sims = _normalized(new_embeddings) @ _normalized(centroids).T
+            best = sims.argmax(axis=1)
+            for fact, b, s in zip(new_facts, best, sims[np.arange(len(best)), best]):
+                if s >= ASSIGN_THRESHOLD:
+                    fact['topic'] = topic_ids[b]
+                    dirty.add(str(topic_ids[b]))
+
+        facts = facts + new_facts
+        embeddings = new_embeddings if embeddings is None else np.vstack([embeddings, new_embeddings])
+        if embeddings is not None and len(embeddings):
+            state['dim'] = int(embeddings.shape[1])
+
+    # (4) عنقدة الحقائق المعلّقة إلى محاور جديدة
+    pending = [i for i, f in enumerate(facts) if f['topic'] < 0]
+    if pending and (len(pending) >= MIN_NEW_TOPIC_FACTS or not state['topics']):
+        clusters = cluster_chunks([facts[i] for i in pending], embeddings[pending])
+        position = {id(facts[i]): i for i in pending}
+        for title, members in clusters.items():
+            topic_id = str(state['next_topic_id'])
+            state['next_topic_id'] += 1
+            state['topics'] = dict(state['topics'], **{topic_id: {"title": title, "content": None}})
+            for fact in members:
+                facts[position[id(fact)]]['topic'] = int(topic_id)
+            dirty.add(topic_id)
+
+    # المحاور التي فقدت كل حقائقها تُحذف
+    alive = {str(f['topic']) for f in facts if f['topic'] >= 0}
+    state['topics'] = {t: v for t, v in state['topics'].items() if t in alive}
+    dirty &= alive
+
+    # المحور المتغير يُعاد عنونته من حقيقته الممثلة الجديدة (الأقرب إلى مركزه)، كما في محاور التقارير
+    if dirty and embeddings is not None:
+        from clusterer import centroid_order, exemplar_title
+        used_titles = {v['title'] for t, v in state['topics'].items() if t not in dirty}
+        topics = dict(state['topics'])
+        for t in sorted(dirty, key=int):
+            _, order, _ = centroid_order(embeddings, [i for i, f in enumerate(facts) if str(f['topic']) == t])
+            topics[t] = dict(topics[t], title=exemplar_title(facts[order[0]]['text'], used_titles))
+        state['topics'] = topics
+
+    # أرقام المراجع ثابتة بين التحديثات حتى لا تفسد الإحالات في المحاور التي لم يعد كتابتها
+    reference_map = dict(state['reference_map'])
+    for f in facts:
+        url = f.get('source_url')
+        if url and url not in reference_map:
+            reference_map[url] = max(reference_map.values(), default=0) + 1
+    state['reference_map'] = reference_map
+    state['facts'] = facts
+    # التقرير يعاد تجميعه فقط إن تغير محور أو أُضيف أو حُذف
+    state['changed'] = bool(dirty) or set(state['topics']) != topics_before
+    return state, embeddings, sorted(dirty, key=int)
+
+def topic_facts(state: dict, topic_id: str, embeddings: np.ndarray | None = None) -> list[dict]:
+    """حقائق المحور؛ مع المتجهات تُرتب بالأقرب إلى مركزه أولًا (لميزانية أمر الكتابة)."""
+    members = [i for i, f in enumerate(state['facts']) if str(f['topic']) == topic_id]
+    if embeddings is not None and members:
+        from clusterer import centroid_order
+        _, members, _ = centroid_order(embeddings, members)
+    return [{'text': state['facts'][i]['text'], 'source_url': state['facts'][i]['source_url']} for i in members]
+
+def used_reference_map(state: dict) -> dict:
+    """المراجع التي ما زالت لها حقائق في النافذة (بأرقامها الثابتة)."""
+    used = {f['source_url'] for f in state['facts'] if f.get('source_url')}
+    return {url: n for url, n in state['reference_map'].items() if url in used}
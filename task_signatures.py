@@ -0,0 +1,94 @@
+# task_signatures.py
+# وحدة خفيفة يعتمد عليها خادم الويب (Flask): تطبيق Celery وتواقيع المهام بالاسم فقط.
+# لا تستورد أي مكوّن من خط المعالجة، فلا يدفع خادم الويب ثمن تحميل النماذج والمكتبات الثقيلة.
+
+import uuid
+import zlib
+import msgpack
+from celery import Celery, chain
+from kombu.serialization import register
+from settings import SETTINGS
+from redis_conn import REDIS_URL
+
+# نحن نتصل بـ Redis الذي يعمل كوسيط
+celery_app = Celery('tasks', broker=REDIS_URL, backend=REDIS_URL, include=['tasks'])
+
+# --- تخزين النتائج: msgpack مضغوط بـ zlib بدل JSON، أصغر في ذاكرة Redis وأسرع في كل استعلام حالة ---
+def _pack_result(value) -> bytes:
+    return zlib.compress(msgpack.packb(value, use_bin_type=True, default=str), 6)
+
+def _unpack_result(data: bytes):
+    return msgpack.unpackb(zlib.decompress(data), raw=False)
+
+register('msgpack_zlib', _pack_result, _unpack_result,
+         content_type='application/x-msgpack-zlib', content_encoding='binary')
+celery_app.conf.update(
+    result_serializer='msgpack_zlib',
+    accept_content=['json', 'msgpack_zlib'],
+    result_accept_content=['json', 'msgpack_zlib'],
+    result_expires=SETTINGS.get('pipeline', {}).get('result_ttl_hours', 24) * 3600,
+)
+
+# --- مراحل خط التقرير، كل مرحلة في طابور حسب المورد الذي تستهلكه ---
+# io: الشبكة (بحث، تنزيل)، cpu: الترميز والعنقدة، llm: استدعاءات Gemini المقيدة بالحصة.
+# لكل طابور عامل بنوع مجمّع وتزامن خاص به (انظر Procfile)، فيتوسع كل مورد مستقلًا.
+SEARCH_STAGE = 'tasks.search_stage'
+EXTRACT_STAGE = 'tasks.extract_stage'
+DEDUP_STAGE = 'tasks.dedup_stage'
+FACTS_STAGE = 'tasks.facts_stage'
+CLUSTER_STAGE = 'tasks.cluster_stage'
+WRITE_TOPIC_STAGE = 'tasks.write_topic_stage'
+ASSEMBLE_STAGE = 'tasks.assemble_stage'
+# المواضيع الدائمة (تحديث تزايدي يطلقه Celery beat)
+STANDING_REFRESH = 'tasks.standing_refresh_task'
+STANDING_COLLECT_STAGE = 'tasks.standing_collect_stage'
+STANDING_FACTS_STAGE = 'tasks.standing_facts_stage'
+STANDING_MERGE_STAGE = 'tasks.standing_merge_stage'
+STANDING_PUBLISH_STAGE = 'tasks.standing_publish_stage'
+# إعادة بناء فهرس المدوّنة الدائم (corpus_index.py) دوريًا عبر Celery beat
+CORPUS_COMPACT = 'tasks.corpus_compact_task'
+
+celery_app.conf.task_routes = {
+    SEARCH_STAGE: {'queue': 'io'},
+    EXTRACT_STAGE: {'queue': 'io'},
+    DEDUP_STAGE: {'queue': 'cpu'},
+    FACTS_STAGE: {'queue': 'llm'},
+    CLUSTER_STAGE: {'queue': 'cpu'},
+    WRITE_TOPIC_STAGE: {'queue': 'llm'},
+    ASSEMBLE_STAGE: {'queue': 'llm'},
+    STANDING_REFRESH: {'queue': 'io'},
+    STANDING_COLLECT_STAGE: {'queue': 'io'},
+    STANDING_FACTS_STAGE: {'queue': 'llm'},
+    STANDING_MERGE_STAGE: {'queue': 'cpu'},
+    STANDING_PUBLISH_STAGE: {'queue': 'llm'},
+    CORPUS_COMPACT: {'queue': 'cpu'},
+}
+# المراحل طويلة: لا يحجز العامل أكثر من مهمة، ولا تُؤكَّد الرسالة إلا بعد انتهاء المرحلة
+celery_app.conf.worker_prefetch_multiplier = 1
+celery_app.conf.task_acks_late = True
+
+def generate_report_signature(user_query: str, period_days: int = 14, report_id: str | None = None):
+    """
+    سلسلة مراحل التقرير (بالاسم) دون استيراد tasks.py.
+    معرّف التقرير هو معرّف المهمة الأخيرة في السلسلة؛ مرحلة العنقدة تستبدل نفسها بـ chord
+    (كتابة المحاور بالتوازي ثم التجميع) يرث هذا المعرّف، فيبقى task_id الذي يعرفه العميل صالحًا حتى النهاية.
+    """
+    report_id = report_id or str(uuid.uuid4())
+    return chain(
+        celery_app.signature(SEARCH_STAGE, args=(report_id, user_query, period_days), immutable=True),
+        celery_app.signature(EXTRACT_STAGE, args=(report_id,), immutable=True),
+        celery_app.signature(DEDUP_STAGE, args=(report_id,), immutable=True),
+        celery_app.signature(FACTS_STAGE, args=(report_id,), immutable=True),
+        celery_app.signature(CLUSTER_STAGE, args=(report_id,), immutable=True).set(task_id=report_id),
+    )
+
+def standing_refresh_signature(slug: str, refresh_id: str):
+    """
+    سلسلة تحديث موضوع دائم: جمع المقالات الجديدة (io) ← حقائقها (llm) ← الدمج (cpu).
+    مرحلة الدمج تستبدل نفسها بـ chord لكتابة المحاور المتغيرة فقط ثم النشر، بمعرّف التحديث نفسه.
+    """
+    return chain(
+        celery_app.signature(STANDING_COLLECT_STAGE, args=(refresh_id, slug), immutable=True),
+        celery_app.signature(STANDING_FACTS_STAGE, args=(refresh_id, slug), immutable=True),
+        celery_app.signature(STANDING_MERGE_STAGE, args=(refresh_id, slug), immutable=True).set(task_id=refresh_id),
+    )
@@ -1,95 +1,378 @@
 # tasks.py
-# هذا الملف يحتوي على المهمة الطويلة التي سيتم تشغيلها في الخلفية بواسطة Celery
+# هذا الملف يحتوي على مراحل توليد التقرير التي سيتم تشغيلها في الخلفية بواسطة Celery
+# (السلسلة نفسها معرّفة في task_signatures.generate_report_signature)
 
 import time
+import uuid
 import urllib.parse
+from functools import partial
 import numpy as np
-from celery import Celery
+from celery import chord
+from settings import SETTINGS
+from task_signatures import (
+    celery_app,
+    SEARCH_STAGE, EXTRACT_STAGE, DEDUP_STAGE, FACTS_STAGE,
+    CLUSTER_STAGE, WRITE_TOPIC_STAGE, ASSEMBLE_STAGE,
+    STANDING_REFRESH, STANDING_COLLECT_STAGE, STANDING_FACTS_STAGE,
+    STANDING_MERGE_STAGE, STANDING_PUBLISH_STAGE, CORPUS_COMPACT, standing_refresh_signature
+)
+from progress import ReportProgress
+from stage_store import run_stage, load_stage, save_stage, save_report_articles, article_metadata
+from report_registry import complete_report, publish_completed_report
+import standing_topics
+import corpus_index
 
 # --- استيراد مكونات المشروع ---
 # تأكد من أن هذه الملفات موجودة في نفس المجلد
 from search_service import fetch_articles_from_all_providers
 from deduplicator import (
     deduplicate_articles_simple,
+    deduplicate_articles_lexical,
     deduplicate_articles_semantic,
     get_unique_chunk_indices
 )
 from content_extractor import process_articles_in_parallel
-from semantic_searcher import create_vector_index
-from clusterer import cluster_chunks
+from text_processor import clean_articles
+from semantic_searcher import encode_texts, find_relevant_chunks
+from clusterer import cluster_topics
 from llm_summarizer import (
     extract_key_facts_with_sources,
     write_topic_content,
+    budget_topic_facts,
     assemble_final_report,
     format_references
 )
 
 # --- إعداد Celery ---
-# نحن نتصل بـ Redis الذي يعمل كوسيط
-celery_app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
+# تطبيق Celery معرّف في task_signatures.py حتى يستورده خادم الويب دون هذا الملف.
+# المكتبات الثقيلة (النموذج، faiss، hdbscan، sklearn، Gemini) تُحمّل كسولًا عند أول استخدام.
+
+STAGE_MAX_RETRIES = SETTINGS.get('pipeline', {}).get('stage_max_retries', 2)
+
+# جدول Celery beat: تحديث تزايدي لكل موضوع دائم في config.yaml
+celery_app.conf.beat_schedule = {
+    f"standing:{slug}": {'task': STANDING_REFRESH, 'schedule': topic['refresh_minutes'] * 60, 'args': (slug,)}
+    for slug, topic in standing_topics.configured_topics().items()
+}
+if corpus_index.CORPUS_ENABLED:
+    celery_app.conf.beat_schedule['corpus:compact'] = {
+        'task': CORPUS_COMPACT,
+        'schedule': SETTINGS.get('corpus_index', {}).get('compaction_interval_minutes', 60) * 60,
+    }
+
+class StageFailed(Exception):
+    """فشل في بيانات المرحلة نفسها (لا مقالات، لا محاور)؛ إعادة المحاولة لن تغيّر النتيجة."""
+
+class StageTask(celery_app.Task):
+    """
+    أساس كل المراحل: إعادة تلقائية مع تأخير متزايد للأخطاء العابرة (شبكة، Redis، مهلة)،
+    والمخرجات المحفوظة (stage_store) تعني أن الإعادة لا تكرر ما اكتمل قبلها.
+    عند الفشل النهائي يُعلَّم التقرير كله فاشلًا، حتى لو فشلت مرحلة قبل الأخيرة.
+    """
+    autoretry_for = (Exception,)
+    dont_autoretry_for = (StageFailed,)
+    max_retries = STAGE_MAX_RETRIES
+    retry_backoff = True
+    retry_backoff_max = 60
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # معرّف التقرير أول معامل نصي (مرحلة التجميع تستقبل نتائج المحاور قبله)
+        report_id = next((a for a in args if isinstance(a, str)), kwargs.get('report_id'))
+        if not report_id:
+            return
+        ReportProgress(self, report_id).fail(str(exc))
+        complete_report(report_id, succeeded=False)
+        if report_id != task_id:
+            self.backend.mark_as_failure(report_id, exc, traceback=einfo.traceback)
+
+class ReportResultTask(StageTask):
+    """
+    مرحلة نتيجتها هي نتيجة التقرير (معرّف المهمة = معرّف التقرير). نشره في سجل التقارير يجري في on_success،
+    أي بعد أن يخزن Celery النتيجة، فلا يشير :done إلى تقرير لم تصبح حالته SUCCESS بعد
+    ولا يُحذف :inflight قبل ذلك. المرحلة تضع النشر المطلوب في self.request.publish_report.
+    """
+    def on_success(self, retval, task_id, args, kwargs):
+        publish = getattr(self.request, 'publish_report', None)
+        if publish:
+            publish()
+
+@celery_app.task(name=SEARCH_STAGE, base=StageTask, bind=True)
+def search_stage(self, report_id, user_query, period_days=14):
+    """1-2) جلب المقالات ثم تنقية مبدئية (رابط/عنوان مطابق، ثم تكرار معجمي) قبل أي تنزيل."""
+    progress = ReportProgress(self, report_id)
+
+    def compute():
+        search_result = fetch_articles_from_all_providers(user_query, period_days)
+        if not search_result.get('success') or not search_result.get('articles'):
+            raise StageFailed("لم يتم العثور على مقالات حول هذا الموضوع.")
+        progress.stage('articles_found', articles_found=len(search_result['articles']),
+                       titles=[a.get('title') for a in search_result['articles'][:10]])
+        articles = deduplicate_articles_simple(search_result['articles'])
+        articles = deduplicate_articles_lexical(articles)
+        return {"user_query": user_query, "period_days": period_days,
+                "started_at": time.time(), "articles": articles}
+
+    run_stage(report_id, 'search', compute)
+
+@celery_app.task(name=EXTRACT_STAGE, base=StageTask, bind=True)
+def extract_stage(self, report_id):
+    """3) استخراج المحتوى الكامل ثم تنظيفه (أنماط الضوضاء وقوالب كل موقع) قبل الترميز والاستخلاص."""
+    progress = ReportProgress(self, report_id)
+
+    def compute():
+        articles_full = list(clean_articles(process_articles_in_parallel(load_stage(report_id, 'search')['articles'])))
+        progress.stage('articles_extracted', articles_extracted=sum(1 for a in articles_full if a.get('content')))
+        return {"articles": articles_full}
+
+    run_stage(report_id, 'extract', compute)
+
+@celery_app.task(name=DEDUP_STAGE, base=StageTask, bind=True)
+def dedup_stage(self, report_id):
+    """4) إزالة تكرار دلالي، ثم إضافة متجهات المقالات إلى فهرس المدوّنة (من مخزن المتجهات، بلا ترميز جديد)."""
+    def compute():
+        unique_articles = deduplicate_articles_semantic(load_stage(report_id, 'extract')['articles'])
+        corpus_index.index_articles(unique_articles)
+        return {"articles": unique_articles}
+
+    run_stage(report_id, 'dedup', compute)
+
+@celery_app.task(name=FACTS_STAGE, base=StageTask, bind=True)
+def facts_stage(self, report_id):
+    """5) استخلاص حقائق، مع الحقائق المعروفة ذات الصلة من تقارير سابقة (فهرس المدوّنة)."""
+    progress = ReportProgress(self, report_id)
+
+    def compute():
+        unique_articles = load_stage(report_id, 'dedup')['articles']
+        search = load_stage(report_id, 'search')
+        all_facts = extract_key_facts_with_sources(unique_articles, search['user_query'])
+        known, known_articles = corpus_index.known_facts(search['user_query'], search['period_days'],
+                                                         [a.get('url') for a in unique_articles])
+        progress.stage('facts_extracted', unique_articles=len(unique_articles), facts=len(all_facts), known_facts=len(known))
+        return {"facts": all_facts + known, "known_articles": known_articles}
+
+    run_stage(report_id, 'facts', compute)
 
-@celery_app.task
-def generate_report_task(user_query, period_days=14):
+@celery_app.task(name=CLUSTER_STAGE, base=StageTask, bind=True)
+def cluster_stage(self, report_id):
     """
-    هذه هي المهمة الرئيسية التي تقوم بكل العمل الشاق.
+    6-7) متجهات الحقائق (من فهرس المدوّنة أو ترميز جديد يُضاف إليه)، اختيار الأوثق صلة بالاستعلام
+    والأكثر تنوعًا ضمن ميزانية ثابتة، إزالة تكرارها، ثم العنقدة.
+    تستبدل المرحلة نفسها بـ chord: كتابة كل محور مهمة مستقلة في طابور llm، ثم التجميع.
     """
-    start_time = time.time()
+    progress = ReportProgress(self, report_id)
 
-    # 1) جلب المقالات
-    search_result = fetch_articles_from_all_providers(user_query, period_days)
-    if not search_result.get('success') or not search_result.get('articles'):
-        raise Exception("لم يتم العثور على مقالات حول هذا الموضوع.")
+    def compute():
+        all_facts = load_stage(report_id, 'facts')['facts']
+        if not all_facts:
+            return {"topics": [], "reference_map": {}}
 
-    # 2) تنقية مبدئية
-    articles = deduplicate_articles_simple(search_result['articles'])
+        all_embeddings = corpus_index.fact_embeddings(all_facts, load_stage(report_id, 'dedup')['articles'])
 
-    # 3) استخراج المحتوى الكامل
-    articles_full = process_articles_in_parallel(articles)
+        # الميزانية تحدد زمن العنقدة وحجم أوامر كتابة المحاور مهما كثرت المقالات
+        selected_facts, selected_embeddings = find_relevant_chunks(load_stage(report_id, 'search')['user_query'],
+                                                                   all_facts, all_embeddings)
+        progress.stage('facts_selected', facts=len(all_facts), selected=len(selected_facts))
 
-    # 4) إزالة تكرار دلالي
-    unique_articles = deduplicate_articles_semantic(articles_full)
+        unique_fact_indices = get_unique_chunk_indices(selected_facts, selected_embeddings)
+        unique_facts = [selected_facts[i] for i in unique_fact_indices]
+        unique_embeddings = np.array([selected_embeddings[i] for i in unique_fact_indices])
 
-    # 5) استخلاص حقائق
-    all_facts = extract_key_facts_with_sources(unique_articles)
-    if not all_facts:
+        clustered_topics = cluster_topics(unique_facts, unique_embeddings)
+        if not clustered_topics:
+            raise StageFailed("فشل في بناء هيكل للمقال.")
+
+        used_urls = sorted(list({fact['source_url'] for fact in unique_facts if fact.get('source_url')}))
         return {
-            "summary": "لم يتم العثور على معلومات كافية لبناء تقرير.",
-            "articles": unique_articles,
-            "total_time": round(time.time() - start_time, 2)
+            # الحقائق محفوظة بترتيبها من مركز المحور؛ مرحلة الكتابة تأخذ منها ما تسعه ميزانيتها
+            "topics": [{"title": topic['title'], "facts": topic['facts']} for topic in clustered_topics],
+            "reference_map": {url: i + 1 for i, url in enumerate(used_urls)}
         }
 
-    # 6) فهرسة المتجهات وإزالة تكرار الحقائق
-    vector_index, _, all_embeddings = create_vector_index(all_facts)
-    if not vector_index or all_embeddings is None:
-        raise Exception("Failed to create vector index for facts.")
+    clusters = run_stage(report_id, 'clusters', compute)
+    if not clusters['topics']:
+        return self.replace(celery_app.signature(ASSEMBLE_STAGE, args=([], report_id)))
+    progress.stage('clusters', topics=[t['title'] for t in clusters['topics']])
+
+    # 8) كتابة المحاور بالتوازي؛ الإيقاع الفعلي يحدده محدد المعدل المشترك (rate_limiter.py)
+    header = [celery_app.signature(WRITE_TOPIC_STAGE, args=(report_id, i), immutable=True)
+              for i in range(len(clusters['topics']))]
+    return self.replace(chord(header, celery_app.signature(ASSEMBLE_STAGE, args=(report_id,))))
+
+@celery_app.task(name=WRITE_TOPIC_STAGE, base=StageTask, bind=True)
+def write_topic_stage(self, report_id, topic_index):
+    progress = ReportProgress(self, report_id)
+    clusters = load_stage(report_id, 'clusters')
+    topic = clusters['topics'][topic_index]
 
-    unique_fact_indices = get_unique_chunk_indices(all_facts, all_embeddings)
-    unique_facts = [all_facts[i] for i in unique_fact_indices]
-    unique_embeddings = np.array([all_embeddings[i] for i in unique_fact_indices])
+    def compute():
+        facts = budget_topic_facts(topic['facts'], clusters['reference_map'])
+        content = write_topic_content(topic['title'], facts, clusters['reference_map'],
+                                      on_token=lambda text: progress.token(topic['title'], text),
+                                      on_reset=lambda: progress.reset_section(topic['title']))
+        progress.section(topic['title'], content)
+        return content
 
-    # 7) عنقدة الحقائق
-    clustered_topics = cluster_chunks(unique_facts, unique_embeddings)
-    if not clustered_topics:
-        raise Exception("فشل في بناء هيكل للمقال.")
+    return run_stage(report_id, f"section:{topic_index}", compute)
 
-    # 8) كتابة المحاور وتجميع التقرير
-    used_urls = sorted(list({fact['source_url'] for fact in unique_facts if fact.get('source_url')}))
-    reference_map = {url: i + 1 for i, url in enumerate(used_urls)}
+@celery_app.task(name=ASSEMBLE_STAGE, base=ReportResultTask, bind=True)
+def assemble_stage(self, written_sections, report_id):
+    """تجميع التقرير والمراجع. تعمل بمعرّف التقرير نفسه، فنتيجتها هي نتيجة التقرير."""
+    progress = ReportProgress(self, report_id)
+    search = load_stage(report_id, 'search')
+    unique_articles = load_stage(report_id, 'dedup')['articles']
+    known_articles = load_stage(report_id, 'facts').get('known_articles', [])
+    clusters = load_stage(report_id, 'clusters')
 
-    written_topics = {}
-    for topic_title, topic_facts in clustered_topics.items():
-        topic_content = write_topic_content(topic_title, topic_facts, reference_map)
-        written_topics[topic_title] = topic_content
-        time.sleep(4) # تهدئة لمراعاة حدود API
+    if not clusters['topics']:
+        full_report = "لم يتم العثور على معلومات كافية لبناء تقرير."
+    else:
+        progress.stage('assembling')
+        written_topics = {topic['title']: content for topic, content in zip(clusters['topics'], written_sections)}
+        reference_map = clusters['reference_map']
+        final_report_body = assemble_final_report(search['user_query'], written_topics)
+        articles_for_citation = [a for a in unique_articles + known_articles if a.get('url') in reference_map]
+        references_section = format_references(articles_for_citation, reference_map)
+        full_report = f"{final_report_body}{references_section}"
 
-    final_report_body = assemble_final_report(user_query, written_topics)
-    articles_for_citation = [a for a in unique_articles if a.get('url') in used_urls]
-    references_section = format_references(articles_for_citation, reference_map)
-    full_report = f"{final_report_body}{references_section}"
+    # نصوص المقالات الكاملة تُحفظ منفصلة (/report_articles)؛ النتيجة تحمل بياناتها الوصفية فقط
+    save_report_articles(report_id, unique_articles)
 
     # --- النتيجة النهائية التي سيتم إرجاعها ---
-    return {
+    result = {
         "summary": full_report,
-        "articles": unique_articles,
-        "total_time": round(time.time() - start_time, 2)
+        "articles": [article_metadata(a) for a in unique_articles],
+        "articles_count": len(unique_articles),
+        "total_time": round(time.time() - search['started_at'], 2)
     }
+    progress.finish(total_time=result['total_time'])
+    self.request.publish_report = partial(complete_report, report_id, succeeded=True, period_days=search['period_days'])
+    return result
+
+# --- المواضيع الدائمة: تحديث تزايدي بعلامة مائية (standing_topics.py) ---
+
+@celery_app.task(name=STANDING_REFRESH, bind=True)
+def standing_refresh_task(self, slug):
+    """نقطة دخول Celery beat: تطلق سلسلة تحديث للموضوع إن لم يكن تحديث سابق ما زال جاريًا."""
+    refresh_id = f"standing-{slug}-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    if not standing_topics.acquire_refresh_lock(slug, refresh_id):
+        print(f"تحديث سابق للموضوع الدائم '{slug}' ما زال جاريًا؛ تخطي هذه الدورة.")
+        return None
+    standing_refresh_signature(slug, refresh_id).delay()
+    return refresh_id
+
+def _renew_standing_refresh(slug, refresh_id):
+    """كل مرحلة تمدد قفل التحديث وحالته المعلّقة؛ إن أخذ تحديث آخر القفل تتوقف هذه السلسلة."""
+    if not standing_topics.renew_refresh(slug, refresh_id):
+        raise StageFailed(f"تحديث آخر للموضوع الدائم '{slug}' أخذ القفل؛ أُوقف التحديث {refresh_id}.")
+
+@celery_app.task(name=STANDING_COLLECT_STAGE, base=StageTask, bind=True)
+def standing_collect_stage(self, refresh_id, slug):
+    """المقالات المنشورة بعد العلامة المائية فقط، دون ما عولج سابقًا، ثم تنقيتها واستخراج محتواها."""
+    _renew_standing_refresh(slug, refresh_id)
+
+    def compute():
+        state, _ = standing_topics.load_state(slug)
+        if not state.get('query'):
+            raise StageFailed(f"الموضوع الدائم '{slug}' غير معرّف في الإعدادات.")
+        started_at = time.time()
+        search_result = fetch_articles_from_all_providers(state['query'], state['period_days'], since=state['watermark'])
+        articles = standing_topics.unseen_articles(state, search_result.get('articles') or [])
+        print(f"موضوع دائم '{slug}': {len(articles)} مقال جديد منذ {state['watermark'] or 'البداية'}.")
+        if articles:
+            articles = deduplicate_articles_lexical(deduplicate_articles_simple(articles))
+            articles = list(clean_articles(process_articles_in_parallel(articles)))
+        return {"started_at": started_at, "query": state['query'], "articles": articles}
+
+    run_stage(refresh_id, 'collect', compute)
+
+@celery_app.task(name=STANDING_FACTS_STAGE, base=StageTask, bind=True)
+def standing_facts_stage(self, refresh_id, slug):
+    """حقائق المقالات الجديدة فقط، موسومة بتاريخ نشر مقالها (لخروجها من النافذة لاحقًا)."""
+    _renew_standing_refresh(slug, refresh_id)
+
+    def compute():
+        collected = load_stage(refresh_id, 'collect')
+        articles = collected['articles']
+        facts = []
+        if articles:
+            unique_articles = deduplicate_articles_semantic(articles)
+            published = {a['url']: a.get('publishedAt') for a in unique_articles}
+            facts = [dict(f, published_at=published.get(f['source_url']))
+                     for f in extract_key_facts_with_sources(unique_articles, collected.get('query'))]
+        return {"articles": [article_metadata(a) for a in articles], "facts": facts}
+
+    run_stage(refresh_id, 'standing_facts', compute)
+
+@celery_app.task(name=STANDING_MERGE_STAGE, base=StageTask, bind=True)
+def standing_merge_stage(self, refresh_id, slug):
+    """
+    يدمج الحقائق الجديدة في الحالة المحفوظة (نسخة معلّقة حتى النشر)، ثم يكتب المحاور المتغيرة فقط
+    بمرحلة الكتابة نفسها المستخدمة في التقارير.
+    """
+    _renew_standing_refresh(slug, refresh_id)
+    progress = ReportProgress(self, refresh_id)
+    data = load_stage(refresh_id, 'standing_facts')
+    state, embeddings = standing_topics.load_state(slug)
+    new_embeddings = encode_texts([f['text'] for f in data['facts']]) if data['facts'] else None
+    state, embeddings, dirty = standing_topics.merge_new_facts(state, embeddings, data['articles'], data['facts'], new_embeddings)
+    standing_topics.save_state(slug, state, embeddings, pending=refresh_id)
+    print(f"موضوع دائم '{slug}': {len(dirty)} محور متغير من أصل {len(state['topics'])}.")
+
+    if not dirty:
+        return self.replace(celery_app.signature(STANDING_PUBLISH_STAGE, args=([], refresh_id, slug)))
+    save_stage(refresh_id, 'clusters', {
+        "topics": [{"id": t, "title": state['topics'][t]['title'], "facts": standing_topics.topic_facts(state, t, embeddings)} for t in dirty],
+        "reference_map": state['reference_map']
+    })
+    progress.stage('clusters', topics=[state['topics'][t]['title'] for t in dirty])
+    header = [celery_app.signature(WRITE_TOPIC_STAGE, args=(refresh_id, i), immutable=True) for i in range(len(dirty))]
+    return self.replace(chord(header, celery_app.signature(STANDING_PUBLISH_STAGE, args=(refresh_id, slug))))
+
+@celery_app.task(name=STANDING_PUBLISH_STAGE, base=ReportResultTask, bind=True)
+def standing_publish_stage(self, written_sections, refresh_id, slug):
+    """يثبّت الحالة الجديدة (والعلامة المائية)، ويعيد تجميع التقرير فقط إن تغيرت محاوره."""
+    _renew_standing_refresh(slug, refresh_id)
+    progress = ReportProgress(self, refresh_id)
+    state, embeddings = standing_topics.load_state(slug, pending=refresh_id)
+    if state is None:
+        # انتهت صلاحية النسخة المعلّقة أو حُذفت: لا يُثبَّت شيء، والحالة المحفوظة تبقى كما هي
+        raise StageFailed(f"الحالة المعلّقة للتحديث {refresh_id} غير موجودة؛ لم تُثبَّت أي تغييرات.")
+    clusters = load_stage(refresh_id, 'clusters', {"topics": []})
+    for topic, content in zip(clusters['topics'], written_sections):
+        state['topics'][topic['id']]['content'] = content
+
+    if not state['topics']:
+        state['report'] = None
+    elif state.pop('changed', False) or not state['report']:
+        progress.stage('assembling')
+        written_topics = {t['title']: t['content'] for t in state['topics'].values()}
+        reference_map = standing_topics.used_reference_map(state)
+        articles_for_citation = [a for a in state['articles'].values() if a.get('url') in reference_map]
+        state['report'] = f"{assemble_final_report(state['query'], written_topics)}{format_references(articles_for_citation, reference_map)}"
+    state['updated_at'] = time.time()
+
+    standing_topics.save_state(slug, state, embeddings)
+    standing_topics.discard_pending(slug, refresh_id)
+    standing_topics.release_refresh_lock(slug, refresh_id)
+
+    articles = list(state['articles'].values())
+    save_report_articles(refresh_id, articles)
+    result = {
+        "summary": state['report'] or "لم يتم العثور على معلومات كافية لبناء تقرير.",
+        "articles": [article_metadata(a) for a in articles],
+        "articles_count": len(articles),
+        "watermark": state['watermark'],
+        "total_time": round(time.time() - load_stage(refresh_id, 'collect')['started_at'], 2)
+    }
+    if state['report']:
+        self.request.publish_report = partial(publish_completed_report, state['query'], state['period_days'], refresh_id)
+    progress.finish(total_time=result['total_time'])
+    return result
+
+# --- فهرس المدوّنة الدائم (corpus_index.py) ---
+
+@celery_app.task(name=CORPUS_COMPACT)
+def corpus_compact_task():
+    """حذف ما خرج من نافذة الاحتفاظ وإعادة بناء الفهرس الأساسي إن كبرت الدلتا."""
+    corpus = corpus_index.get_corpus()
+    return corpus.compact() if corpus else None
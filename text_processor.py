@@ -1,76 +1,173 @@
 # text_processor.py
 # هذا الملف مسؤول عن تنظيف النص الكامل وتجزئته إلى فقرات.
+# التنظيف مرحلة واحدة متدفقة (مولّد) تعمل مباشرة بعد استخراج المحتوى: سطر واحد من النص في كل خطوة،
+# نمط Regex واحد مترجم مسبقًا بدل ثمانية استدعاءات re.sub، ثم حذف "قوالب الموقع" المتعلَّمة:
+# الأسطر التي تتكرر حرفيًا في صفحات كثيرة من نفس الموقع (روابط التنقل، دعوات الاشتراك، حقوق النشر...).
 
 import re
+import hashlib
+from collections.abc import Iterable, Iterator
+from settings import SETTINGS
+from cache_store import PersistentCache
+from url_utils import canonicalize_url, host_of
 
-def clean_text(text: str) -> str:
+_cleaning_cfg = SETTINGS.get('processing', {}).get('cleaning', {})
+MIN_CHUNK_WORDS = _cleaning_cfg.get('min_chunk_words', 10)
+_boilerplate_cfg = _cleaning_cfg.get('boilerplate', {})
+BOILERPLATE_ENABLED = _boilerplate_cfg.get('enabled', True)
+BOILERPLATE_MIN_PAGES = _boilerplate_cfg.get('min_pages', 3)            # سطر في هذا العدد من صفحات الموقع = قالب
+BOILERPLATE_MAX_LINE_CHARS = _boilerplate_cfg.get('max_line_chars', 200)  # الفقرات الطويلة محتوى لا قالب
+BOILERPLATE_MAX_LINES = _boilerplate_cfg.get('max_lines_per_host', 2000)
+BOILERPLATE_MAX_PAGES = _boilerplate_cfg.get('max_pages_per_host', 500)
+
+# أنماط الضوضاء في نمط واحد مترجم مرة واحدة (يُطبّق على كل سطر بعد تجريده من المسافات)
+# يمكن توسيع هذه القائمة بسهولة في المستقبل
+_NOISE_RE = re.compile(
+    r'(?:اقرأ أيضًا|اقرأ أيضا|Read also'     # "اقرأ أيضًا" وأي شيء بعدها في نفس السطر
+    r'|شارك المقال|Share this article'
+    r'|المصدر:|Source:).*'
+    r'|^https?://\S+$',                     # الروابط التي تكون في سطر لوحدها
+    re.IGNORECASE
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# مخزن دائم لإحصاءات الأسطر لكل موقع: مضيف -> {pages: بصمات الصفحات المحسوبة، lines: {بصمة السطر: عدد الصفحات}}
+_boilerplate_store = PersistentCache(
+    'boilerplate_lines',
+    ttl_seconds=_boilerplate_cfg.get('retention_days', 30) * 24 * 3600,
+    max_bytes=_boilerplate_cfg.get('max_mb', 50) * 1024 * 1024
+)
+
+def _line_key(line: str) -> str:
+    """بصمة السطر بعد توحيد المسافات والأحرف: نفس القالب بتنسيق مختلف قليلًا يُعدّ سطرًا واحدًا."""
+    normalized = _WHITESPACE_RE.sub(' ', line).strip().lower()
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+def iter_clean_paragraphs(text: str, boilerplate: frozenset = frozenset()) -> Iterator[str]:
     """
-    تستقبل نصًا وتزيل منه الأنماط غير المرغوب فيها باستخدام Regex.
+    مولّد يمر على النص مرة واحدة ويعيد فقراته النظيفة (غير الفارغة) بالترتيب.
+    boilerplate: بصمات أسطر قوالب الموقع (انظر learn_boilerplate) وتُحذف كما هي.
     """
     if not text:
-        return ""
-
-    # قائمة بالأنماط التي سيتم البحث عنها وحذفها
-    # يمكن توسيع هذه القائمة بسهولة في المستقبل
-    noise_patterns = [
-        r'اقرأ أيضا[^\n]*',      # إزالة "اقرأ أيضًا" وأي شيء بعدها في نفس السطر
-        r'اقرأ أيضًا[^\n]*',     # صيغة أخرى
-        r'Read also[^\n]*',     # النسخة الإنجليزية
-        r'شارك المقال[^\n]*',   # إزالة "شارك المقال"
-        r'Share this article[^\n]*',
-        r'المصدر:[^\n]*',        # إزالة "المصدر:"
-        r'Source:[^\n]*',
-        r'^\s*https?://[^\s]+\s*$', # إزالة الروابط التي تكون في سطر لوحدها
-    ]
-
-    cleaned_text = text
-    for pattern in noise_patterns:
-        # re.IGNORECASE يجعل البحث غير حساس لحالة الأحرف
-        # re.MULTILINE يسمح للنمط ^ بالبحث في بداية كل سطر
-        cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE | re.MULTILINE)
-
-    # إزالة الأسطر الفارغة الزائدة
-    cleaned_text = re.sub(r'\n\s*\n', '\n', cleaned_text)
-    
-    return cleaned_text.strip()
-
-def chunk_text_by_paragraph(text: str) -> list[str]:
+        return
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        line = _NOISE_RE.sub('', line).strip()
+        if not line:
+            continue
+        if boilerplate and len(line) <= BOILERPLATE_MAX_LINE_CHARS and _line_key(line) in boilerplate:
+            continue
+        yield line
+
+def clean_text(text: str, boilerplate: frozenset = frozenset()) -> str:
+    """
+    تستقبل نصًا وتزيل منه الأنماط غير المرغوب فيها والأسطر الفارغة، فقرة في كل سطر.
+    """
+    return '\n'.join(iter_clean_paragraphs(text, boilerplate))
+
+def chunk_text_by_paragraph(text: str, min_words: int = MIN_CHUNK_WORDS) -> list[str]:
     """
     تقسم النص إلى قائمة من الفقرات.
     """
     if not text:
         return []
 
-    # الفقرات غالبًا ما تكون مفصولة بسطرين فارغين (أو أكثر)
+    # بعد clean_text كل فقرة في سطر مستقل
     paragraphs = text.split('\n')
-    
+
     # إزالة أي فقرات فارغة أو تحتوي على مسافات فقط
     # والتأكد من أن طول الفقرة معقول (أكثر من 10 كلمات مثلاً)
-    chunks = [p.strip() for p in paragraphs if p.strip() and len(p.split()) > 10]
-    
+    chunks = [p.strip() for p in paragraphs if p.strip() and len(p.split()) > min_words]
+
     return chunks
 
-def process_and_chunk_articles(articles: list) -> list:
+def _page_key(article: dict) -> str:
+    return hashlib.blake2b(canonicalize_url(article.get('url') or '').encode('utf-8'), digest_size=8).hexdigest()
+
+def _update_host_stats(stats: dict, pages: list[dict]) -> bool:
+    """يضيف أسطر الصفحات الجديدة (كل صفحة تُحسب مرة واحدة مهما تكرر جلبها) إلى إحصاءات الموقع."""
+    seen_pages = stats.setdefault('pages', [])
+    lines = stats.setdefault('lines', {})
+    known = set(seen_pages)
+    changed = False
+    for article in pages:
+        page = _page_key(article)
+        if page in known:
+            continue
+        known.add(page)
+        seen_pages.append(page)
+        changed = True
+        page_lines = {_line_key(line) for line in iter_clean_paragraphs(article['content'])
+                      if len(line) <= BOILERPLATE_MAX_LINE_CHARS}
+        for key in page_lines:
+            # إعادة الإدراج تنقل السطر إلى آخر القاموس: الترتيب = حداثة آخر ظهور
+            lines[key] = lines.pop(key, 0) + 1
+    if not changed:
+        return False
+    del seen_pages[:-BOILERPLATE_MAX_PAGES]
+    if len(lines) > BOILERPLATE_MAX_LINES:
+        # الاحتفاظ بالأكثر تكرارًا، ثم الأحدث ظهورًا بين المتساوين (كي تجد الأسطر الجديدة مكانًا)
+        ranked = sorted(enumerate(lines.items()), key=lambda item: (item[1][1], item[0]), reverse=True)
+        kept = sorted(ranked[:BOILERPLATE_MAX_LINES])
+        stats['lines'] = dict(line for _, line in kept)
+    return True
+
+def learn_boilerplate(articles: list[dict]) -> dict[str, frozenset]:
+    """
+    يحدّث إحصاءات الأسطر لكل موقع من صفحات هذه الدفعة ويعيد {مضيف: بصمات أسطر القوالب}.
+    الدفعة كلها تُقرأ قبل التنظيف، فقوالب الموقع تُحذف حتى من أولى صفحاته في الدفعة.
+    """
+    if not BOILERPLATE_ENABLED:
+        return {}
+    by_host = {}
+    for article in articles:
+        if isinstance(article.get('content'), str) and article.get('url'):
+            by_host.setdefault(host_of(article['url']), []).append(article)
+
+    rules = {}
+    for host, pages in by_host.items():
+        # التحديث ذرّي (قفل الكتابة في SQLite): مراحل استخراج متزامنة لنفس الموقع لا تمحو عدّات بعضها
+        def merge(stats, pages=pages):
+            stats = stats or {}
+            return stats if _update_host_stats(stats, pages) else None
+        stats = _boilerplate_store.update(host, merge, default={}) or {}
+        rules[host] = frozenset(key for key, count in stats.get('lines', {}).items() if count >= BOILERPLATE_MIN_PAGES)
+    return rules
+
+def _host_rules(rules: dict, article: dict) -> frozenset:
+    return rules.get(host_of(article.get('url') or ''), frozenset())
+
+def clean_articles(articles: list[dict]) -> Iterator[dict]:
     """
-    تأخذ قائمة من المقالات، وتنظف وتجزئ محتوى كل مقال.
+    مرحلة التنظيف بعد استخراج المحتوى (مولّد): يعيد كل مقال ومحتواه نظيف، فقرة في كل سطر.
+    ما يليها (ترميز الحذف الدلالي وأوامر استخلاص الحقائق) يعمل على هذا النص الأقصر.
     """
-    processed_articles = []
+    rules = learn_boilerplate(articles)
+    chars_before = chars_after = 0
     for article in articles:
-        # التأكد من أن المحتوى موجود وهو نص
-        if 'content' in article and isinstance(article['content'], str):
-            # 1. تنظيف النص
-            cleaned_content = clean_text(article['content'])
-            # 2. تجزئة النص النظيف إلى فقرات
-            content_chunks = chunk_text_by_paragraph(cleaned_content)
-            
-            # إضافة قائمة المقاطع إلى المقال
-            article['content_chunks'] = content_chunks
-            # يمكننا حذف المحتوى الأصلي لتوفير المساحة
-            # del article['content'] 
+        content = article.get('content')
+        if isinstance(content, str):
+            cleaned = clean_text(content, _host_rules(rules, article))
+            chars_before += len(content)
+            chars_after += len(cleaned)
+            article['content'] = cleaned
+        yield article
+    if chars_before:
+        print(f"التنظيف: {chars_before} ← {chars_after} حرفًا ({100 * (chars_before - chars_after) / chars_before:.0f}% أقل).")
+
+def process_and_chunk_articles(articles: Iterable[dict]) -> list:
+    """
+    تأخذ قائمة من المقالات، وتنظف وتجزئ محتوى كل مقال (content_chunks: الفقرات الأطول من MIN_CHUNK_WORDS).
+    المحتوى الأصلي يبقى كما هو؛ التجزئة فقط تعمل على النص النظيف.
+    """
+    processed_articles = list(articles)
+    rules = learn_boilerplate(processed_articles)
+    for article in processed_articles:
+        content = article.get('content')
+        if isinstance(content, str):
+            article['content_chunks'] = chunk_text_by_paragraph(clean_text(content, _host_rules(rules, article)))
         else:
-            # إذا لم يكن هناك محتوى، أضف قائمة مقاطع فارغة
             article['content_chunks'] = []
-            
-        processed_articles.append(article)
-        
     return processed_articles
@@ -0,0 +1,60 @@
+# url_utils.py
+# أدوات مساعدة للتعامل مع الروابط: توحيد الرابط (canonical) واستخراج اسم المضيف.
+
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+# معاملات التتبع التي لا تغيّر محتوى الصفحة
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid',
+    'ocid', 'cmpid', 'ref', 'ref_src', 'ref_url', 'spm', '_ga', 'smid', 'at_medium', 'at_campaign',
+}
+# بادئات المضيف لنسخ الجوال وAMP من نفس الموقع
+MOBILE_HOST_PREFIXES = ('amp.', 'm.', 'mobile.')
+# معاملات تطلب نسخة AMP من نفس الصفحة (تُحذف فقط إن كانت قيمتها amp أو فارغة)
+AMP_PARAMS = {'amp', 'outputtype', 'output', 'format'}
+
+def host_of(url: str) -> str:
+    try:
+        return urlparse(url).netloc.lower().split(':')[0].removeprefix('www.')
+    except Exception:
+        return 'unknown'
+
+def canonicalize_url(url: str) -> str:
+    """
+    توحيد الرابط ليصبح مفتاحًا ثابتًا لنفس الصفحة:
+    https دائمًا، مضيف بأحرف صغيرة دون www أو بادئات الجوال/AMP، حذف الـ fragment ومعاملات التتبع
+    (utm_* وأمثالها) ومسارات AMP (/amp، ‎.amp)، ترتيب المعاملات المتبقية، وحذف الشرطة المائلة الأخيرة.
+    """
+    if not url:
+        return url
+    try:
+        parsed = urlparse(url.strip())
+    except Exception:
+        return url
+    if not parsed.netloc:
+        return url
+
+    host = parsed.netloc.lower().removeprefix('www.')
+    if host.endswith(':80') or host.endswith(':443'):
+        host = host.rsplit(':', 1)[0]
+    for prefix in MOBILE_HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') >= 2:
+            host = host[len(prefix):]
+            break
+
+    query = [
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if v and not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS
+        and not (k.lower() in AMP_PARAMS and v.lower() == 'amp')
+    ]
+    path = parsed.path or '/'
+    if path.startswith('/amp/'):
+        path = path[4:]
+    if len(path) > 1:
+        path = path.rstrip('/')
+    for suffix in ('/amp', '.amp', '/amp.html'):
+        if path.endswith(suffix):
+            path = path[:-len(suffix)] or '/'
+            break
+
+    return urlunparse(('https', host, path, '', urlencode(sorted(query)), ''))